@@ -239,6 +239,34 @@ public class RAGController : ControllerBase
         }
     }
 
+    [HttpGet("jobs/{jobId}")]
+    public async Task<IActionResult> GetIngestionJob(string jobId)
+    {
+        try
+        {
+            var ragServiceUrl = GetRAGServiceUrl();
+            var client = _httpClientFactory.CreateClient();
+            var response = await client.GetAsync($"{ragServiceUrl}/jobs/{jobId}");
+            
+            if (response.IsSuccessStatusCode)
+            {
+                var content = await response.Content.ReadAsStringAsync();
+                return Ok(JsonSerializer.Deserialize<object>(content));
+            }
+            else
+            {
+                var errorContent = await response.Content.ReadAsStringAsync();
+                _logger.LogError("Error getting ingestion job: {Error}", errorContent);
+                return StatusCode((int)response.StatusCode, errorContent);
+            }
+        }
+        catch (Exception ex)
+        {
+            _logger.LogError(ex, "Error getting ingestion job");
+            return StatusCode(500, "Error interno del servidor");
+        }
+    }
+
     [HttpGet("projects/{projectId}/documents")]
     public async Task<IActionResult> GetProjectDocuments(int projectId)
     {
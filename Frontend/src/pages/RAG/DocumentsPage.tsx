@@ -1,6 +1,7 @@
 import { useState, useEffect } from 'react'
 import { Upload, FileText, Trash2, Loader2, AlertCircle, CheckCircle2, Download } from 'lucide-react'
 import { apiService } from '../../services/api.service'
+import type { RAGIngestionJob } from '../../types'
 
 interface Document {
     id: number
@@ -15,6 +16,7 @@ export default function DocumentsPage() {
     const [documents, setDocuments] = useState<Document[]>([])
     const [isLoading, setIsLoading] = useState(false)
     const [isUploading, setIsUploading] = useState(false)
+    const [uploadProgress, setUploadProgress] = useState<string | null>(null)
     const [error, setError] = useState<string | null>(null)
     const [success, setSuccess] = useState<string | null>(null)
     const [projectIdFilter, setProjectIdFilter] = useState<number | undefined>(undefined)
@@ -68,12 +70,20 @@ export default function DocumentsPage() {
         setSuccess(null)
 
         try {
-            await apiService.uploadDocument(
+            const upload = await apiService.uploadDocument(
                 selectedFile,
                 uploadProjectId,
                 documentType
             )
 
+            // El documento se procesa en segundo plano: esperar a que el trabajo termine
+            const job = await apiService.waitForIngestionJob(upload.job_id, (current) =>
+                setUploadProgress(describeJob(current))
+            )
+            if (job.status === 'failed') {
+                throw new Error(job.error || 'Error al procesar el documento')
+            }
+
             setSuccess(`Documento "${selectedFile.name}" subido exitosamente`)
             setSelectedFile(null)
             setUploadProjectId(undefined)
@@ -92,9 +102,16 @@ export default function DocumentsPage() {
             setError(err instanceof Error ? err.message : 'Error al subir el documento')
         } finally {
             setIsUploading(false)
+            setUploadProgress(null)
         }
     }
 
+    const describeJob = (job: RAGIngestionJob) => {
+        if (job.status === 'queued') return 'En cola...'
+        if (job.status === 'parsing') return `Leyendo páginas ${job.pages_parsed ?? 0}/${job.pages_total ?? 0}...`
+        return `Procesando fragmentos ${job.chunks_written ?? 0}/${job.chunks_total ?? 0}...`
+    }
+
     const handleDelete = async (documentId: number) => {
         if (!confirm('¿Estás seguro de eliminar este documento?')) {
             return
@@ -265,7 +282,7 @@ export default function DocumentsPage() {
                             {isUploading ? (
                                 <>
                                     <Loader2 className="w-5 h-5 animate-spin" />
-                                    Subiendo...
+                                    {uploadProgress ?? 'Subiendo...'}
                                 </>
                             ) : (
                                 <>
@@ -13,6 +13,7 @@ import type {
     RAGQueryRequest,
     RAGQueryResponse,
     RAGBudgetGenerationRequest,
+    RAGIngestionJob,
     BackendObjective,
 } from '../types'
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:5043/api'
@@ -681,13 +682,15 @@ class ApiService {
     }
 
     /**
-     * Sube un documento para RAG
+     * Sube un documento para RAG. El servicio responde 202 con el trabajo de
+     * ingesta: el documento aparece en el listado cuando el trabajo termina
+     * (ver waitForIngestionJob)
      */
     async uploadDocument(
         file: File,
         projectId?: number,
         documentType: string = 'project_document'
-    ): Promise<any> {
+    ): Promise<RAGIngestionJob> {
         const formData = new FormData()
         formData.append('file', file)
         if (projectId) {
@@ -698,12 +701,42 @@ class ApiService {
         const response = await fetch(`${API_URL}/rag/documents/upload`, {
             method: 'POST',
             headers: {
-                Authorization: `Bearer ${this.getToken()}`,
+                Authorization: `Bearer ${this.getAuthToken()}`,
             },
             body: formData,
         })
 
-        return await this.handleResponse<any>(response)
+        return await this.handleResponse<RAGIngestionJob>(response)
+    }
+
+    /**
+     * Obtiene el estado de un trabajo de ingesta
+     */
+    async getIngestionJob(jobId: string): Promise<RAGIngestionJob> {
+        const response = await fetch(`${API_URL}/rag/jobs/${jobId}`, {
+            method: 'GET',
+            headers: this.getHeaders(),
+        })
+
+        return await this.handleResponse<RAGIngestionJob>(response)
+    }
+
+    /**
+     * Consulta un trabajo de ingesta hasta que termina (completed o failed)
+     */
+    async waitForIngestionJob(
+        jobId: string,
+        onProgress?: (job: RAGIngestionJob) => void,
+        intervalMs: number = 1000
+    ): Promise<RAGIngestionJob> {
+        for (;;) {
+            const job = await this.getIngestionJob(jobId)
+            onProgress?.(job)
+            if (job.status === 'completed' || job.status === 'failed') {
+                return job
+            }
+            await new Promise((resolve) => setTimeout(resolve, intervalMs))
+        }
     }
 
     /**
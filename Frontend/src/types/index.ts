@@ -460,6 +460,22 @@ export interface RAGQueryResponse {
     }>
 }
 
+export type RAGIngestionJobStatus = 'queued' | 'parsing' | 'embedding' | 'completed' | 'failed'
+
+// Trabajo de ingesta: el servicio RAG procesa los documentos subidos en segundo plano
+export interface RAGIngestionJob {
+    job_id: string
+    status: RAGIngestionJobStatus
+    filename: string
+    document_id?: string | null
+    error?: string | null
+    pages_total?: number
+    pages_parsed?: number
+    chunks_total?: number
+    chunks_embedded?: number
+    chunks_written?: number
+}
+
 export interface RAGBudgetGenerationRequest {
     projectId: number
     projectDescription: string
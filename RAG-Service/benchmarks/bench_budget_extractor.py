@@ -0,0 +1,294 @@
+"""
+Benchmark de BudgetExtractor: extracción fila por fila (df.iterrows + una
+corrutina por fila + _safe_numeric con re.sub, copia de la implementación
+anterior que se conserva aquí como referencia) contra la extracción por
+columnas que usa ahora `_extract_activities_from_dataframe`.
+
+Genera hojas de presupuesto sintéticas con las irregularidades habituales
+(valores como texto con "$" y separadores, filas vacías, encabezados
+repetidos, subtotales, cantidades inválidas) y compara ambos caminos fila a
+fila. Las únicas diferencias admitidas son las de INTENTIONAL_DIFFERENCES
+(cifras que la limpieza anterior leía mal); cualquier otra hace fallar el
+benchmark.
+
+Uso:
+    python benchmarks/bench_budget_extractor.py --rows 5000 10000 20000
+    python benchmarks/bench_budget_extractor.py --xlsx Presupuesto.xlsx
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import re
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.budget_extractor import BudgetExtractor  # noqa: E402
+
+CONCEPTOS = [
+    "Profesional investigador", "Licencia de software", "Computador portátil", "Reactivos de laboratorio",
+    "Taller de capacitación", "Tiquetes aéreos", "Servicio de consultoría", "Papelería", "Hospedaje",
+]
+
+
+def _money(value: float, rng: random.Random):
+    # Mezcla de celdas numéricas y de texto con formatos colombianos
+    style = rng.randrange(4)
+    if style == 0:
+        return value
+    if style == 1:
+        return f"${value:,.0f}"
+    if style == 2:
+        return f"{value:,.0f}".replace(",", ".")
+    return f"$ {value:,.2f}"
+
+
+def generate_sheet(rows: int, seed: int = 7) -> pd.DataFrame:
+    rng = random.Random(seed)
+    data = []
+    for i in range(rows):
+        kind = rng.random()
+        if kind < 0.03:
+            data.append([None, None, None, None, None, None])
+            continue
+        if kind < 0.05:
+            data.append(["SUBTOTAL", None, None, None, rng.randint(1, 10**8), None])
+            continue
+        if kind < 0.06:
+            data.append(["Actividad", "Rubro", "Cantidad", "Valor Unitario", "Total", "Justificación"])
+            continue
+        cantidad = rng.choice([rng.randint(1, 24), rng.randint(1, 24), 0, "dos"]) if kind < 0.1 else rng.randint(1, 24)
+        unitario = rng.randint(10, 20000) * 1000
+        total = unitario * cantidad if isinstance(cantidad, int) else None
+        data.append([
+            f"{rng.choice(CONCEPTOS)} {i}",
+            rng.choice(["Talento humano", "Equipos", "Materiales", "Viajes", None]),
+            cantidad,
+            _money(unitario, rng),
+            _money(total, rng) if total else None,
+            rng.choice(["", "Requerido para el objetivo 1", None]),
+        ])
+    return pd.DataFrame(data, columns=["Actividad", "Rubro", "Cantidad", "Valor Unitario", "Total", "Justificación"])
+
+
+# Diferencias intencionales entre la lectura de cifras anterior (_safe_numeric con
+# re.sub) y services/number_parser.py. Una fila que cambia de resultado debe
+# tener al menos una celda numérica en alguno de estos formatos, leída distinto
+# por los dos caminos; cualquier otra diferencia es una regresión.
+INTENTIONAL_DIFFERENCES = [
+    (re.compile(r"^\$?\s*-?\d{1,3}(\.\d{3})+$"),
+     "miles con punto (1.250.000): antes float() fallaba y la celda contaba como vacía"),
+    (re.compile(r"^\$?\s*-?\d{1,3}(,\d{3})+$"),
+     "miles con coma sin decimales (1,250 / 1,250,000): antes se leía 1.25 o la celda contaba como vacía"),
+    (re.compile(r"^\$?\s*-?\d{1,3}(\.\d{3})+,\d+$"),
+     "decimal con coma y miles con punto (1.250,50): antes se quitaba la coma y quedaba 1.25050"),
+]
+NUMERIC_FIELDS = ("cantidad", "valor_unitario", "total", "periodo")
+
+
+async def extract_activities_rowwise(extractor: BudgetExtractor, df: pd.DataFrame,
+                                     sheet_name: str) -> List[Dict[str, Any]]:
+    """Extracción fila por fila: copia de la implementación anterior (referencia)"""
+    activities = []
+    column_mapping = extractor._map_columns(df)
+
+    for idx, row in df.iterrows():
+        # Saltar filas vacías o de encabezado adicional
+        if is_empty_or_header_row(extractor, row, column_mapping):
+            continue
+
+        activity = await extract_activity_from_row(extractor, row, column_mapping, sheet_name)
+        if activity:
+            activity["source_row"] = int(idx) + 2
+            activities.append(activity)
+
+    return activities
+
+
+def is_empty_or_header_row(extractor: BudgetExtractor, row: pd.Series, column_mapping: Dict[str, str]) -> bool:
+    """Verificar si una fila está vacía o es un encabezado adicional"""
+    if "actividad" in column_mapping:
+        value = row[column_mapping["actividad"]]
+        if pd.isna(value) or str(value).strip() == "":
+            return True
+
+        # Encabezado repetido o fila de totales/notas
+        value_lower = str(value).lower().strip()
+        if any(header in value_lower for header in ["actividad", "descripción", "descripcion", "item", "ítem"]):
+            return True
+        if any(keyword in value_lower for keyword in extractor.ignore_keywords):
+            return True
+
+    return False
+
+
+def legacy_safe_numeric(value: Any, default: Optional[float] = None) -> Optional[float]:
+    """_safe_numeric anterior: limpieza con re.sub, sin inferir el separador decimal"""
+    if pd.isna(value):
+        return default
+
+    try:
+        if isinstance(value, str):
+            cleaned = re.sub(r'[^\d.,\-]', '', value)
+            if ',' in cleaned and '.' not in cleaned:
+                cleaned = cleaned.replace(',', '.')
+            elif ',' in cleaned and '.' in cleaned:
+                cleaned = cleaned.replace(',', '')
+            return float(cleaned) if cleaned else default
+
+        return float(value)
+    except (ValueError, TypeError):
+        return default
+
+
+async def extract_activity_from_row(extractor: BudgetExtractor, row: pd.Series, column_mapping: Dict[str, str],
+                                    sheet_name: str) -> Optional[Dict[str, Any]]:
+    """Extraer la actividad de una fila, con validación estricta de cantidad y valor unitario"""
+    try:
+        activity = {}
+        if "actividad" not in column_mapping:
+            return None
+        nombre = str(row[column_mapping["actividad"]])
+        if not nombre.strip():
+            return None
+        activity["nombre"] = nombre.strip()
+
+        # Prioridad del rubro: columna > nombre > hoja
+        rubro_from_column = None
+        if "rubro" in column_mapping:
+            rubro_value = row[column_mapping["rubro"]]
+            if pd.notna(rubro_value):
+                rubro_from_column = extractor.identify_rubro_from_text(str(rubro_value))
+        activity["rubro"] = (rubro_from_column or extractor.identify_rubro_from_text(activity["nombre"])
+                             or extractor.identify_rubro_from_text(sheet_name) or "Otros")
+
+        if "cantidad" in column_mapping:
+            cantidad = legacy_safe_numeric(row[column_mapping["cantidad"]])
+            if cantidad is None or cantidad <= 0:
+                return None
+            activity["cantidad"] = cantidad
+        else:
+            activity["cantidad"] = 1
+
+        if "valor_unitario" not in column_mapping:
+            return None
+        valor_unitario = legacy_safe_numeric(row[column_mapping["valor_unitario"]])
+        if valor_unitario is None or valor_unitario <= 0:
+            return None
+        activity["valor_unitario"] = valor_unitario
+
+        if "total" in column_mapping:
+            activity["total"] = legacy_safe_numeric(row[column_mapping["total"]], 0)
+        else:
+            activity["total"] = activity["valor_unitario"] * activity["cantidad"]
+
+        for key, field in (("justificacion", "justificacion"), ("especificaciones", "especificaciones_tecnicas")):
+            value = row[column_mapping[key]] if key in column_mapping else None
+            activity[field] = str(value) if value is not None and pd.notna(value) else ""
+
+        if "periodo" in column_mapping:
+            activity["periodo"] = legacy_safe_numeric(row[column_mapping["periodo"]], 1)
+        else:
+            activity["periodo"] = 1
+
+        activity["source_sheet"] = sheet_name
+        activity["has_budget_values"] = activity["total"] is not None and activity["total"] > 0
+        return activity
+
+    except Exception:
+        return None
+
+
+def intentional_reason(value: Any) -> Optional[str]:
+    if isinstance(value, str):
+        for pattern, reason in INTENTIONAL_DIFFERENCES:
+            if pattern.match(value.strip()):
+                return reason
+    return None
+
+
+def explain_difference(df: pd.DataFrame, column_mapping: Dict[str, str], source_row: int,
+                       legacy: Optional[Dict[str, Any]], current: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Diferencia intencional que explica el cambio de una fila, o None si no hay ninguna"""
+    row = df.iloc[source_row - 2]
+    if legacy is None or current is None:
+        # Fila descartada por un solo camino: cantidad o valor unitario leídos distinto
+        keys = [key for key in ("cantidad", "valor_unitario") if key in column_mapping]
+    else:
+        # Solo pueden cambiar las cifras (y lo que se deriva de ellas), y cada cifra
+        # distinta debe venir de una celda en un formato de INTENTIONAL_DIFFERENCES
+        derived = set(NUMERIC_FIELDS) | {"has_budget_values"}
+        if any(legacy[key] != current[key] for key in legacy if key not in derived):
+            return None
+        keys = [key for key in NUMERIC_FIELDS if key in column_mapping and legacy[key] != current[key]]
+        if not keys or any(intentional_reason(row[column_mapping[key]]) is None for key in keys):
+            return None
+    reasons = [intentional_reason(row[column_mapping[key]]) for key in keys]
+    return next((reason for reason in reasons if reason is not None), None)
+
+
+def compare(extractor: BudgetExtractor, df: pd.DataFrame, sheet_name: str):
+    start = time.perf_counter()
+    rowwise = asyncio.run(extract_activities_rowwise(extractor, df, sheet_name))
+    rowwise_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    columnar = extractor._extract_activities_from_dataframe(df, sheet_name)
+    columnar_seconds = time.perf_counter() - start
+
+    column_mapping = extractor._map_columns(df)
+    legacy_by_row = {activity["source_row"]: activity for activity in rowwise}
+    current_by_row = {activity["source_row"]: activity for activity in columnar}
+    differences: Dict[str, int] = {}
+    for source_row in sorted(legacy_by_row.keys() | current_by_row.keys()):
+        legacy, current = legacy_by_row.get(source_row), current_by_row.get(source_row)
+        if legacy == current:
+            continue
+        reason = explain_difference(df, column_mapping, source_row, legacy, current)
+        if reason is None:
+            raise SystemExit(
+                f"Diferencia no prevista en '{sheet_name}', fila {source_row}:\n  antes: {legacy}\n  ahora: {current}"
+            )
+        differences[reason] = differences.get(reason, 0) + 1
+    return len(columnar), rowwise_seconds, columnar_seconds, differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[5000, 10000, 20000])
+    parser.add_argument("--xlsx", help="Medir las hojas de presupuesto de un libro real")
+    args = parser.parse_args()
+
+    extractor = BudgetExtractor()
+    if args.xlsx:
+        with pd.ExcelFile(args.xlsx) as excel_file:
+            sheets = [(name, pd.read_excel(excel_file, sheet_name=name)) for name in excel_file.sheet_names]
+        sheets = [(name, df) for name, df in sheets if extractor._is_budget_sheet(df)]
+    else:
+        sheets = [(f"Presupuesto {rows}", generate_sheet(rows)) for rows in args.rows]
+
+    print(f"{'Hoja':<24}{'filas':>8}{'actividades':>13}{'fila a fila':>14}{'columnas':>12}{'speedup':>10}")
+    all_differences: Dict[str, int] = {}
+    for name, df in sheets:
+        activities, rowwise_seconds, columnar_seconds, differences = compare(extractor, df, name)
+        print(f"{str(name)[:23]:<24}{len(df):>8}{activities:>13}{rowwise_seconds * 1000:>12.1f}ms"
+              f"{columnar_seconds * 1000:>10.1f}ms{rowwise_seconds / columnar_seconds:>9.1f}x")
+        for reason, count in differences.items():
+            all_differences[reason] = all_differences.get(reason, 0) + count
+
+    if not all_differences:
+        print("\nAmbos caminos devolvieron las mismas actividades.")
+        return
+    print("\nFilas con resultado distinto, todas por diferencias intencionales del parser de cifras:")
+    for reason, count in all_differences.items():
+        print(f"  {count:>7}  {reason}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Benchmark de la lectura de Excel de CotizacionService.
+
+Compara la lectura anterior (cada hoja leída dos veces: sin encabezado para
+buscarlo fila por fila en toda la hoja y otra vez con `header=`, y mapeo de
+ítems con df.iterrows) contra `_leer_y_validar_excel`, que lee cada hoja una
+sola vez, busca el encabezado en las primeras filas, mapea los ítems por
+columnas y procesa las hojas en paralelo. Comprueba que ambos caminos
+devuelven los mismos ítems.
+
+Uso:
+    python benchmarks/bench_cotizacion_excel.py --rows 2000 --sheets 8
+    python benchmarks/bench_cotizacion_excel.py --xlsx Presupuesto_SGR.xlsx
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import warnings
+
+import pandas as pd
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.cotizacion_service import CotizacionService  # noqa: E402
+from services.number_parser import parse_number_series  # noqa: E402
+from services.price_catalog import PriceCatalog  # noqa: E402
+
+HOJAS_SGR = [
+    ("01. Talento Humano", "CARGO ESPECÍFICO"),
+    ("02. Equipos y Software", "EQUIPOS Y SOFTWARE (DESCRIPCIÓN)"),
+    ("03. Capacitación y Eventos", "CAPACITACIÓN Y EVENTOS (DESCRIPCIÓN)"),
+    ("04. Servicios Tecnológicos", "SERVICIOS TECNOLÓGICOS (DESCRIPCIÓN)"),
+    ("05. Materiales, insumos y Doc", "MATERIALES E INSUMOS (DESCRIPCIÓN)"),
+    ("06. Protección conocimiento y Di", "PROTECCIÓN CONOCIMIENTO Y DIFUSIÓN (DESCRIPCIÓN)"),
+    ("07. Gastos de viaje", "GASTOS DE VIAJE (DESCRIPCIÓN)"),
+    ("11. Otros", "OTROS (DESCRIPCIÓN)"),
+]
+
+
+def generate_workbook(path: str, rows: int, sheets: int, seed: int = 11):
+    """Libro con formato SGR: portada, títulos sobre el encabezado, ítems, subtotales y valores como texto"""
+    rng = random.Random(seed)
+    workbook = Workbook()
+    portada = workbook.active
+    portada.title = "Portada"
+    portada.append(["Proyecto de inversión - Sistema General de Regalías"])
+    for index in range(sheets):
+        name, desc = HOJAS_SGR[index % len(HOJAS_SGR)]
+        sheet = workbook.create_sheet(name if index < len(HOJAS_SGR) else f"{name} {index}")
+        sheet.append(["PRESUPUESTO DETALLADO"])
+        sheet.append([f"Rubro: {name}"])
+        sheet.append([])
+        sheet.append(["ACTIVIDAD", desc, "OBSERVACIONES", "CANTIDAD", "VALOR UNITARIO", "VALOR TOTAL"])
+        for i in range(rows):
+            kind = rng.random()
+            if kind < 0.03:
+                sheet.append(["Subtotal actividad", None, None, None, None, rng.randint(1, 10**8)])
+                continue
+            cantidad = rng.choice([rng.randint(1, 24), "2", None, 0]) if kind < 0.1 else rng.randint(1, 24)
+            unitario = rng.randint(10, 20000) * 1000
+            unitario = rng.choice([unitario, f"$ {unitario:,.0f}".replace(",", "."), None])
+            descripcion = rng.choice([f"Ítem {i}", f"Ítem {i}", str(i % 100), None])
+            sheet.append([
+                f"Actividad {i % 40}", descripcion,
+                rng.choice([None, "Requerido para el objetivo 1", "123"]), cantidad, unitario, None,
+            ])
+    workbook.create_sheet("RESUMEN").append(["Rubro", "Total"])
+    workbook.save(path)
+
+
+def legacy_leer_excel(service: CotizacionService, file_path: str):
+    """Lectura anterior: dos lecturas por hoja, búsqueda del encabezado en toda la hoja y df.iterrows"""
+    todos_los_items = []
+    with pd.ExcelFile(file_path) as excel_file:
+        for sheet_name in excel_file.sheet_names:
+            df_raw = pd.read_excel(excel_file, sheet_name=sheet_name, header=None)
+            header_idx = None
+            for idx, row in df_raw.iterrows():
+                valores = [str(c).strip().lower() for c in row.values if pd.notna(c)]
+                if (any("actividad" in v for v in valores) and any("cantidad" in v for v in valores)
+                        and any("valor unitario" in v or "v. unitario" in v or "costo unitario" in v
+                                or "precio unitario" in v for v in valores)):
+                    header_idx = idx
+                    break
+            if header_idx is None:
+                continue
+            df = pd.read_excel(excel_file, sheet_name=sheet_name, header=header_idx)
+            df.columns = df.columns.str.strip().str.upper()
+            req = ["ACTIVIDAD", "CANTIDAD", "VALOR UNITARIO"]
+            if any(c not in df.columns for c in req):
+                continue
+            item_col = service.hoja_a_desc.get(sheet_name)
+            if item_col is None or item_col not in df.columns:
+                for col in df.columns:
+                    if any(k in col.lower() for k in ["descripción", "descripcion", "concepto", "item", "servicio"]):
+                        item_col = col
+                        break
+            if item_col is None:
+                item_col = "ACTIVIDAD"
+            df = df[~df["ACTIVIDAD"].astype(str).str.lower().str.contains(
+                "|".join(service.ignore_keywords), na=False, regex=True)]
+            cantidades = parse_number_series(df["CANTIDAD"])
+            valores_unitarios = parse_number_series(df["VALOR UNITARIO"])
+            for idx, row in df.iterrows():
+                actividad = str(row["ACTIVIDAD"]).strip() if pd.notna(row["ACTIVIDAD"]) else ""
+                item_desc = ""
+                if item_col in row.index and pd.notna(row[item_col]):
+                    item_desc = str(row[item_col]).strip()
+                if not item_desc or (item_desc.isdigit() and len(item_desc) < 5):
+                    columnas_alternativas = [
+                        c for c in df.columns
+                        if c not in req + ["VALOR TOTAL", "TOTAL", "SUBTOTAL", "JUSTIFICACIÓN", "JUSTIFICACION"]
+                        and c != item_col and not str(c).strip().isdigit()
+                        and not str(c).lower().startswith("unnamed")
+                    ]
+                    for col_alt in columnas_alternativas:
+                        if pd.notna(row[col_alt]):
+                            valor_alt_str = str(row[col_alt]).strip()
+                            if len(valor_alt_str) > 3 and not valor_alt_str.replace(".", "").replace(",", "").isdigit():
+                                item_desc = valor_alt_str
+                                break
+                if not item_desc or (item_desc.isdigit() and len(item_desc) < 5):
+                    item_desc = actividad
+                if not item_desc:
+                    continue
+                cantidad, valor_unitario = cantidades[idx], valores_unitarios[idx]
+                necesita_estimacion = False
+                if pd.isna(cantidad) or cantidad <= 0:
+                    cantidad, necesita_estimacion = 1.0, True
+                if pd.isna(valor_unitario) or valor_unitario <= 0:
+                    valor_unitario, necesita_estimacion = 0.0, True
+                todos_los_items.append({
+                    "actividad": actividad,
+                    "item": item_desc,
+                    "cantidad": float(cantidad),
+                    "valor_unitario": float(valor_unitario),
+                    "valor_total": float(cantidad * valor_unitario if valor_unitario > 0 else 0.0),
+                    "hoja_origen": sheet_name,
+                    "necesita_estimacion": necesita_estimacion,
+                })
+    return todos_los_items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000, help="Ítems por hoja")
+    parser.add_argument("--sheets", type=int, default=8)
+    parser.add_argument("--xlsx", help="Medir un libro real en lugar de uno generado")
+    args = parser.parse_args()
+    # El nombre oficial de la hoja 06 supera los 31 caracteres que recomienda openpyxl
+    warnings.filterwarnings("ignore", message="Title is more than 31 characters")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Catálogo de precios aislado: la lectura del Excel no lo usa
+        service = CotizacionService(price_catalog=PriceCatalog(os.path.join(tmp, "price_catalog.db")))
+        path = args.xlsx
+        if not path:
+            path = os.path.join(tmp, "presupuesto_sgr.xlsx")
+            generate_workbook(path, args.rows, args.sheets)
+
+        start = time.perf_counter()
+        legacy = legacy_leer_excel(service, path)
+        legacy_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        current = asyncio.run(service._leer_y_validar_excel(path))
+        current_seconds = time.perf_counter() - start
+
+    if legacy != current:
+        mismatches = [i for i, (a, b) in enumerate(zip(legacy, current)) if a != b]
+        raise SystemExit(f"Ítems distintos: {len(legacy)} vs {len(current)}, primeras diferencias en {mismatches[:5]}")
+
+    print(f"Ítems: {len(current)}")
+    print(f"Lectura anterior:  {legacy_seconds * 1000:10.1f} ms")
+    print(f"Lectura actual:    {current_seconds * 1000:10.1f} ms")
+    print(f"Speedup:           {legacy_seconds / current_seconds:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Benchmark de recuperación híbrida (services/lexical_index.py).
+
+Genera un proyecto sintético con chunks de presupuesto casi idénticos que solo
+se distinguen por términos exactos (cargo, código de objetivo "OE2", rubro,
+monto) mezclados con chunks narrativos, y preguntas cuya respuesta está en un
+único chunk. Para cada camino mide recall@k (la fracción de preguntas cuyo
+chunk aparece entre los k primeros) con k = 1, 3, 5, 10, 20:
+
+- vectorial: similitud coseno con el modelo de embeddings del servicio;
+- BM25: LexicalIndex.search;
+- híbrido: hybrid_scores con RAG_LEXICAL_WEIGHT sobre los candidatos de ambos.
+
+La tabla permite elegir el k más pequeño con la misma calidad que la búsqueda
+vectorial con k grande (menos contexto para el LLM). Sin sentence_transformers
+instalado solo se mide BM25.
+
+Uso:
+    python benchmarks/bench_hybrid_retrieval.py --chunks 2000 --queries 300
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.lexical_index import LexicalIndex, hybrid_scores  # noqa: E402
+
+KS = [1, 3, 5, 10, 20]
+
+RUBROS = ["Talento Humano", "Equipos y Software", "Servicios Tecnológicos", "Materiales e Insumos",
+          "Capacitación y Eventos", "Gastos de Viaje"]
+CARGOS = ["Profesional especializado en bioinformática", "Investigador principal", "Coordinador de campo",
+          "Ingeniero de software", "Técnico de laboratorio", "Auxiliar administrativo", "Estadístico",
+          "Médico epidemiólogo", "Enfermera jefe", "Analista de datos", "Asesor jurídico", "Comunicador social"]
+NARRATIVA = ("El proyecto fortalece la capacidad regional de investigación en salud pública mediante "
+             "telemedicina, modelos predictivos y formación de talento humano en los municipios priorizados "
+             "con enfoque diferencial y apropiación social del conocimiento").split()
+
+
+def generate_corpus(chunks: int, seed: int):
+    """Chunks (id, texto) y preguntas (texto, id del único chunk que la responde)"""
+    rng = random.Random(seed)
+    corpus, items = [], []
+    for i in range(chunks):
+        chunk_id = f"doc{i % 7}_chunk_{i}"
+        if rng.random() < 0.6:
+            cargo, objetivo = rng.choice(CARGOS), f"OE{rng.randint(1, 9)}"
+            total = rng.randint(10, 900) * 1_000_000 + rng.randint(1, 999) * 1000
+            text = (f"Rubro: {rng.choice(RUBROS)}. Cargo: {cargo} para el objetivo específico {objetivo}. "
+                    f"Dedicación de {rng.randint(3, 36)} meses, valor total $ {total:,} COP.").replace(",", ".")
+            items.append((chunk_id, cargo, objetivo, total))
+        else:
+            text = " ".join(rng.choice(NARRATIVA) for _ in range(rng.randint(40, 120))).capitalize() + "."
+        corpus.append((chunk_id, text))
+
+    # Solo preguntas con una única respuesta: combinación cargo/objetivo o monto irrepetidos
+    combos = Counter((cargo, objetivo) for _, cargo, objetivo, _ in items)
+    totals = Counter(total for _, _, _, total in items)
+    queries = []
+    for chunk_id, cargo, objetivo, total in items:
+        if combos[(cargo, objetivo)] == 1 and rng.random() < 0.5:
+            queries.append((f"¿Cuál es el valor del {cargo.lower()} del {objetivo}?", chunk_id))
+        elif totals[total] == 1:
+            queries.append((f"¿Qué ítem del presupuesto vale $ {total:,}?".replace(",", "."), chunk_id))
+    rng.shuffle(queries)
+    return corpus, queries
+
+
+def recall_at_k(rankings, relevant):
+    hits = {k: 0 for k in KS}
+    for ranking, target in zip(rankings, relevant):
+        for k in KS:
+            hits[k] += target in ranking[:k]
+    return {k: hits[k] / len(relevant) for k in KS}
+
+
+def load_encoder():
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        print("sentence_transformers no está instalado: solo se mide BM25\n")
+        return None
+    return SentenceTransformer(os.getenv("EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2"))
+
+
+def normalized(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--lexical-weight", type=float, default=float(os.getenv("RAG_LEXICAL_WEIGHT", "0.3")))
+    args = parser.parse_args()
+
+    corpus, queries = generate_corpus(args.chunks, seed=7)
+    queries = queries[:args.queries]
+    relevant = [target for _, target in queries]
+    ids = [chunk_id for chunk_id, _ in corpus]
+    positions = {chunk_id: i for i, chunk_id in enumerate(ids)}
+    candidates = max(KS)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = LexicalIndex(os.path.join(tmp, "lexical_index.db"))
+        start = time.perf_counter()
+        index.add_chunks(1, "bench", corpus)
+        print(f"Indexación BM25: {len(corpus)} chunks en {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        lexical = [dict(index.search(question, 1, candidates)) for question, _ in queries]
+        elapsed = time.perf_counter() - start
+        print(f"Búsqueda BM25: {elapsed / len(queries) * 1000:.2f} ms por consulta\n")
+        index.close()
+
+    results = {"bm25": recall_at_k([list(scores) for scores in lexical], relevant)}
+
+    encoder = load_encoder()
+    if encoder is not None:
+        chunk_vectors = normalized(np.asarray(encoder.encode([text for _, text in corpus], batch_size=64)))
+        query_vectors = normalized(np.asarray(encoder.encode([question for question, _ in queries], batch_size=64)))
+        similarities = query_vectors @ chunk_vectors.T
+        vector_rankings, hybrid_rankings = [], []
+        for row, scores in zip(similarities, lexical):
+            top = np.argsort(-row)[:candidates]
+            vector = {ids[i]: float(row[i]) for i in top}
+            vector_rankings.append(list(vector))
+            # Los candidatos léxicos que no trajo la búsqueda vectorial usan su similitud real
+            vector.update({chunk_id: float(row[positions[chunk_id]]) for chunk_id in scores if chunk_id not in vector})
+            fused = hybrid_scores(vector, scores, args.lexical_weight)
+            hybrid_rankings.append(sorted(fused, key=lambda chunk_id: -fused[chunk_id]))
+        results["vectorial"] = recall_at_k(vector_rankings, relevant)
+        results[f"híbrido (w={args.lexical_weight:g})"] = recall_at_k(hybrid_rankings, relevant)
+
+    print(f"{'camino':<20}" + "".join(f"{f'R@{k}':>8}" for k in KS))
+    for name, recall in results.items():
+        print(f"{name:<20}" + "".join(f"{recall[k]:>8.1%}" for k in KS))
+
+    if "vectorial" in results:
+        target = results["vectorial"][max(KS)]
+        hybrid = next(value for name, value in results.items() if name.startswith("híbrido"))
+        smallest = next((k for k in KS if hybrid[k] >= target), None)
+        if smallest is not None:
+            print(f"\nEl híbrido alcanza con k={smallest} el recall vectorial con k={max(KS)} ({target:.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmark del parser de cifras COP (services/number_parser.py).
+
+Genera columnas de cifras conocidas escritas en los formatos que aparecen en
+los libros de presupuesto ("$ 1.234.567", "1,234,567.89", "(1.500)",
+"COP 3.000.000", "1'500.000"...) y mide:
+
+- celdas/segundo de `parse_number` (celda a celda), de `parse_number_series`
+  (Series y arreglo numpy de objetos) y de la limpieza con re.sub que usaban
+  antes el extractor y la cotización;
+- exactitud contra el valor original de cada camino.
+
+Las propiedades (ida y vuelta formato -> parser, acuerdo celda/columna) se
+verifican con este mismo generador en tests/test_number_parser.py.
+
+Uso:
+    python benchmarks/bench_number_parser.py --cells 200000
+"""
+
+import argparse
+import math
+import os
+import random
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.number_parser import infer_decimal_separator, parse_number, parse_number_series  # noqa: E402
+
+
+def legacy_safe_numeric(value):
+    """Limpieza anterior de BudgetExtractor/CotizacionService._safe_numeric"""
+    if pd.isna(value):
+        return None
+    try:
+        if isinstance(value, str):
+            cleaned = re.sub(r'[^\d.,\-]', '', value)
+            if ',' in cleaned and '.' not in cleaned:
+                cleaned = cleaned.replace(',', '.')
+            elif ',' in cleaned and '.' in cleaned:
+                cleaned = cleaned.replace(',', '')
+            return float(cleaned) if cleaned else None
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def _group(integer: int, separator: str) -> str:
+    return f"{integer:,}".replace(",", separator)
+
+
+def format_cop(value: float, style: str, rng: random.Random) -> str:
+    """Escribir `value` en uno de los formatos de las hojas de presupuesto"""
+    negative = value < 0
+    value = abs(value)
+    integer = int(value)
+    cents = round((value - integer) * 100)
+    if style == "co":
+        text = _group(integer, ".") + (f",{cents:02d}" if cents else "")
+    elif style == "us":
+        text = _group(integer, ",") + (f".{cents:02d}" if cents else "")
+    elif style == "plain":
+        text = str(integer) + (f",{cents:02d}" if cents else "")
+    else:
+        # Apóstrofo de millones: 1'500.000
+        millions, rest = divmod(integer, 1_000_000)
+        text = (f"{_group(millions, '.')}'{rest:07,d}".replace(",", ".") if millions else _group(integer, "."))
+        text += f",{cents:02d}" if cents else ""
+    text = rng.choice(["{}", "$ {}", "${}", "COP {}", "{} COP", " $ {} "]).format(text)
+    if negative:
+        text = rng.choice(["-{}", "({})", "{}-"]).format(text.strip())
+    return text
+
+
+def generate_column(cells: int, style: str, seed: int):
+    rng = random.Random(seed)
+    truth = []
+    texts = []
+    for _ in range(cells):
+        value = float(rng.choice([rng.randint(1, 999), rng.randint(1_000, 99_999_999)]) * 1000)
+        if rng.random() < 0.2:
+            value += rng.randint(1, 99) / 100
+        if rng.random() < 0.05:
+            value = -value
+        truth.append(value)
+        texts.append(format_cop(value, style, rng))
+    return np.array(texts, dtype=object), np.array(truth)
+
+
+def measure(label: str, fn, cells: int, truth: np.ndarray, repeat: int = 3):
+    # Mejor de `repeat` corridas: el ruido de la máquina solo suma tiempo
+    elapsed = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = np.asarray(fn(), dtype=float)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    accuracy = float(np.mean(np.isclose(result, truth)))
+    print(f"{label:<34}{cells / elapsed:>14,.0f}{accuracy:>11.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cells", type=int, default=200_000)
+    parser.add_argument("--style", choices=["co", "us", "plain", "apostrophe"], default="co")
+    args = parser.parse_args()
+
+    texts, truth = generate_column(args.cells, args.style, seed=42)
+    series = pd.Series(texts, dtype=object)
+    decimal = infer_decimal_separator(texts)
+
+    def as_float(values):
+        return [np.nan if value is None else value for value in values]
+
+    print(f"{'camino':<34}{'celdas/s':>14}{'exactitud':>11}")
+    measure("re.sub anterior (_safe_numeric)", lambda: as_float(legacy_safe_numeric(t) for t in texts), args.cells, truth)
+    measure("parse_number por celda", lambda: as_float(parse_number(t, None, decimal) for t in texts), args.cells, truth)
+    measure("parse_number_series (Series)", lambda: parse_number_series(series), args.cells, truth)
+    measure("parse_number_series (numpy)", lambda: parse_number_series(texts), args.cells, truth)
+
+    # Columnas reales repiten muchos valores (cantidades, tarifas)
+    repeated = pd.Series(np.resize(texts[:500], args.cells), dtype=object)
+    repeated_truth = np.resize(truth[:500], args.cells)
+    measure("parse_number_series (repetidos)", lambda: parse_number_series(repeated), args.cells, repeated_truth)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark de ingesta de XLSX: compara el camino anterior (pandas +
+DataFrame.to_string por hoja) con la lectura en streaming de openpyxl en modo
+de solo lectura que usa ahora DocumentProcessor.
+
+Por cada hoja reporta bytes de texto emitidos y ms/hoja de ambos caminos, y
+el pico de memoria (tracemalloc) del libro completo.
+
+Uso:
+    python benchmarks/bench_xlsx_ingestion.py Presupuesto.xlsx
+    python benchmarks/bench_xlsx_ingestion.py --generate /tmp/ancho.xlsx --rows 5000 --cols 30
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+import pandas as pd
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.document_processor import iter_xlsx_segments  # noqa: E402
+
+
+def generate_workbook(path: str, rows: int, cols: int, sheets: int):
+    """Libro sintético con la forma de un presupuesto SGR ancho"""
+    workbook = Workbook(write_only=True)
+    for sheet_number in range(sheets):
+        worksheet = workbook.create_sheet(f"Presupuesto {sheet_number + 1}")
+        worksheet.append(["Actividad", "Rubro", "Descripción", "Cantidad", "Valor Unitario", "Total"]
+                         + [f"Año {i}" for i in range(1, cols - 5)])
+        for row in range(rows):
+            worksheet.append([f"Actividad {row}", "TalentoHumano", f"Profesional de apoyo {row % 17}",
+                              row % 12 + 1, 4500000.0, (row % 12 + 1) * 4500000.0]
+                             + [None if (row + i) % 3 else 1250000.0 for i in range(cols - 6)])
+    workbook.save(path)
+
+
+def run_pandas(path: str):
+    per_sheet = {}
+    with pd.ExcelFile(path) as excel_file:
+        for sheet_name in excel_file.sheet_names:
+            start = time.perf_counter()
+            df = pd.read_excel(excel_file, sheet_name=sheet_name)
+            text = f"Hoja: {sheet_name}\n{df.to_string(index=False)}\n"
+            per_sheet[sheet_name] = (len(text.encode("utf-8")), time.perf_counter() - start)
+    return per_sheet
+
+
+def run_streaming(path: str):
+    sizes = defaultdict(int)
+    elapsed = defaultdict(float)
+    start = time.perf_counter()
+    for segment in iter_xlsx_segments(path):
+        now = time.perf_counter()
+        sizes[segment.label] += len(segment.text.encode("utf-8"))
+        elapsed[segment.label] += now - start
+        start = now
+    return {name: (sizes[name], elapsed[name]) for name in sizes}
+
+
+def measure_peak(fn, path: str):
+    tracemalloc.start()
+    try:
+        result = fn(path)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="Libro XLSX a medir")
+    parser.add_argument("--generate", metavar="PATH", help="Generar un libro sintético y medirlo")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--cols", type=int, default=30)
+    parser.add_argument("--sheets", type=int, default=2)
+    parser.add_argument("--memory", action="store_true", help="Medir el pico de memoria (más lento)")
+    args = parser.parse_args()
+
+    path = args.path
+    if args.generate:
+        generate_workbook(args.generate, args.rows, args.cols, args.sheets)
+        path = args.generate
+    if not path:
+        parser.error("indica un archivo XLSX o --generate")
+
+    if args.memory:
+        old, old_peak = measure_peak(run_pandas, path)
+        new, new_peak = measure_peak(run_streaming, path)
+    else:
+        old, new = run_pandas(path), run_streaming(path)
+
+    print(f"{'Hoja':<24}{'bytes pandas':>14}{'bytes stream':>14}{'ratio':>8}{'ms pandas':>12}{'ms stream':>12}")
+    for sheet_name, (old_bytes, old_seconds) in old.items():
+        new_bytes, new_seconds = new.get(str(sheet_name), (0, 0.0))
+        ratio = old_bytes / new_bytes if new_bytes else float("inf")
+        print(f"{str(sheet_name)[:23]:<24}{old_bytes:>14,}{new_bytes:>14,}{ratio:>7.1f}x"
+              f"{old_seconds * 1000:>12.1f}{new_seconds * 1000:>12.1f}")
+
+    total_old = sum(size for size, _ in old.values())
+    total_new = sum(size for size, _ in new.values())
+    print(f"\nTotal: {total_old:,} bytes (pandas) vs {total_new:,} bytes (streaming)")
+    if args.memory:
+        print(f"Pico de memoria: {old_peak / 1e6:.1f} MB (pandas) vs {new_peak / 1e6:.1f} MB (streaming)")
+
+
+if __name__ == "__main__":
+    main()
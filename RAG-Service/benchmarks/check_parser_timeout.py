@@ -0,0 +1,96 @@
+"""
+Comprobación del tiempo de espera del parseo (services/document_processor.py).
+
+Con dos workers y un solo cupo para PDF, envía al pool una tarea que no
+termina dentro del plazo, una tarea sana que sigue en curso cuando se agota y
+una tercera que espera un worker libre. Al agotarse el plazo se matan los
+workers, se reemplaza el pool y se devuelven los cupos: la tarea sana se
+reenvía sin error, la que esperaba no pierde plazo por la espera, y después un
+PDF normal se parsea.
+
+Uso:
+    python benchmarks/check_parser_timeout.py --timeout 4
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+from PyPDF2 import PdfWriter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.document_processor import DocumentProcessor  # noqa: E402
+
+
+def write_pdf(path: str, pages: int):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=612, height=792)
+    with open(path, "wb") as file:
+        writer.write(file)
+
+
+def run_task(processor: DocumentProcessor, file_extension: str, seconds: float):
+    """Tarea de parseo simulada de `seconds` segundos; devuelve cuánto tardó en obtenerse"""
+    start = time.perf_counter()
+    processor._result(processor._submit(file_extension, time.sleep, seconds))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--timeout", type=float, default=4.0)
+    parser.add_argument("--pages", type=int, default=30)
+    args = parser.parse_args()
+
+    os.environ["DOC_PARSER_MAX_PDF_TASKS"] = "1"
+    processor = DocumentProcessor(max_workers=2, timeout_seconds=args.timeout)
+    failures = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp, ThreadPoolExecutor(max_workers=3) as threads:
+            path = os.path.join(tmp, "normal.pdf")
+            write_pdf(path, args.pages)
+
+            # Parseo colgado: ocupa el único cupo de PDF más allá del plazo
+            hung = threads.submit(run_task, processor, ".pdf", 3600)
+            time.sleep(args.timeout * 3 / 4)
+            # Tarea sana en curso cuando se mata el pool: debe reenviarse, no fallar
+            collateral = threads.submit(run_task, processor, ".docx", args.timeout / 4)
+            time.sleep(0.2)
+            # Sin worker libre (límite global = 2): espera sin que el plazo corra
+            waiting = threads.submit(run_task, processor, ".txt", 0)
+
+            try:
+                hung.result()
+                failures.append("la tarea colgada no agotó el plazo")
+            except FuturesTimeoutError:
+                print(f"Tarea colgada abandonada tras {args.timeout:.0f}s")
+            for name, future in (("colateral", collateral), ("en espera", waiting)):
+                try:
+                    print(f"Tarea {name}: terminó en {future.result():.1f}s")
+                except Exception as e:
+                    failures.append(f"la tarea {name} falló: {e!r}")
+
+            start = time.perf_counter()
+            pages = []
+            processor.process_file(path, ".pdf", lambda **fields: pages.append(fields["pages_parsed"]))
+            if pages[-1:] != [args.pages]:
+                failures.append(f"se parsearon {pages[-1:] or [0]} de {args.pages} páginas")
+            else:
+                print(f"El PDF siguiente se parseó en {time.perf_counter() - start:.1f}s ({args.pages} páginas)")
+    finally:
+        processor.close()
+
+    for failure in failures:
+        print(f"FALLO: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
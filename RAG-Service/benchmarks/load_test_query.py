@@ -0,0 +1,99 @@
+"""
+Prueba de carga para /query: lanza N consultas concurrentes contra un servicio
+RAG en ejecución y verifica que se solapen en lugar de serializarse.
+
+Mientras corren las consultas se sondea /health; con el LLM asíncrono el
+endpoint de salud debe seguir respondiendo en milisegundos.
+
+Cada consulta lleva un número distinto ("... (consulta 3)"): la caché semántica
+de respuestas exige que las cifras de la pregunta coincidan, así que ninguna se
+responde desde la caché y todas recorren la recuperación y el LLM.
+
+Uso:
+    python benchmarks/load_test_query.py --url http://localhost:8001 -n 8 --project-id 1
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+import requests
+
+
+def numbered(question: str, number: int) -> str:
+    """Pregunta con un número propio, para que no coincida en la caché de respuestas"""
+    return f"{question} (consulta {number})"
+
+
+def run_query(url: str, question: str, project_id, top_k: int) -> Tuple[float, bool]:
+    payload = {"question": question, "top_k": top_k}
+    if project_id:
+        payload["project_id"] = project_id
+    start = time.perf_counter()
+    resp = requests.post(f"{url}/query", json=payload, timeout=600)
+    elapsed = time.perf_counter() - start
+    resp.raise_for_status()
+    return elapsed, resp.json().get("cached", False)
+
+
+def poll_health(url: str, stop: threading.Event, latencies: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            requests.get(f"{url}/health", timeout=60)
+            latencies.append(time.perf_counter() - start)
+        except requests.RequestException:
+            latencies.append(float("inf"))
+        time.sleep(0.25)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("-n", "--concurrency", type=int, default=8)
+    parser.add_argument("--project-id", type=int, default=None)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--question", default="¿Cuáles son los objetivos del proyecto?")
+    args = parser.parse_args()
+    url = args.url.rstrip("/")
+
+    # Línea base: una consulta sola
+    single, single_cached = run_query(url, numbered(args.question, 0), args.project_id, args.top_k)
+    print(f"Consulta individual: {single:.2f}s" + (" (desde la caché)" if single_cached else ""))
+
+    stop = threading.Event()
+    health_latencies: list = []
+    health_thread = threading.Thread(target=poll_health, args=(url, stop, health_latencies), daemon=True)
+    health_thread.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(run_query, url, numbered(args.question, i), args.project_id, args.top_k)
+            for i in range(1, args.concurrency + 1)
+        ]
+        results = [f.result() for f in futures]
+    wall = time.perf_counter() - start
+    latencies = [elapsed for elapsed, _ in results]
+    cached = sum(hit for _, hit in results)
+
+    stop.set()
+    health_thread.join()
+
+    total = sum(latencies)
+    print(f"{args.concurrency} consultas concurrentes: {wall:.2f}s de reloj, {total:.2f}s sumando latencias")
+    print(f"Latencia por consulta: min {min(latencies):.2f}s / max {max(latencies):.2f}s")
+    print(f"Respondidas desde la caché: {cached} de {args.concurrency}")
+    if cached:
+        print("Aviso: hubo aciertos de caché; el factor de solapamiento no mide solo el camino del LLM")
+    # ~1.0 => serializadas; cercano a N (o al límite LLM_MAX_CONCURRENCY) => solapadas
+    print(f"Factor de solapamiento: {total / wall:.2f}x (serializado = 1.00x)")
+    if health_latencies:
+        worst = max(health_latencies)
+        print(f"/health durante la carga: {len(health_latencies)} sondeos, peor latencia {worst * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,30 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import os
+import json
+import uuid
+import asyncio
 from dotenv import load_dotenv
 import uvicorn
 import logging
 
-from services.document_processor import DocumentProcessor
 from services.rag_service import RAGService
 from services.budget_automation import BudgetAutomationService
 from services.cotizacion_service import CotizacionService
+from services import container
+from services.container import (
+    get_rag_service,
+    get_budget_automation_service,
+    get_cotizacion_service,
+    get_embedding_cache,
+    get_price_catalog,
+    get_ingestion_queue,
+    get_ingestion_upload_dir,
+)
+from services.ingestion_jobs import IngestionJobQueue, PROGRESS_FIELDS
 
 # Configurar logger
 logger = logging.getLogger(__name__)
@@ -45,17 +59,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Inicializar servicios
-document_processor = DocumentProcessor()
-rag_service = RAGService()
-budget_automation = BudgetAutomationService()
-cotizacion_service = CotizacionService()
+# Los servicios se construyen una sola vez por proceso, bajo demanda, en
+# services/container.py y se inyectan en los endpoints con Depends
+
+@app.on_event("startup")
+async def start_ingestion_workers():
+    """Arrancar los workers de ingesta (reanudan los trabajos pendientes)"""
+    await get_ingestion_queue().start()
+
+@app.on_event("shutdown")
+async def shutdown_services():
+    """Liberar los recursos compartidos del proceso"""
+    await get_ingestion_queue().stop()
+    container.shutdown()
 
 # Modelos de datos
 class HealthResponse(BaseModel):
     status: str
     message: str
 
+class RAGQueryResponse(QueryResponse):
+    # Tokens de entrada que la post-recuperación (k adaptativo, MMR, unión de chunks) evitó enviar al LLM
+    tokens_saved: int = 0
+    # Respuesta reutilizada de una pregunta equivalente sobre la misma versión de los documentos
+    cached: bool = False
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Endpoint de salud del servicio"""
@@ -64,13 +92,42 @@ async def health_check():
         message="RAG Budget Automation Service is running"
     )
 
-@app.post("/documents/upload")
+@app.get("/cache/embeddings/stats")
+async def embedding_cache_stats(embedding_cache = Depends(get_embedding_cache)):
+    """Aciertos, fallos y tamaño de la caché persistente de embeddings"""
+    if embedding_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **embedding_cache.stats()}
+
+@app.get("/cache/cotizaciones/stats")
+async def cotizacion_cache_stats(cotizacion_service: CotizacionService = Depends(get_cotizacion_service)):
+    """Aciertos, fallos y tamaño de la caché de ítems leídos y estimados por libro"""
+    return cotizacion_service.cache_stats()
+
+@app.get("/cache/answers/stats")
+async def answer_cache_stats(rag_service: RAGService = Depends(get_rag_service)):
+    """Aciertos, fallos, invalidaciones y tamaño de la caché semántica de respuestas de /query"""
+    return rag_service.answer_cache.stats()
+
+@app.get("/catalog/stats")
+async def price_catalog_stats(price_catalog = Depends(get_price_catalog)):
+    """Precios en el catálogo local y tasa de ítems valorados sin LLM"""
+    if price_catalog is None:
+        return {"enabled": False}
+    return {"enabled": True, **price_catalog.stats()}
+
+@app.post("/documents/upload", status_code=202)
 async def upload_document(
     file: UploadFile = File(...),
     project_id: int = None,
-    document_type: str = "project_document"
+    document_type: str = "project_document",
+    ingestion_queue: IngestionJobQueue = Depends(get_ingestion_queue)
 ):
-    """Subir y procesar un documento de proyecto"""
+    """
+    Subir un documento de proyecto para procesarlo en segundo plano.
+    
+    Devuelve 202 con el `job_id`; el avance se consulta en /jobs/{job_id}.
+    """
     try:
         # Validar tipo de archivo
         allowed_extensions = ['.pdf', '.docx', '.txt', '.xlsx']
@@ -82,30 +139,66 @@ async def upload_document(
                 detail=f"Tipo de archivo no soportado. Permitidos: {allowed_extensions}"
             )
         
-        # Procesar documento
-        content = await document_processor.process_document(file)
+        # Guardar el archivo; el trabajo lo procesa y lo elimina al terminar
+        job_id = str(uuid.uuid4())
+        file_path = os.path.join(get_ingestion_upload_dir(), f"{job_id}{file_extension}")
+        content = await file.read()
+        await asyncio.to_thread(_write_file, file_path, content)
         
-        # Almacenar en base de datos vectorial
-        document_id = await rag_service.add_document(
-            content=content,
-            metadata={
-                "filename": file.filename,
-                "project_id": project_id,
-                "document_type": document_type,
-                "file_extension": file_extension
-            }
+        job = ingestion_queue.submit(
+            job_id=job_id,
+            filename=file.filename,
+            file_path=file_path,
+            file_extension=file_extension,
+            project_id=project_id,
+            document_type=document_type,
         )
         
-        return {
-            "message": "Documento procesado exitosamente",
-            "document_id": document_id,
+        return JSONResponse(status_code=202, content={
+            "message": "Documento recibido, procesamiento en curso",
+            "job_id": job_id,
+            "status": job["status"],
             "filename": file.filename,
-            "project_id": project_id
-        }
+            "project_id": project_id,
+            "status_url": f"/jobs/{job_id}",
+        })
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error procesando documento: {str(e)}")
 
+def _write_file(path: str, content: bytes):
+    with open(path, "wb") as f:
+        f.write(content)
+
+@app.get("/jobs/{job_id}")
+async def get_ingestion_job(
+    job_id: str,
+    ingestion_queue: IngestionJobQueue = Depends(get_ingestion_queue)
+):
+    """Estado de un trabajo de ingesta (document_id disponible al completarse)"""
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    job.pop("file_path", None)
+    return job
+
+@app.get("/jobs/{job_id}/progress")
+async def get_ingestion_job_progress(
+    job_id: str,
+    ingestion_queue: IngestionJobQueue = Depends(get_ingestion_queue)
+):
+    """Progreso de un trabajo: páginas parseadas, chunks embebidos y chunks escritos"""
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        **{field: job[field] for field in PROGRESS_FIELDS},
+    }
+
 @app.post("/budget/extract-from-file")
 async def extract_budget_from_file(
     file: UploadFile = File(...),
@@ -174,7 +267,9 @@ async def extract_budget_from_file(
 async def generar_cotizacion(
     file: UploadFile = File(...),
     incluir_iva: bool = False,
-    tasa_iva: float = 0.19
+    tasa_iva: float = 0.19,
+    incluir_narrativa: bool = True,
+    cotizacion_service: CotizacionService = Depends(get_cotizacion_service)
 ):
     """
     Generar cotización en formato colombiano desde archivo Excel.
@@ -183,6 +278,7 @@ async def generar_cotizacion(
         file: Archivo Excel con ítems a cotizar
         incluir_iva: Si True, incluye IVA (19%) en la cotización
         tasa_iva: Tasa de IVA (por defecto 0.19 = 19%)
+        incluir_narrativa: Si True, agrega un párrafo de justificación redactado por el LLM
     
     Returns:
         Cotización en formato markdown y datos estructurados
@@ -212,19 +308,23 @@ async def generar_cotizacion(
             resultado = await cotizacion_service.generar_cotizacion_desde_excel(
                 file_path=temp_file_path,
                 incluir_iva=incluir_iva,
-                tasa_iva=tasa_iva
+                tasa_iva=tasa_iva,
+                incluir_narrativa=incluir_narrativa
             )
             
             return {
                 "message": "Cotización generada exitosamente",
                 "filename": file.filename,
                 "cotizacion_markdown": resultado["cotizacion_markdown"],
+                "narrativa": resultado.get("narrativa"),
                 "items": resultado["items"],
                 "totales": resultado["totales"],
                 "incluye_iva": resultado["incluye_iva"],
                 "tasa_iva": resultado["tasa_iva"],
                 "total_items": resultado["total_items"],
                 "items_estimados": resultado.get("items_estimados", 0),
+                "items_desde_catalogo": resultado.get("items_desde_catalogo", 0),
+                "desde_cache": resultado.get("desde_cache", False),
                 "fecha_generacion": resultado["fecha_generacion"]
             }
         
@@ -261,8 +361,11 @@ async def generar_cotizacion(
         logger.error(f"Error generando cotización: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generando cotización: {str(e)}")
 
-@app.post("/query", response_model=QueryResponse)
-async def query_documents(request: QueryRequest):
+@app.post("/query", response_model=RAGQueryResponse)
+async def query_documents(
+    request: QueryRequest,
+    rag_service: RAGService = Depends(get_rag_service)
+):
     """Realizar consulta semántica sobre los documentos"""
     try:
         response = await rag_service.query(
@@ -271,17 +374,56 @@ async def query_documents(request: QueryRequest):
             top_k=request.top_k or 10  # Aumentado de 5 a 10 para más contexto
         )
         
-        return QueryResponse(
+        return RAGQueryResponse(
             answer=response["answer"],
             sources=response["sources"],
-            confidence=response["confidence"]
+            confidence=response["confidence"],
+            tokens_saved=response["tokens_saved"],
+            cached=response["cached"]
         )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error en consulta: {str(e)}")
 
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Un evento server-sent events con datos JSON"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/query/stream")
+async def query_documents_stream(
+    request: QueryRequest,
+    rag_service: RAGService = Depends(get_rag_service)
+):
+    """
+    Consulta semántica con la respuesta en streaming (text/event-stream).
+    
+    Eventos: `sources` (fuentes, confianza, tokens ahorrados y si la respuesta viene
+    de la caché, al terminar la recuperación), `delta` (fragmentos de texto de la
+    respuesta), `done` (confianza final) y `error` si la consulta falla a mitad de camino.
+    """
+    async def events():
+        try:
+            async for event in rag_service.query_stream(
+                question=request.question,
+                project_id=request.project_id,
+                top_k=request.top_k or 10
+            ):
+                yield _sse(event["event"], event["data"])
+        except Exception as e:
+            yield _sse("error", {"detail": f"Error en consulta: {str(e)}"})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Sin caché ni buffering en proxies para que cada fragmento llegue al instante
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/budget/generate", response_model=BudgetGenerationResponse)
-async def generate_budget(request: BudgetGenerationRequest):
+async def generate_budget(
+    request: BudgetGenerationRequest,
+    budget_automation: BudgetAutomationService = Depends(get_budget_automation_service)
+):
     """
     Generar presupuesto automáticamente basado en documentos de proyecto y/o actividades.
     
@@ -329,27 +471,37 @@ async def generate_budget(request: BudgetGenerationRequest):
         raise HTTPException(status_code=500, detail=f"Error generando presupuesto: {str(e)}")
 
 @app.get("/projects/{project_id}/documents")
-async def get_project_documents(project_id: int):
+async def get_project_documents(
+    project_id: int,
+    rag_service: RAGService = Depends(get_rag_service)
+):
     """Obtener documentos asociados a un proyecto"""
     try:
-        documents = await rag_service.get_project_documents(project_id)
+        documents = await rag_service.list_project_documents(project_id)
         return {"project_id": project_id, "documents": documents}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo documentos: {str(e)}")
 
 @app.delete("/documents/{document_id}")
-async def delete_document(document_id: str):
-    """Eliminar un documento"""
+async def delete_document(
+    document_id: str,
+    project_id: Optional[int] = None,
+    rag_service: RAGService = Depends(get_rag_service)
+):
+    """Eliminar un documento por su id (o, para documentos antiguos, por nombre de archivo)"""
     try:
-        await rag_service.delete_document(document_id)
+        await rag_service.delete_document(document_id, project_id=project_id)
         return {"message": "Documento eliminado exitosamente", "document_id": document_id}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error eliminando documento: {str(e)}")
 
 @app.post("/resources/plan", response_model=ResourcePlanResponse)
-async def plan_resources(request: ResourcePlanRequest):
+async def plan_resources(
+    request: ResourcePlanRequest,
+    rag_service: RAGService = Depends(get_rag_service)
+):
     """
     Generar un plan inicial de asignación de recursos para las actividades proporcionadas.
 
@@ -378,7 +530,11 @@ async def plan_resources(request: ResourcePlanRequest):
         raise HTTPException(status_code=500, detail=f"Error generando plan de recursos: {str(e)}")
 
 @app.get("/projects/{project_id}/budget/suggestions")
-async def get_budget_suggestions(project_id: int, category: str = None):
+async def get_budget_suggestions(
+    project_id: int,
+    category: str = None,
+    budget_automation: BudgetAutomationService = Depends(get_budget_automation_service)
+):
     """Obtener sugerencias de presupuesto para un proyecto específico"""
     try:
         suggestions = await budget_automation.get_budget_suggestions(
@@ -391,7 +547,10 @@ async def get_budget_suggestions(project_id: int, category: str = None):
         raise HTTPException(status_code=500, detail=f"Error obteniendo sugerencias: {str(e)}")
 
 @app.get("/projects/{project_id}/activities/extract", response_model=ExtractedActivities)
-async def extract_activities_from_documents(project_id: int):
+async def extract_activities_from_documents(
+    project_id: int,
+    budget_automation: BudgetAutomationService = Depends(get_budget_automation_service)
+):
     """
     Extraer todas las actividades mencionadas en los documentos del proyecto.
     No se preocupa por jerarquías, solo extrae la lista de actividades encontradas.
@@ -0,0 +1,135 @@
+"""
+Caché semántica de respuestas de /query.
+
+Las mismas preguntas ("resumen del proyecto", "presupuesto total", "actividades
+principales") se repiten por proyecto desde Streamlit y desde el Backend. Cada
+respuesta se guarda bajo (proyecto, versión de sus documentos, top_k) junto con
+el embedding normalizado de la pregunta; una pregunta con similitud coseno
+mayor o igual al umbral reutiliza la respuesta sin recuperar ni llamar al LLM.
+
+La versión del proyecto cambia con cada alta o baja de documentos: las
+respuestas de versiones anteriores dejan de coincidir y se descartan en la
+siguiente consulta del proyecto. Las cifras y códigos de la pregunta ("OE2",
+"2025") deben coincidir exactamente, porque los embeddings apenas los distinguen.
+"""
+
+import copy
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Hashable, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .lexical_index import tokenize
+
+# (proyecto, versión de sus documentos, top_k)
+Scope = Tuple[str, int, Hashable]
+
+
+class _Entry(NamedTuple):
+    scope: Scope
+    vector: np.ndarray
+    signature: FrozenSet[str]
+    value: Dict[str, Any]
+    stored_at: float
+
+
+def _signature(question: str) -> FrozenSet[str]:
+    """Términos con dígitos de la pregunta (códigos, años, montos)"""
+    return frozenset(token for token in tokenize(question) if any(char.isdigit() for char in token))
+
+
+class SemanticAnswerCache:
+    """Respuestas por proyecto y versión, reutilizadas entre preguntas equivalentes"""
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: Optional[float] = 1800,
+                 similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, scope: Scope, question: str, embedding: Sequence[float]) -> Optional[Dict[str, Any]]:
+        """Copia de la respuesta guardada para una pregunta equivalente, o None"""
+        vector = _normalize(embedding)
+        signature = _signature(question)
+        with self._lock:
+            self._check_version(scope)
+            now = time.monotonic()
+            candidates = []
+            for entry_id, entry in list(self._entries.items()):
+                if self.ttl_seconds is not None and now - entry.stored_at > self.ttl_seconds:
+                    del self._entries[entry_id]
+                elif entry.scope == scope and entry.signature == signature:
+                    candidates.append(entry_id)
+            if candidates:
+                scores = np.stack([self._entries[entry_id].vector for entry_id in candidates]) @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    self._entries.move_to_end(candidates[best])
+                    self.hits += 1
+                    return copy.deepcopy(self._entries[candidates[best]].value)
+            self.misses += 1
+            return None
+
+    def set(self, scope: Scope, question: str, embedding: Sequence[float], value: Dict[str, Any]) -> None:
+        entry = _Entry(scope, _normalize(embedding), _signature(question), copy.deepcopy(value), time.monotonic())
+        with self._lock:
+            self._check_version(scope)
+            if self._versions.get(scope[0]) != scope[1]:
+                # Respuesta calculada con documentos que ya cambiaron
+                return
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _check_version(self, scope: Scope) -> None:
+        """Descartar las respuestas de versiones anteriores del proyecto (con el lock tomado)"""
+        project, version = scope[0], scope[1]
+        current = self._versions.get(project)
+        if current is not None and version < current:
+            return
+        if current is not None and version > current:
+            stale = [entry_id for entry_id, entry in self._entries.items()
+                     if entry.scope[0] == project and entry.scope[1] != version]
+            for entry_id in stale:
+                del self._entries[entry_id]
+            self.invalidations += len(stale)
+        self._versions[project] = version
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "similarity_threshold": self.similarity_threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+def _normalize(embedding: Sequence[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
@@ -0,0 +1,95 @@
+"""
+Almacén de archivos originales direccionado por contenido.
+
+Cada archivo subido se guarda una sola vez bajo su SHA-256
+(`<raíz>/<2 primeros hex>/<hash><extensión>`). El manifiesto de documentos
+guarda el hash, de modo que servicios como la extracción de presupuestos
+pueden volver a parsear el archivo real en lugar de reconstruirlo desde los
+chunks de ChromaDB. Subir dos veces el mismo archivo no duplica el blob,
+aunque llegue con otra extensión (p. ej. el mismo libro como .xls y .xlsx).
+"""
+
+import os
+import glob
+import shutil
+import hashlib
+import tempfile
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+_READ_BLOCK = 1024 * 1024
+
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 del archivo, leído por bloques"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(_READ_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Archivos originales indexados por su SHA-256"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _blob_path(self, content_hash: str, file_extension: str) -> str:
+        return os.path.join(self.root, content_hash[:2], f"{content_hash}{file_extension.lower()}")
+
+    def _matches(self, content_hash: str) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.root, content_hash[:2], f"{content_hash}*")))
+
+    def put_file(self, file_path: str, content_hash: Optional[str] = None) -> str:
+        """
+        Guardar una copia del archivo y devolver su hash.
+
+        El archivo de origen no se modifica. Si el contenido ya existe, con
+        cualquier extensión, no se vuelve a escribir. `content_hash` evita
+        recalcular el hash si quien llama ya lo tiene.
+        """
+        content_hash = content_hash or hash_file(file_path)
+        if self.path(content_hash) is not None:
+            return content_hash
+        file_extension = os.path.splitext(file_path)[1]
+        target = self._blob_path(content_hash, file_extension)
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            # Mismo sistema de archivos (uploads/ingestion -> uploads/blobs): basta un hard link
+            os.link(file_path, target)
+        except FileExistsError:
+            pass
+        except OSError:
+            # Copiar a un temporal y renombrar para no dejar blobs a medio escribir
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+            os.close(fd)
+            try:
+                shutil.copyfile(file_path, tmp_path)
+                os.replace(tmp_path, target)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        return content_hash
+
+    def path(self, content_hash: str) -> Optional[str]:
+        """Ruta del blob con ese hash, o None si no existe"""
+        if not content_hash:
+            return None
+        matches = self._matches(content_hash)
+        return matches[0] if matches else None
+
+    def delete(self, content_hash: str) -> None:
+        """Eliminar el blob con ese hash, incluidas las copias que hayan quedado con otra extensión"""
+        if not content_hash:
+            return
+        for path in self._matches(content_hash):
+            try:
+                os.unlink(path)
+            except OSError as e:
+                logger.warning(f"No se pudo eliminar el blob {content_hash}: {str(e)}")
@@ -1,4 +1,6 @@
 import os
+import copy
+import asyncio
 import json
 from typing import List, Dict, Any, Optional
 from datetime import datetime
@@ -8,27 +10,38 @@ from openpyxl.styles import Font, Alignment, PatternFill
 from openpyxl.utils import get_column_letter
 import logging
 
-from .rag_service import RAGService
-from .llm_service import LLMService
+from . import container
 from .budget_extractor import BudgetExtractor
+from .cache import LRUCache
+from .context_packer import ContextCandidate
+from .number_parser import parse_number
 
 logger = logging.getLogger(__name__)
 
 class BudgetAutomationService:
     """Servicio para automatización de presupuestos basado en RAG"""
     
-    def __init__(self):
-        self.rag_service = RAGService()
+    def __init__(self, rag_service=None, llm_service=None, budget_store=None, price_catalog=None,
+                 context_packer=None):
+        # Reutilizar el RAGService y el LLM del proceso en lugar de crear copias propias
+        self.rag_service = rag_service if rag_service is not None else container.get_rag_service()
         self.budget_extractor = BudgetExtractor()
+        # Ítems de presupuesto extraídos al subir cada Excel/DOCX (consultas SQL por proyecto y rubro)
+        self.budget_store = budget_store if budget_store is not None else container.get_budget_store()
+        # Extracciones de archivos originales por SHA-256: el contenido de un hash no cambia
+        self._extraction_cache = LRUCache(
+            max_entries=int(os.getenv("BUDGET_EXTRACTION_CACHE_MAX_FILES", "128"))
+        )
+        # Catálogo de precios conocidos: se valora localmente antes de preguntar al LLM
+        self.price_catalog = price_catalog if price_catalog is not None else container.get_price_catalog()
+        # Contexto de documentos para los prompts, por presupuesto de tokens de cada tarea
+        self.context_packer = context_packer if context_packer is not None else container.get_context_packer()
         
-        # Inicializar servicio LLM (opcional)
-        try:
-            self.llm_service = LLMService()
-            self.use_llm = True
-        except Exception as e:
-            self.llm_service = None
-            self.use_llm = False
-            logger.warning(f"LLM no disponible para generación de presupuestos. Error: {str(e)}")
+        # Servicio LLM (opcional)
+        self.llm_service = llm_service if llm_service is not None else container.get_llm_service()
+        self.use_llm = self.llm_service is not None
+        if not self.use_llm:
+            logger.warning("LLM no disponible para generación de presupuestos.")
         
         # Categorías de presupuesto mapeadas a los rubros del sistema
         self.budget_categories = {
@@ -81,6 +94,9 @@ class BudgetAutomationService:
             if extracted_budget and extracted_budget.get("total_activities", 0) > 0:
                 logger.info(f"Presupuesto extraído exitosamente: {extracted_budget['total_activities']} actividades")
                 
+                # Valorar con el catálogo de precios las actividades sin valor ya conocidas
+                await self._price_activities_from_catalog(extracted_budget["activities"])
+                
                 # Verificar si necesita completar valores faltantes con LLM
                 summary = self.budget_extractor.calculate_budget_summary(extracted_budget["activities"])
                 
@@ -165,11 +181,7 @@ class BudgetAutomationService:
                 project_docs = await self.rag_service.get_project_documents(project_id)
                 if project_docs:
                     project_docs_count = len(project_docs)
-                    # Combinar contenido de documentos para contexto
-                    project_docs_context = " ".join([
-                        " ".join([chunk["content"] for chunk in doc["chunks"]])
-                        for doc in project_docs[:5]  # Limitar a 5 documentos
-                    ])
+                    project_docs_context = self._budget_documents_context(project_docs[:5])
             except:
                 pass
             
@@ -207,6 +219,13 @@ class BudgetAutomationService:
     async def get_budget_suggestions(self, project_id: int, category: str = None) -> List[Dict[str, Any]]:
         """Obtener sugerencias de presupuesto para un proyecto específico"""
         try:
+            categories_to_analyze = [category] if category else list(self.budget_categories.keys())
+            
+            # Si el proyecto tiene presupuestos extraídos, agregarlos por rubro en SQL
+            indexed = await asyncio.to_thread(self.budget_store.indexed_documents, project_id)
+            if any(indexed.values()):
+                return await asyncio.to_thread(self._budget_suggestions_from_store, project_id, categories_to_analyze)
+            
             # Obtener documentos del proyecto
             project_docs = await self.rag_service.get_project_documents(project_id)
             
@@ -214,7 +233,6 @@ class BudgetAutomationService:
                 return []
             
             suggestions = []
-            categories_to_analyze = [category] if category else list(self.budget_categories.keys())
             
             for cat in categories_to_analyze:
                 if cat in self.budget_categories:
@@ -227,6 +245,39 @@ class BudgetAutomationService:
         except Exception as e:
             raise Exception(f"Error obteniendo sugerencias: {str(e)}")
     
+    def _budget_suggestions_from_store(self, project_id: int, categories: List[str]) -> List[Dict[str, Any]]:
+        """Sugerencias por rubro a partir de la tabla de ítems extraídos"""
+        suggestions = []
+        for totals in self.budget_store.rubro_totals(project_id):
+            category = totals["rubro"]
+            if category not in categories or category not in self.budget_categories:
+                continue
+            
+            items = self.budget_store.top_items(project_id, category)
+            suggestions.append({
+                "category": category,
+                "suggested_items": [
+                    {
+                        "description": item["nombre"],
+                        "estimated_cost": item["total"],
+                        "quantity": item["cantidad"],
+                        "unit_cost": item["valor_unitario"],
+                        "category": category,
+                        "source": f"{item['filename']} / {item['source_sheet']} fila {item['source_row']}",
+                        "confidence": 0.9
+                    }
+                    for item in items
+                ],
+                "total_estimated": totals["total"],
+                "reasoning": (
+                    f"Basado en {totals['items']} ítems extraídos de los presupuestos del proyecto "
+                    f"({totals['items_without_budget']} sin valor)"
+                ),
+                "confidence": 0.85
+            })
+        
+        return suggestions
+    
     async def _extract_budget_information(self, project_docs: List[Dict[str, Any]], 
                                         budget_categories: List[str]) -> Dict[str, Any]:
         """Extraer información de presupuesto de los documentos del proyecto"""
@@ -618,14 +669,26 @@ class BudgetAutomationService:
         if not project_docs:
             return {"project_id": project_id, "activities": [], "total_activities": 0}
             
-        # 2. Preparar contexto
-        context = ""
+        # 2. Preparar contexto: los chunks que más hablan de actividades, en orden de lectura
+        keywords = ["actividad", "objetivo", "metodolog", "cronograma", "fase", "producto", "entregable"]
+        candidates = []
         for doc in project_docs:
-            # Limitar el tamaño del contexto si es necesario
-            content = doc.get("content", "")
-            if len(content) > 15000:
-                content = content[:15000] + "..."
-            context += f"\n--- Documento: {doc.get('filename')} ---\n{content}\n"
+            for chunk in doc.get("chunks", []):
+                content = chunk["content"]
+                lower = content.lower()
+                candidates.append(ContextCandidate(
+                    content, sum(lower.count(keyword) for keyword in keywords),
+                    doc.get("filename", ""), len(candidates)
+                ))
+        packed = self.context_packer.pack(candidates, "activity_extraction", keep_order=True)
+        
+        context = ""
+        current = None
+        for filename, content in zip(packed.sources, packed.texts):
+            if filename != current:
+                context += f"\n--- Documento: {filename} ---\n"
+                current = filename
+            context += f"{content}\n"
             
         # 3. Llamar al LLM
         if self.use_llm and self.llm_service:
@@ -633,49 +696,85 @@ class BudgetAutomationService:
         
         return {"project_id": project_id, "activities": [], "total_activities": 0}
     
+    def _budget_documents_context(self, project_docs: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        Chunks de los documentos con más términos de costos y rubros, dentro del
+        presupuesto de tokens de "budget_generation" y en su orden original.
+        """
+        keywords = {keyword for data in self.budget_categories.values() for keyword in data["keywords"]}
+        keywords.update(["presupuesto", "costo", "valor", "$"])
+        candidates = []
+        for doc in project_docs:
+            for chunk in doc.get("chunks", []):
+                content = chunk["content"]
+                lower = content.lower()
+                # Densidad de términos: un chunk largo no gana solo por tamaño
+                score = sum(lower.count(keyword) for keyword in keywords) / (1 + len(content) / 1000)
+                candidates.append(ContextCandidate(content, score, doc.get("filename", ""), len(candidates)))
+        packed = self.context_packer.pack(candidates, "budget_generation", keep_order=True)
+        return "\n\n".join(packed.texts) or None
+    
     async def _extract_budget_from_project_documents(self, project_id: int) -> Optional[Dict[str, Any]]:
         """
         Extraer presupuesto inteligentemente desde archivos Excel/DOCX del proyecto.
-        Busca documentos con presupuestos cargados en ChromaDB.
+        
+        Las actividades se leen de la tabla de presupuesto, que se llena al subir
+        cada archivo. Los documentos con original guardado que aún no estén en la
+        tabla se extraen y registran ahora; los cargados antes de que se guardaran
+        los originales se reconstruyen desde los chunks de ChromaDB.
         """
         try:
-            # Obtener documentos del proyecto
-            project_docs = await self.rag_service.get_project_documents(project_id)
+            # Listar documentos del proyecto desde el manifiesto (sin texto de chunks)
+            project_docs = await self.rag_service.list_project_documents(project_id)
             
             if not project_docs:
                 return None
             
-            all_extracted_activities = []
+            indexed = await asyncio.to_thread(self.budget_store.indexed_documents, project_id)
+            indexed_ids = []
             source_files = []
+            legacy_docs = []
             
             # Buscar documentos Excel o DOCX que contengan presupuestos
             for doc in project_docs:
                 filename = doc.get("filename", "")
-                file_extension = os.path.splitext(filename)[1].lower()
+                file_extension = (doc.get("file_extension") or os.path.splitext(filename)[1]).lower()
                 
                 # Solo procesar Excel y DOCX
                 if file_extension not in ['.xlsx', '.xls', '.docx']:
                     continue
                 
-                logger.info(f"Intentando extraer presupuesto de: {filename}")
+                document_id = doc["document_id"]
+                if document_id not in indexed:
+                    try:
+                        count = await self.index_document_budget(
+                            document_id, project_id, filename, file_extension, doc.get("content_hash")
+                        )
+                    except Exception as e:
+                        logger.warning(f"Error extrayendo de {filename}: {str(e)}")
+                        continue
+                    if count is None:
+                        legacy_docs.append(filename)
+                        continue
+                    indexed[document_id] = count
                 
-                # Aquí necesitaríamos acceso al archivo original
-                # Por ahora, intentamos extraer desde el contenido chunkeado en ChromaDB
-                try:
-                    # Reconstruir contenido del documento
-                    full_content = " ".join([chunk["content"] for chunk in doc.get("chunks", [])])
-                    
-                    # Si el contenido contiene datos tabulares (detectar por patrones)
-                    if self._contains_tabular_data(full_content):
-                        # Parsear el contenido como tabla
-                        extracted = await self._parse_tabular_content(full_content, filename)
-                        if extracted and extracted.get("activities"):
-                            all_extracted_activities.extend(extracted["activities"])
-                            source_files.append(filename)
-                    
-                except Exception as e:
-                    logger.warning(f"Error extrayendo de {filename}: {str(e)}")
-                    continue
+                if indexed[document_id]:
+                    indexed_ids.append(document_id)
+                    source_files.append(filename)
+            
+            all_extracted_activities = []
+            if indexed_ids:
+                all_extracted_activities = await asyncio.to_thread(
+                    self.budget_store.list_items, project_id, None, indexed_ids
+                )
+            
+            legacy_used = False
+            if legacy_docs:
+                legacy_activities, legacy_sources = await self._extract_budget_from_chunks(project_id, legacy_docs)
+                if legacy_activities:
+                    all_extracted_activities.extend(legacy_activities)
+                    source_files.extend(legacy_sources)
+                    legacy_used = True
             
             if not all_extracted_activities:
                 return None
@@ -689,14 +788,119 @@ class BudgetAutomationService:
                 "total_activities": len(all_extracted_activities),
                 "rubros_found": list(grouped_by_rubro.keys()),
                 "source_files": source_files,
-                "extraction_method": "intelligent_from_chroma",
-                "confidence": 0.8
+                "extraction_method": "intelligent_from_chroma" if legacy_used else "intelligent_from_original",
+                "confidence": 0.8 if legacy_used else 0.85
             }
             
         except Exception as e:
             logger.error(f"Error extrayendo presupuesto de documentos: {str(e)}")
             return None
     
+    async def index_document_budget(self, document_id: str, project_id: Any, filename: str,
+                                    file_extension: str, content_hash: Optional[str]) -> Optional[int]:
+        """
+        Extraer las actividades del archivo original de un documento y guardarlas en la tabla de presupuesto.
+        
+        Devuelve el número de ítems guardados, o None si el documento no es Excel/DOCX
+        o su original no está disponible.
+        """
+        if file_extension not in ['.xlsx', '.xls', '.docx']:
+            return None
+        original_path = self.rag_service.get_original_file(content_hash)
+        if original_path is None:
+            return None
+        
+        extracted = await self._extract_from_original(content_hash, original_path, file_extension)
+        count = await asyncio.to_thread(
+            self.budget_store.replace_document,
+            document_id, project_id, filename, extracted.get("activities", []), content_hash
+        )
+        logger.info(f"Tabla de presupuesto: {count} ítems de {filename} (proyecto {project_id})")
+        # Las respuestas cacheadas del proyecto no incluyen estos ítems
+        self.rag_service.mark_project_changed(project_id)
+        # Los valores unitarios del presupuesto alimentan el catálogo de precios
+        await self._add_activities_to_catalog(extracted.get("activities", []), fuente="presupuesto")
+        return count
+    
+    async def _price_activities_from_catalog(self, activities: List[Dict[str, Any]]) -> int:
+        """Completar con el catálogo de precios las actividades sin valor; devuelve cuántas se valoraron"""
+        missing = [act for act in activities if not act.get("total") or act["total"] <= 0]
+        if self.price_catalog is None or not missing:
+            return 0
+        try:
+            prices = await asyncio.to_thread(
+                self.price_catalog.lookup, [(act.get("nombre", ""), act.get("rubro")) for act in missing]
+            )
+        except Exception as e:
+            logger.warning(f"Catálogo de precios no disponible: {str(e)}")
+            return 0
+        
+        priced = 0
+        for activity, price in zip(missing, prices):
+            if price is None:
+                continue
+            cantidad = activity.get("cantidad") if activity.get("cantidad") and activity["cantidad"] > 0 else 1
+            activity["cantidad"] = cantidad
+            activity["valor_unitario"] = price["valor_unitario"]
+            activity["total"] = cantidad * price["valor_unitario"]
+            activity["has_budget_values"] = True
+            activity["fuente_valor"] = "catalogo"
+            priced += 1
+        if priced:
+            logger.info(f"Catálogo de precios: {priced} de {len(missing)} actividades sin valor completadas sin LLM")
+        return priced
+    
+    async def _add_activities_to_catalog(self, activities: List[Dict[str, Any]], fuente: str) -> None:
+        if self.price_catalog is None or not activities:
+            return
+        try:
+            await asyncio.to_thread(self.price_catalog.add_prices, [
+                {"descripcion": act.get("nombre"), "rubro": act.get("rubro"), "valor_unitario": act.get("valor_unitario")}
+                for act in activities
+            ], fuente)
+        except Exception as e:
+            logger.warning(f"No se pudieron guardar precios en el catálogo: {str(e)}")
+    
+    async def _extract_from_original(self, content_hash: str, file_path: str, file_extension: str) -> Dict[str, Any]:
+        """Correr BudgetExtractor sobre el archivo original; el resultado se cachea por hash"""
+        cached = self._extraction_cache.get(content_hash)
+        if cached is None:
+            # pandas/python-docx son síncronos: fuera del event loop
+            cached = await asyncio.to_thread(self.budget_extractor.extract_file, file_path, file_extension)
+            self._extraction_cache.set(content_hash, cached)
+        # Copia: el completado con LLM modifica las actividades en sitio
+        return copy.deepcopy(cached)
+    
+    async def _extract_budget_from_chunks(self, project_id: int, filenames: List[str]):
+        """Reconstruir el contenido desde los chunks de ChromaDB (documentos sin original guardado)"""
+        activities = []
+        source_files = []
+        project_docs = await self.rag_service.get_project_documents(project_id)
+        
+        for doc in project_docs:
+            filename = doc.get("filename", "")
+            if filename not in filenames:
+                continue
+            
+            logger.info(f"Intentando extraer presupuesto desde chunks de: {filename}")
+            try:
+                # Reconstruir contenido del documento
+                full_content = " ".join([chunk["content"] for chunk in doc.get("chunks", [])])
+                
+                # Si el contenido contiene datos tabulares (detectar por patrones)
+                if self._contains_tabular_data(full_content):
+                    # Parsear el contenido como tabla
+                    extracted = await self._parse_tabular_content(full_content, filename)
+                    if extracted and extracted.get("activities"):
+                        activities.extend(extracted["activities"])
+                        source_files.append(filename)
+                
+            except Exception as e:
+                logger.warning(f"Error extrayendo de {filename}: {str(e)}")
+                continue
+        
+        return activities, source_files
+    
     def _contains_tabular_data(self, content: str) -> bool:
         """Detectar si el contenido tiene datos tabulares"""
         # Buscar patrones que indiquen tablas
@@ -756,15 +960,12 @@ class BudgetAutomationService:
         if not rubro:
             return None
         
-        # Extraer el valor más alto como total
+        # Extraer el valor más alto como total (cifras de al menos 3 dígitos)
         values = []
         for num_str in numbers:
-            try:
-                cleaned = num_str.replace(',', '').replace('.', '')
-                if len(cleaned) > 2:
-                    values.append(float(cleaned))
-            except:
-                continue
+            value = parse_number(num_str)
+            if value is not None and value >= 100:
+                values.append(value)
         
         if not values:
             return None
@@ -808,10 +1009,7 @@ class BudgetAutomationService:
             try:
                 project_docs = await self.rag_service.get_project_documents(project_id)
                 if project_docs:
-                    project_docs_context = " ".join([
-                        " ".join([chunk["content"] for chunk in doc["chunks"]])
-                        for doc in project_docs[:3]
-                    ])[:3000]  # Limitar contexto
+                    project_docs_context = self._budget_documents_context(project_docs[:3])
             except:
                 pass
             
@@ -836,6 +1034,11 @@ class BudgetAutomationService:
                         completed_map[activity_name]["cantidad"] = item.get("quantity", 1)
                         completed_map[activity_name]["has_budget_values"] = True
             
+            # Las estimaciones aceptadas pasan al catálogo de precios
+            await self._add_activities_to_catalog(
+                [act for act in activities_to_complete if act.get("has_budget_values")], fuente="llm"
+            )
+            
             logger.info("Presupuestos completados exitosamente con LLM")
             
             return extracted_budget
@@ -1,11 +1,14 @@
 import os
 import re
+import asyncio
 import pandas as pd
 import tempfile
 from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 import logging
 
+from .number_parser import parse_number_series
+
 logger = logging.getLogger(__name__)
 
 class BudgetExtractor:
@@ -68,6 +71,12 @@ class BudgetExtractor:
             "nota", "notas", "observación", "observaciones", "pie de página",
             "encabezado", "título", "resumen", "conclusión"
         ]
+        
+        # Patrones compilados para filtrar filas sobre columnas completas
+        self._header_pattern = "|".join(
+            re.escape(word) for word in ["actividad", "descripción", "descripcion", "item", "ítem"]
+        )
+        self._ignore_pattern = "|".join(re.escape(word) for word in self.ignore_keywords)
     
     def identify_rubro_from_text(self, text: str) -> Optional[str]:
         """Identificar el rubro al que pertenece un texto basándose en palabras clave"""
@@ -102,11 +111,23 @@ class BudgetExtractor:
         
         return None
     
+    def extract_file(self, file_path: str, file_extension: str) -> Dict[str, Any]:
+        """
+        Extraer actividades de un archivo Excel o DOCX (síncrono).
+        Lee el archivo con pandas/python-docx: desde código async, correrlo con asyncio.to_thread.
+        """
+        if file_extension.lower() == '.docx':
+            return self._extract_docx(file_path)
+        return self._extract_excel(file_path)
+    
     async def extract_from_excel(self, file_path: str) -> Dict[str, Any]:
         """
         Extraer actividades y presupuesto de un archivo Excel.
         Detecta automáticamente las columnas y mapea a la estructura del sistema.
         """
+        return await asyncio.to_thread(self._extract_excel, file_path)
+    
+    def _extract_excel(self, file_path: str) -> Dict[str, Any]:
         try:
             # Leer todas las hojas del Excel
             excel_file = pd.ExcelFile(file_path)
@@ -120,7 +141,7 @@ class BudgetExtractor:
                 
                 # Detectar si esta hoja contiene presupuesto/actividades
                 if self._is_budget_sheet(df):
-                    activities = await self._extract_activities_from_dataframe(df, sheet_name)
+                    activities = self._extract_activities_from_dataframe(df, sheet_name)
                     all_activities.extend(activities)
             
             excel_file.close()
@@ -156,32 +177,131 @@ class BudgetExtractor:
         
         return any(indicator in columns_str for indicator in budget_indicators)
     
-    async def _extract_activities_from_dataframe(
+    def _extract_activities_from_dataframe(
         self, 
         df: pd.DataFrame, 
         sheet_name: str
     ) -> List[Dict[str, Any]]:
         """Extraer actividades de un DataFrame de pandas"""
-        activities = []
-        
         # Identificar columnas
         column_mapping = self._map_columns(df)
         
         logger.info(f"Mapeo de columnas en '{sheet_name}': {column_mapping}")
         
-        # Iterar por filas
-        for idx, row in df.iterrows():
-            # Saltar filas vacías o de encabezado adicional
-            if self._is_empty_or_header_row(row, column_mapping):
-                continue
-            
-            # Extraer datos de la fila
-            activity = await self._extract_activity_from_row(row, column_mapping, sheet_name)
-            
-            if activity:
-                activities.append(activity)
+        return self._extract_activities_columnar(df, column_mapping, sheet_name)
+    
+    def _extract_activities_columnar(
+        self,
+        df: pd.DataFrame,
+        column_mapping: Dict[str, str],
+        sheet_name: str
+    ) -> List[Dict[str, Any]]:
+        """
+        Extraer actividades operando sobre columnas completas.
         
-        return activities
+        El parseo numérico, las validaciones y la clasificación por rubro se hacen
+        con operaciones vectorizadas en lugar de fila por fila (la extracción
+        anterior, fila a fila, está en benchmarks/bench_budget_extractor.py).
+        """
+        # Sin columna de actividad o de valor unitario ninguna fila es válida
+        if "actividad" not in column_mapping or "valor_unitario" not in column_mapping or df.empty:
+            return []
+        
+        # Filas vacías, encabezados repetidos y filas de totales/notas
+        raw_names = self._column(df, column_mapping["actividad"])
+        valid = raw_names.notna()
+        names = raw_names[valid].map(str).str.strip()
+        names_lower = raw_names[valid].map(str).str.lower().str.strip()
+        valid[valid] = (
+            names.ne("")
+            & ~names_lower.str.contains(self._header_pattern, regex=True)
+            & ~names_lower.str.contains(self._ignore_pattern, regex=True)
+        ).to_numpy()
+        
+        # Validación estricta: cantidad > 0 (si hay columna) y valor unitario > 0
+        if "cantidad" in column_mapping:
+            cantidad = self._numeric_column(self._column(df, column_mapping["cantidad"]))
+            valid &= cantidad.gt(0)
+        else:
+            cantidad = pd.Series(1, index=df.index)
+        valor_unitario = self._numeric_column(self._column(df, column_mapping["valor_unitario"]))
+        valid &= valor_unitario.gt(0)
+        
+        if not valid.any():
+            return []
+        
+        rows = df.index[valid]
+        nombres = names.loc[rows]
+        cantidad = cantidad.loc[rows]
+        valor_unitario = valor_unitario.loc[rows]
+        
+        if "total" in column_mapping:
+            total = self._numeric_column(self._column(df, column_mapping["total"])).loc[rows].fillna(0)
+        else:
+            total = valor_unitario * cantidad
+        
+        if "periodo" in column_mapping:
+            periodo = self._numeric_column(self._column(df, column_mapping["periodo"])).loc[rows].fillna(1)
+        else:
+            periodo = pd.Series(1, index=rows)
+        
+        # Prioridad del rubro: columna > nombre > hoja
+        rubro = pd.Series(None, index=rows, dtype=object)
+        if "rubro" in column_mapping:
+            rubro = self._identify_rubros(self._column(df, column_mapping["rubro"]).loc[rows])
+        rubro = rubro.fillna(self._identify_rubros(nombres))
+        rubro = rubro.fillna(self.identify_rubro_from_text(sheet_name) or "Otros")
+        
+        justificacion = self._text_column(df, column_mapping, "justificacion", rows)
+        especificaciones = self._text_column(df, column_mapping, "especificaciones", rows)
+        # Fila de origen en la hoja o tabla (la fila 1 es el encabezado)
+        source_rows = [int(idx) + 2 for idx in rows]
+        
+        return [
+            {
+                "nombre": nombre,
+                "rubro": rubro_value,
+                "cantidad": cantidad_value,
+                "valor_unitario": valor_value,
+                "total": total_value,
+                "justificacion": justificacion_value,
+                "especificaciones_tecnicas": specs_value,
+                "periodo": periodo_value,
+                "source_sheet": sheet_name,
+                "has_budget_values": total_value > 0,
+                "source_row": source_row,
+            }
+            for nombre, rubro_value, cantidad_value, valor_value, total_value,
+                justificacion_value, specs_value, periodo_value, source_row in zip(
+                nombres.tolist(), rubro.tolist(), cantidad.tolist(), valor_unitario.tolist(),
+                total.tolist(), justificacion, especificaciones, periodo.tolist(), source_rows,
+            )
+        ]
+    
+    @staticmethod
+    def _column(df: pd.DataFrame, label: Any) -> pd.Series:
+        column = df[label]
+        # Las tablas de Word pueden repetir encabezados: usar la primera columna
+        if isinstance(column, pd.DataFrame):
+            column = column.iloc[:, 0]
+        return column
+    
+    def _numeric_column(self, column: pd.Series) -> pd.Series:
+        """Números de la columna (formatos COP, ver services/number_parser.py): NaN donde no hay número"""
+        return parse_number_series(column)
+    
+    def _identify_rubros(self, column: pd.Series) -> pd.Series:
+        """`identify_rubro_from_text` sobre una columna, evaluado una vez por valor distinto"""
+        present = column.dropna().map(str)
+        rubros = {value: self.identify_rubro_from_text(value) for value in present.unique()}
+        return present.map(rubros).reindex(column.index)
+    
+    @staticmethod
+    def _text_column(df: pd.DataFrame, column_mapping: Dict[str, str], key: str, rows: pd.Index) -> List[str]:
+        if key not in column_mapping:
+            return [""] * len(rows)
+        column = BudgetExtractor._column(df, column_mapping[key]).loc[rows]
+        return [str(value) if pd.notna(value) else "" for value in column.tolist()]
     
     def _map_columns(self, df: pd.DataFrame) -> Dict[str, str]:
         """Mapear columnas del DataFrame a tipos conocidos"""
@@ -208,152 +328,6 @@ class BudgetExtractor:
         
         return column_mapping
     
-    def _is_empty_or_header_row(self, row: pd.Series, column_mapping: Dict[str, str]) -> bool:
-        """Verificar si una fila está vacía o es un encabezado adicional"""
-        # Si la columna de actividad está vacía, saltar
-        if "actividad" in column_mapping:
-            actividad_col = column_mapping["actividad"]
-            value = row[actividad_col]
-            
-            if pd.isna(value) or str(value).strip() == "":
-                return True
-            
-            # Si parece ser un encabezado o palabra clave a ignorar
-            value_lower = str(value).lower().strip()
-            if any(header in value_lower for header in ["actividad", "descripción", "descripcion", "item", "ítem"]):
-                return True
-            
-            # Ignorar filas con palabras clave (TOTAL, SUBTOTAL, NOTA, etc.)
-            if any(keyword in value_lower for keyword in self.ignore_keywords):
-                return True
-        
-        return False
-    
-    async def _extract_activity_from_row(
-        self, 
-        row: pd.Series, 
-        column_mapping: Dict[str, str],
-        sheet_name: str
-    ) -> Optional[Dict[str, Any]]:
-        """Extraer información de actividad desde una fila"""
-        try:
-            activity = {}
-            
-            # Nombre/Descripción de la actividad
-            if "actividad" in column_mapping:
-                nombre = str(row[column_mapping["actividad"]])
-                if pd.notna(nombre) and nombre.strip():
-                    activity["nombre"] = nombre.strip()
-                else:
-                    return None
-            else:
-                return None
-            
-            # Identificar rubro basándose en el nombre y/o sheet
-            rubro_from_name = self.identify_rubro_from_text(activity["nombre"])
-            rubro_from_sheet = self.identify_rubro_from_text(sheet_name)
-            
-            # Verificar si hay columna de rubro explícita
-            rubro_from_column = None
-            if "rubro" in column_mapping:
-                rubro_value = row[column_mapping["rubro"]]
-                if pd.notna(rubro_value):
-                    rubro_from_column = self.identify_rubro_from_text(str(rubro_value))
-            
-            # Prioridad: columna > nombre > sheet
-            activity["rubro"] = rubro_from_column or rubro_from_name or rubro_from_sheet or "Otros"
-            
-            # Extraer valores numéricos con validación estricta
-            if "cantidad" in column_mapping:
-                cantidad = row[column_mapping["cantidad"]]
-                cantidad_val = self._safe_numeric(cantidad)
-                # Validar que CANTIDAD sea numérica > 0
-                if cantidad_val is None or cantidad_val <= 0:
-                    logger.debug(f"Fila ignorada: cantidad inválida ({cantidad}) para actividad '{activity['nombre']}'")
-                    return None
-                activity["cantidad"] = cantidad_val
-            else:
-                activity["cantidad"] = 1
-            
-            if "valor_unitario" in column_mapping:
-                valor_unitario = row[column_mapping["valor_unitario"]]
-                valor_unitario_val = self._safe_numeric(valor_unitario)
-                # Validar que VALOR UNITARIO sea numérico > 0
-                if valor_unitario_val is None or valor_unitario_val <= 0:
-                    logger.debug(f"Fila ignorada: valor unitario inválido ({valor_unitario}) para actividad '{activity['nombre']}'")
-                    return None
-                activity["valor_unitario"] = valor_unitario_val
-            else:
-                # Si no hay valor unitario, no podemos calcular total
-                logger.debug(f"Fila ignorada: falta valor unitario para actividad '{activity['nombre']}'")
-                return None
-            
-            if "total" in column_mapping:
-                total = row[column_mapping["total"]]
-                activity["total"] = self._safe_numeric(total, 0)
-            else:
-                # Calcular total si no está presente
-                if activity["valor_unitario"] is not None:
-                    activity["total"] = activity["valor_unitario"] * activity["cantidad"]
-                else:
-                    activity["total"] = None
-            
-            # Justificación/Especificaciones
-            if "justificacion" in column_mapping:
-                justif = row[column_mapping["justificacion"]]
-                activity["justificacion"] = str(justif) if pd.notna(justif) else ""
-            else:
-                activity["justificacion"] = ""
-            
-            if "especificaciones" in column_mapping:
-                specs = row[column_mapping["especificaciones"]]
-                activity["especificaciones_tecnicas"] = str(specs) if pd.notna(specs) else ""
-            else:
-                activity["especificaciones_tecnicas"] = ""
-            
-            # Periodo
-            if "periodo" in column_mapping:
-                periodo = row[column_mapping["periodo"]]
-                activity["periodo"] = self._safe_numeric(periodo, 1)
-            else:
-                activity["periodo"] = 1
-            
-            # Metadatos
-            activity["source_sheet"] = sheet_name
-            activity["has_budget_values"] = activity["total"] is not None and activity["total"] > 0
-            
-            return activity
-            
-        except Exception as e:
-            logger.warning(f"Error extrayendo actividad de fila: {str(e)}")
-            return None
-    
-    def _safe_numeric(self, value: Any, default: Optional[float] = None) -> Optional[float]:
-        """
-        Convertir un valor a numérico de forma segura.
-        Retorna None si no se puede convertir (para validación estricta).
-        """
-        if pd.isna(value):
-            return default
-        
-        try:
-            # Si es string, limpiar formato (comas, símbolos de moneda, etc.)
-            if isinstance(value, str):
-                # Remover símbolos de moneda y separadores de miles
-                cleaned = re.sub(r'[^\d.,\-]', '', value)
-                # Reemplazar coma por punto si es separador decimal
-                if ',' in cleaned and '.' not in cleaned:
-                    cleaned = cleaned.replace(',', '.')
-                elif ',' in cleaned and '.' in cleaned:
-                    # Asumimos que coma es separador de miles
-                    cleaned = cleaned.replace(',', '')
-                
-                return float(cleaned) if cleaned else default
-            
-            return float(value)
-        except (ValueError, TypeError):
-            return default
-    
     def _group_activities_by_rubro(self, activities: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
         """Agrupar actividades por rubro"""
         grouped = {}
@@ -371,6 +345,9 @@ class BudgetExtractor:
         Extraer actividades desde un documento Word.
         Busca tablas y texto estructurado.
         """
+        return await asyncio.to_thread(self._extract_docx, file_path)
+    
+    def _extract_docx(self, file_path: str) -> Dict[str, Any]:
         try:
             from docx import Document
             
@@ -379,12 +356,12 @@ class BudgetExtractor:
             
             # Buscar en tablas
             for table_idx, table in enumerate(doc.tables):
-                activities = await self._extract_from_docx_table(table, table_idx)
+                activities = self._extract_from_docx_table(table, table_idx)
                 all_activities.extend(activities)
             
             # Si no se encontraron tablas, buscar en texto
             if not all_activities:
-                activities = await self._extract_from_docx_text(doc)
+                activities = self._extract_from_docx_text(doc)
                 all_activities.extend(activities)
             
             grouped_by_rubro = self._group_activities_by_rubro(all_activities)
@@ -402,7 +379,7 @@ class BudgetExtractor:
             logger.error(f"Error extrayendo desde DOCX: {str(e)}")
             raise Exception(f"Error procesando DOCX: {str(e)}")
     
-    async def _extract_from_docx_table(self, table, table_idx: int) -> List[Dict[str, Any]]:
+    def _extract_from_docx_table(self, table, table_idx: int) -> List[Dict[str, Any]]:
         """Extraer actividades de una tabla en Word"""
         activities = []
         
@@ -421,7 +398,7 @@ class BudgetExtractor:
             
             # Procesar como DataFrame
             if self._is_budget_sheet(df):
-                activities = await self._extract_activities_from_dataframe(
+                activities = self._extract_activities_from_dataframe(
                     df, 
                     f"Tabla_{table_idx + 1}"
                 )
@@ -431,7 +408,7 @@ class BudgetExtractor:
         
         return activities
     
-    async def _extract_from_docx_text(self, doc) -> List[Dict[str, Any]]:
+    def _extract_from_docx_text(self, doc) -> List[Dict[str, Any]]:
         """Extraer actividades del texto plano del documento"""
         # Esta es una implementación básica
         # En producción, podrías usar NLP más avanzado o LLM para extraer
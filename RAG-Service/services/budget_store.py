@@ -0,0 +1,175 @@
+"""
+Tabla estructurada de ítems de presupuesto por proyecto.
+
+Al subir un Excel o DOCX, BudgetExtractor se ejecuta una sola vez sobre el
+archivo original y sus actividades (rubro, cantidad, valor unitario, total,
+hoja y fila de origen) se guardan en SQLite. La generación de presupuestos,
+las sugerencias y las preguntas de presupuesto en /query se resuelven con
+consultas indexadas sobre esta tabla en lugar de volver a recorrer el texto
+de todos los documentos.
+"""
+
+import os
+import sqlite3
+import threading
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_ITEM_FIELDS = (
+    "nombre", "rubro", "cantidad", "valor_unitario", "total", "periodo",
+    "justificacion", "especificaciones_tecnicas", "source_sheet", "source_row",
+)
+
+
+class BudgetStore:
+    """Ítems de presupuesto extraídos de los documentos, indexados por proyecto y rubro"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS budget_documents (
+                document_id TEXT PRIMARY KEY,
+                project_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                content_hash TEXT,
+                total_items INTEGER NOT NULL,
+                indexed_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_budget_documents_project ON budget_documents(project_id);
+            CREATE TABLE IF NOT EXISTS budget_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                document_id TEXT NOT NULL,
+                project_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                nombre TEXT NOT NULL,
+                rubro TEXT NOT NULL,
+                cantidad REAL,
+                valor_unitario REAL,
+                total REAL,
+                periodo REAL,
+                justificacion TEXT,
+                especificaciones_tecnicas TEXT,
+                source_sheet TEXT,
+                source_row INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_budget_items_project_rubro ON budget_items(project_id, rubro);
+            CREATE INDEX IF NOT EXISTS idx_budget_items_document ON budget_items(document_id);
+        """)
+        self._conn.commit()
+
+    def replace_document(self, document_id: str, project_id: Any, filename: str,
+                         activities: List[Dict[str, Any]], content_hash: Optional[str] = None) -> int:
+        """Guardar (reemplazando lo anterior) las actividades extraídas de un documento"""
+        rows = []
+        for activity in activities:
+            rows.append((
+                document_id, str(project_id), filename,
+                str(activity.get("nombre", "")), activity.get("rubro") or "Otros",
+                activity.get("cantidad"), activity.get("valor_unitario"), activity.get("total"),
+                activity.get("periodo"), activity.get("justificacion", ""),
+                activity.get("especificaciones_tecnicas", ""),
+                str(activity.get("source_sheet", "")), activity.get("source_row"),
+            ))
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM budget_items WHERE document_id = ?", (document_id,))
+                self._conn.executemany(
+                    """
+                    INSERT INTO budget_items (
+                        document_id, project_id, filename, nombre, rubro, cantidad, valor_unitario,
+                        total, periodo, justificacion, especificaciones_tecnicas, source_sheet, source_row
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    rows,
+                )
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO budget_documents (
+                        document_id, project_id, filename, content_hash, total_items, indexed_at
+                    ) VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (document_id, str(project_id), filename, content_hash, len(rows), datetime.now().isoformat()),
+                )
+        return len(rows)
+
+    def delete_document(self, document_id: str) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM budget_items WHERE document_id = ?", (document_id,))
+                self._conn.execute("DELETE FROM budget_documents WHERE document_id = ?", (document_id,))
+
+    def indexed_documents(self, project_id: Any) -> Dict[str, int]:
+        """document_id -> número de ítems, de los documentos del proyecto ya procesados"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT document_id, total_items FROM budget_documents WHERE project_id = ?",
+                (str(project_id),)
+            ).fetchall()
+        return {row["document_id"]: row["total_items"] for row in rows}
+
+    def list_items(self, project_id: Any, rubro: Optional[str] = None,
+                   document_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Ítems del proyecto con la misma forma que las actividades de BudgetExtractor"""
+        query = f"SELECT filename, {', '.join(_ITEM_FIELDS)} FROM budget_items WHERE project_id = ?"
+        params: List[Any] = [str(project_id)]
+        if rubro is not None:
+            query += " AND rubro = ?"
+            params.append(rubro)
+        if document_ids is not None:
+            query += f" AND document_id IN ({','.join('?' * len(document_ids))})"
+            params.extend(document_ids)
+        query += " ORDER BY id"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+
+        items = []
+        for row in rows:
+            item = dict(row)
+            item["has_budget_values"] = bool(item["total"] and item["total"] > 0)
+            items.append(item)
+        return items
+
+    def rubro_totals(self, project_id: Any) -> List[Dict[str, Any]]:
+        """Total, número de ítems e ítems sin valor por rubro, de mayor a menor total"""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT rubro,
+                       COUNT(*) AS items,
+                       COALESCE(SUM(CASE WHEN total > 0 THEN total END), 0) AS total,
+                       SUM(CASE WHEN total IS NULL OR total <= 0 THEN 1 ELSE 0 END) AS items_without_budget
+                FROM budget_items
+                WHERE project_id = ?
+                GROUP BY rubro
+                ORDER BY total DESC
+                """,
+                (str(project_id),)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def top_items(self, project_id: Any, rubro: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Ítems de mayor valor de un rubro"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT filename, {', '.join(_ITEM_FIELDS)}
+                FROM budget_items
+                WHERE project_id = ? AND rubro = ? AND total > 0
+                ORDER BY total DESC
+                LIMIT ?
+                """,
+                (str(project_id), rubro, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,335 @@
+"""
+Chunking de documentos para el índice vectorial.
+
+Los documentos llegan como una secuencia de segmentos con estructura (páginas
+de PDF, títulos y párrafos de DOCX, hojas de Excel). Un chunker los convierte
+en chunks con sus offsets de caracteres dentro del texto del documento, que es
+"\\n".join(segment.text for segment in segments).
+
+- `StructuredTokenChunker` (por defecto): mide los chunks en tokens del modelo
+  de embeddings y no supera su longitud máxima de secuencia, así todo el texto
+  guardado se embebe. Un chunk nunca cruza una página, una sección de DOCX o
+  una hoja; en las hojas cada chunk es un grupo de filas con el encabezado.
+- `FixedSizeChunker`: ventanas de 1000 caracteres con solapamiento de 200, el
+  corte original del servicio.
+
+Se elige con RAG_CHUNKER=token|fixed.
+"""
+
+import os
+import re
+import copy
+import threading
+import logging
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+class Segment(NamedTuple):
+    """Fragmento estructural de un documento"""
+    text: str
+    kind: str = "text"   # page | heading | paragraph | sheet | text
+    label: str = ""      # p. ej. "Página 3", nombre de la hoja o del título
+
+
+class Chunk(NamedTuple):
+    text: str
+    char_start: int
+    char_end: int
+    kind: str = "text"
+    label: str = ""
+
+
+# Unidad de empaquetado: (texto, inicio, fin) con offsets absolutos
+_Unit = Tuple[str, int, int]
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+_WORD = re.compile(r"\S+")
+
+
+def _as_segments(segments: Iterable[Union[Segment, str]]) -> Iterator[Segment]:
+    for segment in segments:
+        yield segment if isinstance(segment, Segment) else Segment(segment)
+
+
+class TokenCounter:
+    """Cuenta tokens con el tokenizer del modelo de embeddings (o una aproximación)"""
+
+    def __init__(self, tokenizer=None):
+        # Copia propia: el tokenizer del modelo lo usa el hilo de embeddings y los
+        # tokenizers rápidos no admiten uso concurrente desde varios hilos
+        self._tokenizer = None
+        if tokenizer is not None:
+            try:
+                self._tokenizer = copy.deepcopy(tokenizer)
+            except Exception:
+                self._tokenizer = tokenizer
+        self._lock = threading.Lock()
+
+    def count_many(self, texts: Sequence[str]) -> List[int]:
+        if not texts:
+            return []
+        if self._tokenizer is None:
+            # Aproximación para español: ~1.5 tokens por palabra en tokenizers subword
+            return [int(len(text.split()) * 1.5) + 1 for text in texts]
+        with self._lock:
+            encoded = self._tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def count(self, text: str) -> int:
+        return self.count_many([text])[0]
+
+
+class FixedSizeChunker:
+    """Ventanas de `chunk_size` caracteres con `overlap`, cortando en fin de oración"""
+
+    def __init__(self, chunk_size: int = 1000, overlap: int = 200):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+
+    def chunk(self, segments: Iterable[Union[Segment, str]]) -> Iterator[Chunk]:
+        """
+        Cortar "\\n".join(segments).strip() sin materializar el texto completo:
+        solo se retiene la ventana actual y cada chunk se emite en cuanto llega
+        texto suficiente para decidir su final.
+        """
+        chunk_size, overlap = self.chunk_size, self.overlap
+        buffer = ""
+        base = 0          # offset absoluto de buffer[0]
+        position = 0      # offset absoluto del próximo segmento
+        started = False
+        emitted = False
+
+        for segment in _as_segments(segments):
+            text = segment.text
+            if not started:
+                # Equivale al strip() inicial del texto completo
+                stripped = text.lstrip()
+                if stripped:
+                    started = True
+                    buffer = stripped
+                    base = position + len(text) - len(stripped)
+            else:
+                buffer += "\n" + text
+            position += len(text) + 1
+
+            # Solo se corta cuando el final de la ventana cae antes del texto que
+            # aún podría eliminarse con el strip() final
+            while len(buffer.rstrip()) > chunk_size:
+                end = self._find_chunk_end(buffer, chunk_size)
+                chunk = self._make_chunk(buffer[:end], base)
+                if chunk:
+                    yield chunk
+                emitted = True
+                buffer = buffer[end - overlap:]
+                base += end - overlap
+
+        text = buffer.rstrip()
+        if not emitted and len(text) <= chunk_size:
+            yield Chunk(text, base, base + len(text))
+            return
+
+        start = 0
+        while start < len(text):
+            end = start + chunk_size
+
+            # Intentar dividir en un punto lógico (final de oración)
+            if end < len(text):
+                end = start + self._find_chunk_end(text[start:], chunk_size)
+
+            chunk = self._make_chunk(text[start:end], base + start)
+            if chunk:
+                yield chunk
+
+            start = end - overlap
+            if start >= len(text):
+                break
+
+    @staticmethod
+    def _make_chunk(window: str, offset: int) -> Optional[Chunk]:
+        chunk = window.strip()
+        if not chunk:
+            return None
+        start = offset + len(window) - len(window.lstrip())
+        return Chunk(chunk, start, start + len(chunk))
+
+    @staticmethod
+    def _find_chunk_end(text: str, chunk_size: int) -> int:
+        """Final de la ventana que empieza en 0: el último .!? de sus 100 caracteres finales"""
+        end = chunk_size
+        # Buscar el último punto, exclamación o interrogación
+        for i in range(end, max(chunk_size // 2, end - 100), -1):
+            if text[i] in '.!?':
+                return i + 1
+        return end
+
+
+class StructuredTokenChunker:
+    """Empaqueta líneas/párrafos en chunks de hasta `max_tokens` respetando la estructura"""
+
+    def __init__(self, counter: TokenCounter, max_tokens: int):
+        self.counter = counter
+        self.max_tokens = max_tokens
+
+    def chunk(self, segments: Iterable[Union[Segment, str]]) -> Iterator[Chunk]:
+        position = 0
+        # Sección de DOCX en curso: título + párrafos hasta el siguiente título
+        heading: Optional[Segment] = None
+        heading_start = 0
+        section_units: List[_Unit] = []
+
+        for segment in _as_segments(segments):
+            start = position
+            position += len(segment.text) + 1
+
+            if segment.kind in ("heading", "paragraph"):
+                if segment.kind == "heading" and heading is not None and not section_units:
+                    # Títulos seguidos (p. ej. capítulo y subtítulo) forman un único encabezado
+                    heading = Segment(f"{heading.text}\n{segment.text}", "heading", segment.text.strip())
+                elif segment.kind == "heading":
+                    yield from self._flush_section(heading, heading_start, section_units)
+                    heading, heading_start, section_units = segment, start, []
+                else:
+                    section_units.extend(self._lines(segment.text, start))
+                continue
+
+            yield from self._flush_section(heading, heading_start, section_units)
+            heading, section_units = None, []
+
+            if segment.kind == "sheet":
+                yield from self._chunk_sheet(segment, start)
+            else:
+                yield from self._pack(self._lines(segment.text, start), "", segment.kind, segment.label)
+
+        yield from self._flush_section(heading, heading_start, section_units)
+
+    def _flush_section(self, heading: Optional[Segment], heading_start: int,
+                       units: List[_Unit]) -> Iterator[Chunk]:
+        if heading is None:
+            yield from self._pack(units, "", "paragraph", "")
+            return
+        title = heading.label or heading.text.strip()
+        heading_units = self._lines(heading.text, heading_start)
+        if not units:
+            yield from self._pack(heading_units, "", "heading", title)
+            return
+        # El título se repite al inicio de cada chunk de la sección como contexto
+        prefix = "\n".join(text for text, _, _ in heading_units)
+        if self.counter.count(prefix) > self.max_tokens // 4:
+            prefix, units = "", heading_units + units
+        yield from self._pack(units, prefix, "heading", title)
+
+    def _chunk_sheet(self, segment: Segment, start: int) -> Iterator[Chunk]:
+        """Grupos de filas de una hoja, cada uno con el nombre de la hoja y el encabezado"""
+        lines = self._lines(segment.text, start)
+        prefix = "\n".join(text for text, _, _ in lines[:2])
+        if len(lines) <= 2 or self.counter.count(prefix) > self.max_tokens // 2:
+            yield from self._pack(lines, "", "sheet", segment.label)
+            return
+        yield from self._pack(lines[2:], prefix, "sheet", segment.label)
+
+    def _pack(self, units: List[_Unit], prefix: str, kind: str, label: str) -> Iterator[Chunk]:
+        """Agrupar unidades consecutivas mientras quepan (junto con el prefijo) en max_tokens"""
+        if not units:
+            return
+        budget = self.max_tokens - (self.counter.count(prefix) + 1 if prefix else 0)
+
+        current: List[_Unit] = []
+        used = 0
+        for unit, tokens in self._fit(units, budget):
+            if current and used + tokens > budget:
+                yield self._make_chunk(current, prefix, kind, label)
+                current, used = [], 0
+            current.append(unit)
+            used += tokens
+        if current:
+            yield self._make_chunk(current, prefix, kind, label)
+
+    @staticmethod
+    def _make_chunk(units: List[_Unit], prefix: str, kind: str, label: str) -> Chunk:
+        body = "\n".join(text for text, _, _ in units)
+        text = f"{prefix}\n{body}" if prefix else body
+        return Chunk(text, units[0][1], units[-1][2], kind, label)
+
+    @staticmethod
+    def _lines(text: str, offset: int) -> List[_Unit]:
+        """Líneas no vacías del texto (sin espacios en los extremos) con sus offsets"""
+        units: List[_Unit] = []
+        position = 0
+        for line in text.split("\n"):
+            stripped = line.strip()
+            if stripped:
+                start = offset + position + len(line) - len(line.lstrip())
+                units.append((stripped, start, start + len(stripped)))
+            position += len(line) + 1
+        return units
+
+    def _fit(self, units: List[_Unit], limit: int) -> List[Tuple[_Unit, int]]:
+        """Unidades con su número de tokens; las que superan `limit` se parten en oraciones o palabras"""
+        counts = self.counter.count_many([text for text, _, _ in units])
+        result: List[Tuple[_Unit, int]] = []
+        for unit, tokens in zip(units, counts):
+            if tokens <= limit:
+                result.append((unit, tokens))
+                continue
+            sentences = self._split_by(unit, _SENTENCE_END)
+            sentence_counts = self.counter.count_many([text for text, _, _ in sentences])
+            for sentence, sentence_tokens in zip(sentences, sentence_counts):
+                if sentence_tokens <= limit:
+                    result.append((sentence, sentence_tokens))
+                else:
+                    result.extend(self._split_words(sentence, limit))
+        return result
+
+    @staticmethod
+    def _split_by(unit: _Unit, pattern: "re.Pattern") -> List[_Unit]:
+        text, offset, _ = unit
+        parts: List[_Unit] = []
+        start = 0
+        for match in pattern.finditer(text):
+            parts.append((text[start:match.start()], offset + start, offset + match.start()))
+            start = match.end()
+        parts.append((text[start:], offset + start, offset + len(text)))
+        return [part for part in parts if part[0]]
+
+    def _split_words(self, unit: _Unit, limit: int) -> List[Tuple[_Unit, int]]:
+        """Agrupar palabras hasta `limit` tokens (para textos largos sin puntuación)"""
+        text, offset, _ = unit
+        words = [(m.start(), m.end()) for m in _WORD.finditer(text)]
+        counts = self.counter.count_many([text[start:end] for start, end in words])
+        pieces: List[Tuple[_Unit, int]] = []
+        group_start, group_end, used = None, None, 0
+        for (start, end), tokens in zip(words, counts):
+            if group_start is not None and used + tokens > limit:
+                pieces.append(((text[group_start:group_end], offset + group_start, offset + group_end), used))
+                group_start, used = None, 0
+            if group_start is None:
+                group_start = start
+            group_end = end
+            used += tokens
+        if group_start is not None:
+            pieces.append(((text[group_start:group_end], offset + group_start, offset + group_end), used))
+        return pieces
+
+
+def build_chunker(name: Optional[str] = None, embedding_model=None):
+    """Construir el chunker configurado en RAG_CHUNKER ("token" por defecto, o "fixed")"""
+    name = (name or os.getenv("RAG_CHUNKER", "token")).lower()
+    if name == "fixed":
+        return FixedSizeChunker()
+    if name != "token":
+        raise ValueError(f"Chunker desconocido: {name}")
+
+    tokenizer = getattr(embedding_model, "tokenizer", None)
+    max_seq_length = getattr(embedding_model, "max_seq_length", None) or 128
+    # Los tokens especiales ([CLS]/[SEP] o <s>/</s>) ocupan dos posiciones
+    max_tokens = int(os.getenv("RAG_CHUNK_MAX_TOKENS", str(max_seq_length - 2)))
+    if max_tokens > max_seq_length - 2:
+        logger.warning(
+            f"RAG_CHUNK_MAX_TOKENS={max_tokens} supera la longitud máxima del modelo "
+            f"({max_seq_length}); el final de los chunks no se embeberá"
+        )
+    if tokenizer is None:
+        logger.warning("El modelo de embeddings no expone tokenizer; se aproxima el conteo de tokens")
+    return StructuredTokenChunker(TokenCounter(tokenizer), max_tokens=max_tokens)
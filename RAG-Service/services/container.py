@@ -0,0 +1,341 @@
+"""
+Contenedor de servicios compartidos del proceso.
+
+Construye de forma perezosa (la primera vez que se piden) y una sola vez por
+proceso los recursos costosos: modelo de embeddings, cliente de ChromaDB y
+cliente LLM, y a partir de ellos los servicios de la aplicación. Las funciones
+get_* se usan directamente como dependencias de FastAPI (Depends).
+"""
+
+import os
+import threading
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "./chroma_db")
+RAG_DATA_DIR = os.getenv("RAG_DATA_DIR", "./rag_data")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./uploads")
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+PRICE_CATALOG_SIMILARITY_THRESHOLD = float(os.getenv("PRICE_CATALOG_SIMILARITY_THRESHOLD", "0.9"))
+COLLECTION_NAME = "project_documents"
+
+_instances: Dict[str, Any] = {}
+_lock = threading.RLock()
+
+
+def _singleton(name: str, factory: Callable[[], Any]) -> Any:
+    """Devolver la instancia registrada con `name`, creándola una sola vez."""
+    if name in _instances:
+        return _instances[name]
+    with _lock:
+        if name not in _instances:
+            _instances[name] = factory()
+        return _instances[name]
+
+
+def _build_embedding_model():
+    from sentence_transformers import SentenceTransformer
+
+    logger.info(f"Cargando modelo de embeddings '{EMBEDDING_MODEL_NAME}'")
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+
+def _build_embedding_executor():
+    from .embedding_executor import EmbeddingExecutor
+
+    return EmbeddingExecutor(
+        get_embedding_model(),
+        max_batch_size=EMBEDDING_BATCH_SIZE,
+        max_wait_ms=EMBEDDING_BATCH_WAIT_MS,
+    )
+
+
+def _build_embedding_cache():
+    from .embedding_cache import EmbeddingCache
+
+    try:
+        return EmbeddingCache(
+            os.path.join(RAG_DATA_DIR, "embedding_cache.db"),
+            model_name=EMBEDDING_MODEL_NAME,
+            max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+        )
+    except Exception as e:
+        # Sin caché la ingesta sigue funcionando, solo codifica todos los chunks
+        logger.warning(f"Caché de embeddings no disponible: {e}")
+        return None
+
+
+def _build_chunker():
+    from .chunking import build_chunker
+
+    return build_chunker(embedding_model=get_embedding_model())
+
+
+def _build_document_manifest():
+    from .document_manifest import DocumentManifest
+
+    return DocumentManifest(os.path.join(RAG_DATA_DIR, "document_manifest.db"))
+
+
+def _build_blob_store():
+    from .blob_store import BlobStore
+
+    return BlobStore(os.path.join(UPLOAD_DIR, "blobs"))
+
+
+def _build_budget_store():
+    from .budget_store import BudgetStore
+
+    return BudgetStore(os.path.join(RAG_DATA_DIR, "budget_items.db"))
+
+
+def _build_lexical_index():
+    from .lexical_index import LexicalIndex
+
+    try:
+        return LexicalIndex(os.path.join(RAG_DATA_DIR, "lexical_index.db"))
+    except Exception as e:
+        # Sin índice léxico las consultas usan solo la búsqueda vectorial
+        logger.warning(f"Índice léxico no disponible: {e}")
+        return None
+
+
+def _build_price_catalog():
+    from .price_catalog import PriceCatalog
+
+    try:
+        embedder = get_embedding_executor()
+    except Exception as e:
+        # Sin modelo de embeddings el catálogo solo resuelve descripciones idénticas
+        logger.warning(f"Catálogo de precios sin búsqueda semántica: {e}")
+        embedder = None
+    try:
+        return PriceCatalog(
+            os.path.join(RAG_DATA_DIR, "price_catalog.db"),
+            embedder=embedder,
+            similarity_threshold=PRICE_CATALOG_SIMILARITY_THRESHOLD,
+        )
+    except Exception as e:
+        logger.warning(f"Catálogo de precios no disponible: {e}")
+        return None
+
+
+def _build_context_packer():
+    from .context_packer import build_context_packer
+
+    return build_context_packer()
+
+
+def _build_chroma_client():
+    try:
+        import chromadb
+        from chromadb.config import Settings
+    except Exception as e:
+        logger.warning(f"ChromaDB no disponible: {e}")
+        return None
+
+    try:
+        return chromadb.PersistentClient(
+            path=CHROMA_DB_PATH,
+            settings=Settings(anonymized_telemetry=False)
+        )
+    except Exception as e:
+        logger.warning(f"Falló la inicialización de ChromaDB: {e}")
+        return None
+
+
+def _build_chroma_collection():
+    client = get_chroma_client()
+    if client is None:
+        logger.warning("Ejecutando sin ChromaDB - búsqueda vectorial deshabilitada")
+        return None
+    return client.get_or_create_collection(
+        name=COLLECTION_NAME,
+        metadata={"description": "Documentos de proyectos para RAG"}
+    )
+
+
+def _build_llm_service():
+    from .llm_service import LLMService
+
+    try:
+        return LLMService(context_packer=get_context_packer())
+    except Exception as e:
+        # Sin API key configurada los servicios trabajan en modo básico
+        logger.warning(f"LLM no disponible. Usando modo básico. Error: {str(e)}")
+        return None
+
+
+def get_embedding_model():
+    """Modelo SentenceTransformer compartido por todo el proceso."""
+    return _singleton("embedding_model", _build_embedding_model)
+
+
+def get_embedding_executor():
+    """Ejecutor con micro-batching; único punto que llama a `encode` del modelo."""
+    return _singleton("embedding_executor", _build_embedding_executor)
+
+
+def get_embedding_cache():
+    """Caché persistente de embeddings de chunks (None si no se pudo abrir)."""
+    return _singleton("embedding_cache", _build_embedding_cache)
+
+
+def get_chunker():
+    """Chunker de ingesta configurado con RAG_CHUNKER (token por defecto, o fixed)."""
+    return _singleton("chunker", _build_chunker)
+
+
+def get_document_manifest():
+    """Manifiesto de documentos indexados (listado y borrado sin leer chunks)."""
+    return _singleton("document_manifest", _build_document_manifest)
+
+
+def get_blob_store():
+    """Archivos originales subidos, direccionados por SHA-256."""
+    return _singleton("blob_store", _build_blob_store)
+
+
+def get_budget_store():
+    """Tabla de ítems de presupuesto extraídos de los Excel/DOCX subidos."""
+    return _singleton("budget_store", _build_budget_store)
+
+
+def get_lexical_index():
+    """Índice BM25 de los chunks por proyecto para la búsqueda híbrida (None si no se pudo abrir)."""
+    return _singleton("lexical_index", _build_lexical_index)
+
+
+def get_price_catalog():
+    """Catálogo de precios unitarios conocidos (None si no se pudo abrir)."""
+    return _singleton("price_catalog", _build_price_catalog)
+
+
+def get_context_packer():
+    """Contexto de los prompts por presupuesto de tokens de cada tarea."""
+    return _singleton("context_packer", _build_context_packer)
+
+
+def get_chroma_client():
+    """Único cliente persistente de ChromaDB sobre CHROMA_DB_PATH."""
+    return _singleton("chroma_client", _build_chroma_client)
+
+
+def get_chroma_collection():
+    """Colección `project_documents` (None si ChromaDB no está disponible)."""
+    return _singleton("chroma_collection", _build_chroma_collection)
+
+
+def get_llm_service():
+    """Cliente LLM compartido, o None si no hay proveedor configurado."""
+    return _singleton("llm_service", _build_llm_service)
+
+
+def get_document_processor():
+    from .document_processor import DocumentProcessor
+
+    return _singleton("document_processor", DocumentProcessor)
+
+
+def get_rag_service():
+    from .rag_service import RAGService
+
+    return _singleton("rag_service", lambda: RAGService(
+        embedding_model=get_embedding_model(),
+        embedder=get_embedding_executor(),
+        embedding_cache=get_embedding_cache(),
+        document_manifest=get_document_manifest(),
+        chunker=get_chunker(),
+        collection=get_chroma_collection(),
+        llm_service=get_llm_service(),
+        blob_store=get_blob_store(),
+        budget_store=get_budget_store(),
+        context_packer=get_context_packer(),
+        lexical_index=get_lexical_index(),
+        ingestion_job_store=get_ingestion_job_store(),
+    ))
+
+
+def get_budget_automation_service():
+    from .budget_automation import BudgetAutomationService
+
+    return _singleton("budget_automation", lambda: BudgetAutomationService(
+        rag_service=get_rag_service(),
+        llm_service=get_llm_service(),
+        budget_store=get_budget_store(),
+        price_catalog=get_price_catalog(),
+        context_packer=get_context_packer(),
+    ))
+
+
+def get_cotizacion_service():
+    from .cotizacion_service import CotizacionService
+
+    return _singleton("cotizacion_service", lambda: CotizacionService(
+        llm_service=get_llm_service(),
+        price_catalog=get_price_catalog(),
+        context_packer=get_context_packer(),
+    ))
+
+
+def get_ingestion_job_store():
+    """Tabla SQLite con el estado y progreso de los trabajos de ingesta."""
+    from .ingestion_jobs import IngestionJobStore
+
+    return _singleton("ingestion_job_store", lambda: IngestionJobStore(
+        os.path.join(RAG_DATA_DIR, "ingestion_jobs.db")
+    ))
+
+
+def get_ingestion_queue():
+    """Cola de ingesta en segundo plano (se arranca en el evento startup)."""
+    from .ingestion_jobs import IngestionJobQueue
+
+    return _singleton("ingestion_queue", lambda: IngestionJobQueue(
+        store=get_ingestion_job_store(),
+        document_processor=get_document_processor(),
+        rag_service=get_rag_service(),
+        workers=INGESTION_WORKERS,
+        blob_store=get_blob_store(),
+        budget_service=get_budget_automation_service(),
+        max_attempts=INGESTION_MAX_ATTEMPTS,
+    ))
+
+
+def get_ingestion_upload_dir() -> str:
+    """Directorio donde se guardan los archivos subidos hasta que se procesan."""
+    path = os.path.join(UPLOAD_DIR, "ingestion")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def shutdown():
+    """Liberar recursos con hilos propios al apagar la aplicación."""
+    executor = _instances.get("embedding_executor")
+    if executor is not None:
+        executor.close()
+    for name in ("document_processor", "embedding_cache", "document_manifest", "budget_store",
+                 "price_catalog", "lexical_index", "ingestion_job_store"):
+        store = _instances.get(name)
+        if store is not None:
+            store.close()
+
+
+def reset(name: Optional[str] = None):
+    """Olvidar una instancia (o todas) para que se reconstruya en el próximo uso."""
+    with _lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
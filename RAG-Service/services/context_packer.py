@@ -0,0 +1,232 @@
+"""
+Empaquetado de contexto para los prompts del LLM por presupuesto de tokens.
+
+Cada tarea (respuesta RAG, generación de presupuesto, estimación de la
+cotización, extracción de actividades...) tiene un presupuesto de tokens de
+entrada configurable con CONTEXT_BUDGET_<TAREA>_TOKENS. El empaquetador:
+
+- cuenta tokens para el proveedor y modelo configurados (tiktoken para OpenAI
+  si está instalado; si no, una aproximación por caracteres del proveedor);
+- ordena los candidatos por relevancia;
+- quita duplicados y el solapamiento entre chunks consecutivos (el chunker fijo
+  repite 200 caracteres entre chunks);
+- llena el presupuesto: un chunk que no cabe completo se recorta al espacio
+  restante en lugar de descartarse, y los descartes quedan en el log.
+"""
+
+import os
+import re
+import math
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Union
+
+logger = logging.getLogger(__name__)
+
+# Presupuesto de tokens de entrada por tarea (CONTEXT_BUDGET_<TAREA>_TOKENS)
+DEFAULT_TASK_BUDGETS = {
+    "answer": 6000,                 # chunks recuperados para responder una consulta
+    "answer_project": 400,          # contexto general del proyecto en la respuesta
+    "budget_generation": 600,       # documentos del proyecto al generar presupuestos
+    "cotizacion_estimation": 600,   # contexto adicional al estimar valores de la cotización
+    "cotizacion_narrative": 300,    # descripción del proyecto en la justificación
+    "activity_extraction": 12000,   # documentos del proyecto al extraer actividades
+}
+
+# Caracteres por token en texto en español cuando no hay tokenizer del modelo
+_CHARS_PER_TOKEN = {"openai": 3.5, "gemini": 4.0}
+
+_WHITESPACE = re.compile(r"\s+")
+_MIN_OVERLAP_CHARS = 40
+
+
+class ContextCandidate(NamedTuple):
+    """Texto candidato a entrar en el contexto"""
+    text: str
+    score: float = 0.0
+    source: str = ""    # documento de origen; el solapamiento solo se busca dentro del mismo
+    position: int = 0   # orden original (desempate y salida con keep_order)
+
+
+class PackedContext(NamedTuple):
+    texts: List[str]
+    sources: List[str]
+    tokens: int
+    candidates: int
+    duplicates: int
+    truncated: int
+    dropped: int
+
+
+class LLMTokenCounter:
+    """Cuenta y recorta tokens para el proveedor y modelo del LLM"""
+
+    def __init__(self, provider: str = "gemini", model: Optional[str] = None):
+        self.provider = (provider or "gemini").lower()
+        self.model = model
+        self.chars_per_token = _CHARS_PER_TOKEN.get(self.provider, 3.5)
+        self._encoding = None
+        if self.provider == "openai":
+            try:
+                import tiktoken
+            except ImportError:
+                tiktoken = None
+            if tiktoken is not None:
+                try:
+                    self._encoding = tiktoken.encoding_for_model(model or "gpt-4o-mini")
+                except KeyError:
+                    self._encoding = tiktoken.get_encoding("o200k_base")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Prefijo de `text` con a lo sumo `max_tokens`, cortado en un límite de palabra"""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        if self._encoding is not None:
+            cut = self._encoding.decode(self._encoding.encode(text, disallowed_special=())[:max_tokens])
+        else:
+            cut = text[:int(max_tokens * self.chars_per_token)]
+        # No dejar media palabra al final
+        boundary = cut.rfind(" ")
+        if boundary > len(cut) * 0.8:
+            cut = cut[:boundary]
+        return cut.rstrip()
+
+
+class ContextPacker:
+    """Llena el presupuesto de tokens de cada tarea con los candidatos más relevantes"""
+
+    def __init__(self, counter: LLMTokenCounter, budgets: Optional[Dict[str, int]] = None,
+                 min_chunk_tokens: int = 48, separator_tokens: int = 8, max_overlap_chars: int = 400):
+        self.counter = counter
+        self.budgets = {**DEFAULT_TASK_BUDGETS, **(budgets or {})}
+        # Espacio mínimo para recortar un chunk en lugar de saltarlo
+        self.min_chunk_tokens = min_chunk_tokens
+        # Encabezado y separador que el llamador añade a cada chunk ("--- Documento N ---")
+        self.separator_tokens = separator_tokens
+        self.max_overlap_chars = max_overlap_chars
+
+    def budget(self, task: str) -> int:
+        return self.budgets.get(task, DEFAULT_TASK_BUDGETS["answer"])
+
+    def count(self, text: str) -> int:
+        return self.counter.count(text)
+
+    def fit(self, text: Optional[str], task: str) -> str:
+        """Un solo texto recortado al presupuesto de la tarea"""
+        if not text:
+            return ""
+        return self.counter.truncate(text, self.budget(task))
+
+    def pack(self, candidates: Iterable[Union[ContextCandidate, str]], task: str,
+             max_tokens: Optional[int] = None, keep_order: bool = False) -> PackedContext:
+        """
+        Seleccionar candidatos por relevancia hasta llenar el presupuesto de `task`.
+
+        Los textos se devuelven en orden de relevancia, o en su orden original con
+        keep_order=True (contexto de documentos que se lee de corrido).
+        """
+        items = [
+            candidate if isinstance(candidate, ContextCandidate) else ContextCandidate(candidate, position=position)
+            for position, candidate in enumerate(candidates)
+        ]
+        budget = max_tokens if max_tokens is not None else self.budget(task)
+        ranked = sorted(items, key=lambda candidate: (-candidate.score, candidate.position))
+
+        selected: List[ContextCandidate] = []
+        seen = set()
+        used = 0
+        duplicates = truncated = dropped = 0
+        for candidate in ranked:
+            text = candidate.text.strip()
+            key = _WHITESPACE.sub(" ", text)
+            if not text or key in seen:
+                duplicates += bool(text)
+                continue
+
+            text = self._remove_overlap(text, candidate.source, selected)
+            if not text:
+                duplicates += 1
+                continue
+
+            tokens = self.counter.count(text) + self.separator_tokens
+            remaining = budget - used
+            if tokens > remaining:
+                if remaining - self.separator_tokens < self.min_chunk_tokens:
+                    dropped += 1
+                    continue
+                text = self.counter.truncate(text, remaining - self.separator_tokens)
+                tokens = self.counter.count(text) + self.separator_tokens
+                truncated += 1
+
+            seen.add(key)
+            selected.append(candidate._replace(text=text))
+            used += tokens
+
+        if dropped:
+            logger.info(
+                f"Contexto '{task}': {len(selected)} de {len(items)} fragmentos en {used}/{budget} tokens "
+                f"({dropped} sin espacio, {duplicates} duplicados)"
+            )
+        if keep_order:
+            selected.sort(key=lambda candidate: candidate.position)
+        return PackedContext(
+            texts=[candidate.text for candidate in selected],
+            sources=[candidate.source for candidate in selected],
+            tokens=used,
+            candidates=len(items),
+            duplicates=duplicates,
+            truncated=truncated,
+            dropped=dropped,
+        )
+
+    def _remove_overlap(self, text: str, source: str, selected: Sequence[ContextCandidate]) -> str:
+        """Quitar de `text` lo que ya aportan los fragmentos seleccionados del mismo documento"""
+        for other in selected:
+            if other.source != source:
+                continue
+            if text in other.text:
+                return ""
+            # Final del seleccionado repetido al inicio del candidato, o al revés
+            head = overlap_length(other.text, text, self.max_overlap_chars)
+            if head:
+                text = text[head:].lstrip()
+            tail = overlap_length(text, other.text, self.max_overlap_chars)
+            if tail:
+                text = text[:-tail].rstrip()
+            if not text:
+                return ""
+        return text
+
+
+def overlap_length(left: str, right: str, max_chars: int) -> int:
+    """Longitud del sufijo más largo de `left` que es prefijo de `right`"""
+    limit = min(len(left), len(right), max_chars)
+    if limit < _MIN_OVERLAP_CHARS:
+        return 0
+    tail = left[-limit:]
+    probe = right[:_MIN_OVERLAP_CHARS]
+    start = tail.find(probe)
+    while start != -1:
+        if right.startswith(tail[start:]):
+            return limit - start
+        start = tail.find(probe, start + 1)
+    return 0
+
+
+def build_context_packer() -> ContextPacker:
+    """Empaquetador para el proveedor LLM configurado y los presupuestos del entorno"""
+    provider = os.getenv("LLM_PROVIDER", "gemini").lower()
+    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini") if provider == "openai" else os.getenv("GEMINI_MODEL")
+    budgets = {
+        task: int(os.getenv(f"CONTEXT_BUDGET_{task.upper()}_TOKENS", str(default)))
+        for task, default in DEFAULT_TASK_BUDGETS.items()
+    }
+    return ContextPacker(LLMTokenCounter(provider, model), budgets)
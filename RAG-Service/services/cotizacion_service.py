@@ -5,14 +5,19 @@ Adaptado para el Sistema General de Regalías (SGR) y entidades públicas colomb
 
 import os
 import re
+import copy
 import json
+import asyncio
 import pandas as pd
 import tempfile
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 import logging
 
-from .llm_service import LLMService
+from . import container
+from .blob_store import hash_file
+from .cache import LRUCache
+from .number_parser import parse_number, parse_number_series
 
 logger = logging.getLogger(__name__)
 
@@ -23,16 +28,16 @@ class CotizacionService:
     Lee archivos Excel, valida ítems y genera cotizaciones usando Gemini.
     """
 
-    def __init__(self):
-        # Inicializar servicio LLM
-        try:
-            self.llm_service = LLMService()
-            self.use_llm = True
-        except Exception as e:
-            self.llm_service = None
-            self.use_llm = False
-            logger.warning(
-                f"LLM no disponible para generación de cotizaciones. Error: {str(e)}")
+    def __init__(self, llm_service=None, price_catalog=None, context_packer=None):
+        # Servicio LLM compartido del proceso (ver services/container.py)
+        self.llm_service = llm_service if llm_service is not None else container.get_llm_service()
+        self.use_llm = self.llm_service is not None
+        if not self.use_llm:
+            logger.warning("LLM no disponible para generación de cotizaciones.")
+        # Catálogo de precios conocidos: los ítems ya vistos no se estiman con el LLM
+        self.price_catalog = price_catalog if price_catalog is not None else container.get_price_catalog()
+        # Recorta el contexto del proyecto al presupuesto de tokens de cada prompt
+        self.context_packer = context_packer if context_packer is not None else container.get_context_packer()
 
         # Palabras clave para identificar columnas en español colombiano
         self.column_keywords = {
@@ -59,13 +64,41 @@ class CotizacionService:
             "encabezado", "título", "resumen", "conclusión"
         ]
 
+        # Columna de descripción por hoja SGR (oficial)
+        self.hoja_a_desc = {
+            "01. Talento Humano": "CARGO ESPECÍFICO",
+            "02. Equipos y Software": "EQUIPOS Y SOFTWARE (DESCRIPCIÓN)",
+            "03. Capacitación y Eventos": "CAPACITACIÓN Y EVENTOS (DESCRIPCIÓN)",
+            "04. Servicios Tecnológicos": "SERVICIOS TECNOLÓGICOS (DESCRIPCIÓN)",
+            "05. Materiales, insumos y Doc": "MATERIALES E INSUMOS (DESCRIPCIÓN)",
+            "06. Protección conocimiento y Di": "PROTECCIÓN CONOCIMIENTO Y DIFUSIÓN (DESCRIPCIÓN)",
+            "07. Gastos de viaje": "GASTOS DE VIAJE (DESCRIPCIÓN)",
+            "11. Otros": "OTROS (DESCRIPCIÓN)"
+        }
+
+        # Lectura del Excel: filas donde se busca el encabezado y hojas procesadas a la vez
+        self.filas_busqueda_encabezado = int(os.getenv("COTIZACION_HEADER_SCAN_ROWS", "30"))
+        self.max_hojas_en_paralelo = int(os.getenv("COTIZACION_SHEET_WORKERS", "4"))
+
+        # Ítems leídos y estimados por libro (SHA-256 + parámetros de estimación):
+        # regenerar la misma cotización con otro IVA no vuelve a leer el Excel ni a llamar al LLM
+        self._items_cache = LRUCache(
+            max_entries=int(os.getenv("COTIZACION_CACHE_MAX_FILES", "32")),
+            ttl_seconds=float(os.getenv("COTIZACION_CACHE_TTL_SECONDS", "3600")),
+        )
+
+        # Estimación de valores faltantes: ítems por llamada al LLM y llamadas simultáneas
+        self.items_por_lote_estimacion = int(os.getenv("COTIZACION_ESTIMATION_BATCH_ITEMS", "40"))
+        self.max_lotes_estimacion_en_paralelo = int(os.getenv("COTIZACION_ESTIMATION_CONCURRENCY", "4"))
+
     async def generar_cotizacion_desde_excel(
         self,
         file_path: str,
         incluir_iva: bool = False,
         tasa_iva: float = 0.19,
         project_description: Optional[str] = None,
-        project_context: Optional[str] = None
+        project_context: Optional[str] = None,
+        incluir_narrativa: bool = True
     ) -> Dict[str, Any]:
         """
         Generar cotización desde archivo Excel.
@@ -76,52 +109,68 @@ class CotizacionService:
             tasa_iva: Tasa de IVA (por defecto 0.19 = 19%)
             project_description: Descripción del proyecto (opcional, para estimación de valores)
             project_context: Contexto adicional del proyecto (opcional, para estimación de valores)
+            incluir_narrativa: Si True y hay LLM, agrega un párrafo de justificación bajo la tabla
 
         Returns:
             Diccionario con la cotización en formato markdown y datos estructurados
         """
         try:
-            # Paso 1: Leer y validar Excel
-            items_validos = await self._leer_y_validar_excel(file_path)
-
-            if not items_validos:
-                raise ValueError(
-                    "No se encontraron ítems válidos para cotizar en el archivo.")
-
-            # Paso 1.5: Estimar valores faltantes si hay ítems que lo necesitan
-            items_con_valores_estimados = await self._estimar_valores_faltantes(
-                items_validos,
-                project_description=project_description,
-                project_context=project_context
+            # Paso 1: Ítems del mismo libro ya leídos y estimados con estos parámetros
+            clave_cache = (
+                await asyncio.to_thread(hash_file, file_path),
+                project_description or "",
+                project_context or "",
             )
+            cacheado = self._items_cache.get(clave_cache)
+            desde_cache = cacheado is not None
 
-            # Paso 2: Agrupar por actividad
-            items_por_actividad = self._agrupar_por_actividad(items_con_valores_estimados)
-
-            # Paso 3: Generar cotización con Gemini
-            if self.use_llm and self.llm_service:
-                cotizacion_markdown = await self._generar_cotizacion_con_gemini(
-                    items_por_actividad,
-                    incluir_iva=incluir_iva,
-                    tasa_iva=tasa_iva
-                )
+            if desde_cache:
+                logger.info(f"Cotización desde caché: {len(cacheado['items'])} ítems, sin releer el Excel")
+                items_con_valores_estimados = copy.deepcopy(cacheado["items"])
             else:
-                # Fallback: generar cotización básica sin LLM
-                cotizacion_markdown = self._generar_cotizacion_basica(
-                    items_por_actividad,
-                    incluir_iva=incluir_iva,
-                    tasa_iva=tasa_iva
+                # Paso 1.1: Leer y validar Excel
+                items_validos = await self._leer_y_validar_excel(file_path)
+
+                if not items_validos:
+                    raise ValueError(
+                        "No se encontraron ítems válidos para cotizar en el archivo.")
+
+                # Paso 1.2: Estimar valores faltantes si hay ítems que lo necesitan
+                items_con_valores_estimados = await self._estimar_valores_faltantes(
+                    items_validos,
+                    project_description=project_description,
+                    project_context=project_context
                 )
+                cacheado = {"items": copy.deepcopy(items_con_valores_estimados), "narrativa": None}
+                self._items_cache.set(clave_cache, cacheado)
 
-            # Paso 4: Calcular totales
+            # Paso 2: Agrupar por actividad y calcular totales
+            items_por_actividad = self._agrupar_por_actividad(items_con_valores_estimados)
             totales = self._calcular_totales(
                 items_con_valores_estimados, incluir_iva, tasa_iva)
 
+            # Paso 3: Narrativa opcional con el LLM (no depende del IVA: se reutiliza desde caché)
+            narrativa = None
+            if incluir_narrativa and self.use_llm and self.llm_service:
+                narrativa = cacheado.get("narrativa")
+                if narrativa is None:
+                    narrativa = await self._generar_narrativa_con_llm(
+                        items_por_actividad, totales, project_description=project_description
+                    )
+                    cacheado["narrativa"] = narrativa
+
+            # Paso 4: Tabla de la cotización desde la plantilla
+            cotizacion_markdown = self._renderizar_cotizacion(
+                items_por_actividad, totales, incluir_iva=incluir_iva, narrativa=narrativa
+            )
+
             # Contar ítems estimados
             items_estimados = sum(1 for item in items_con_valores_estimados if item.get("necesita_estimacion", False) and item.get("valor_estimado", False))
+            items_desde_catalogo = sum(1 for item in items_con_valores_estimados if item.get("fuente_valor") == "catalogo")
 
             return {
                 "cotizacion_markdown": cotizacion_markdown,
+                "narrativa": narrativa,
                 "items": items_con_valores_estimados,
                 "items_por_actividad": items_por_actividad,
                 "totales": totales,
@@ -129,13 +178,19 @@ class CotizacionService:
                 "tasa_iva": tasa_iva,
                 "fecha_generacion": datetime.now().isoformat(),
                 "total_items": len(items_con_valores_estimados),
-                "items_estimados": items_estimados
+                "items_estimados": items_estimados,
+                "items_desde_catalogo": items_desde_catalogo,
+                "desde_cache": desde_cache
             }
 
         except Exception as e:
             logger.error(f"Error generando cotización: {str(e)}")
             raise
 
+    def cache_stats(self) -> Dict[str, Any]:
+        """Aciertos, fallos y tamaño de la caché de ítems por libro"""
+        return self._items_cache.stats()
+
     async def _leer_y_validar_excel(self, file_path: str) -> List[Dict[str, Any]]:
         """
         Lee todas las hojas del Excel que contengan las columnas mínimas:
@@ -143,6 +198,7 @@ class CotizacionService:
         
         Ignora hojas que no tengan esas columnas (como "RESUMEN", "Portada", etc.).
         Devuelve una lista plana de ítems con el campo 'hoja_origen'.
+        Las hojas se leen una sola vez cada una y se procesan en paralelo en hilos.
         """
         excel_file = None
         try:
@@ -152,157 +208,20 @@ class CotizacionService:
             
             logger.info(f"Hojas encontradas en el Excel: {', '.join(sheet_names)}")
             
-            todos_los_items = []
-            
-            # 2. Iterar sobre cada hoja
-            for sheet_name in sheet_names:
-                try:
-                    # 2.1. Leer la hoja sin encabezado para buscar la fila de inicio
-                    df_raw = pd.read_excel(excel_file, sheet_name=sheet_name, header=None)
-                    
-                    # 2.2. Buscar fila que contenga "ACTIVIDAD", "CANTIDAD" y "VALOR UNITARIO"
-                    header_idx = None
-                    for idx, row in df_raw.iterrows():
-                        valores = [str(c).strip().lower() for c in row.values if pd.notna(c)]
-                        # Verificar que tenga las tres columnas requeridas
-                        tiene_actividad = any("actividad" in v for v in valores)
-                        tiene_cantidad = any("cantidad" in v for v in valores)
-                        tiene_valor_unitario = any("valor unitario" in v or "v. unitario" in v or "costo unitario" in v or "precio unitario" in v for v in valores)
-                        
-                        if tiene_actividad and tiene_cantidad and tiene_valor_unitario:
-                            header_idx = idx
-                            break
-                    
-                    # 2.3. Si no se encontró la fila de encabezados, ignorar esta hoja
-                    if header_idx is None:
-                        logger.info(f"Hoja '{sheet_name}' ignorada: no tiene columnas válidas.")
-                        continue
-                    
-                    # 2.4. Re-leer con el encabezado correcto
-                    df = pd.read_excel(excel_file, sheet_name=sheet_name, header=header_idx)
-                    
-                    # 2.5. Normalizar nombres de columnas
-                    df.columns = df.columns.str.strip().str.upper()
-                    
-                    # 2.6. Validar columnas mínimas requeridas
-                    req = ["ACTIVIDAD", "CANTIDAD", "VALOR UNITARIO"]
-                    faltan = [c for c in req if c not in df.columns]
-                    if faltan:
-                        logger.info(f"Hoja '{sheet_name}' ignorada: faltan columnas {', '.join(faltan)}.")
-                        continue
-                    
-                    # 2.7. Buscar columna de descripción/ítem (puede tener diferentes nombres)
-                    # ---------- DESCRIPCIÓN POR HOJA SGR (OFICIAL) ----------
-                    hoja_a_desc = {
-                        "01. Talento Humano": "CARGO ESPECÍFICO",
-                        "02. Equipos y Software": "EQUIPOS Y SOFTWARE (DESCRIPCIÓN)",
-                        "03. Capacitación y Eventos": "CAPACITACIÓN Y EVENTOS (DESCRIPCIÓN)",
-                        "04. Servicios Tecnológicos": "SERVICIOS TECNOLÓGICOS (DESCRIPCIÓN)",
-                        "05. Materiales, insumos y Doc": "MATERIALES E INSUMOS (DESCRIPCIÓN)",
-                        "06. Protección conocimiento y Di": "PROTECCIÓN CONOCIMIENTO Y DIFUSIÓN (DESCRIPCIÓN)",
-                        "07. Gastos de viaje": "GASTOS DE VIAJE (DESCRIPCIÓN)",
-                        "11. Otros": "OTROS (DESCRIPCIÓN)"
-                    }
-                    
-                    item_col = hoja_a_desc.get(sheet_name)
-                    if item_col is None or item_col not in df.columns:
-                        # Fallback por palabras clave
-                        for col in df.columns:
-                            if any(k in col.lower() for k in ["descripción", "descripcion", "concepto", "item", "servicio"]):
-                                item_col = col
-                                break
-                    if item_col is None:
-                        item_col = "ACTIVIDAD"
-                    
-                    logger.debug(f"Hoja '{sheet_name}': usando columna '{item_col}' para descripción de ítems.")
-                    
-                    # 2.8. Filtrar filas que no sean ítems válidos (ignorar totales, subtotales, etc.)
-                    df = df[~df["ACTIVIDAD"].astype(str).str.lower().str.contains("|".join(self.ignore_keywords), na=False, regex=True)]
-                    
-                    # 2.9. NO filtrar por valores faltantes - capturar todos los ítems con descripción
-                    # Los ítems sin valor serán estimados después
-                    
-                    if df.empty:
-                        logger.info(f"Hoja '{sheet_name}': no se encontraron ítems válidos después del filtrado.")
-                        continue
-                    
-                    # 2.10. Mapear a formato estándar y agregar hoja_origen
-                    items_hoja = []
-                    for idx, row in df.iterrows():
-                        actividad = str(row["ACTIVIDAD"]).strip() if pd.notna(row["ACTIVIDAD"]) else ""
-                        
-                        # Extraer descripción del ítem de la columna correspondiente
-                        item_desc = ""
-                        if item_col in row.index:
-                            item_valor = row[item_col]
-                            if pd.notna(item_valor):
-                                item_desc = str(item_valor).strip()
-                        
-                        # Si no hay descripción o es solo un número, buscar en otras columnas
-                        if not item_desc or (item_desc.isdigit() and len(item_desc) < 5):
-                            # Buscar en otras columnas que no sean numéricas ni requeridas
-                            columnas_alternativas = [
-                                c for c in df.columns 
-                                if c not in req + ["VALOR TOTAL", "TOTAL", "SUBTOTAL", "JUSTIFICACIÓN", "JUSTIFICACION"]
-                                and c != item_col
-                                and not str(c).strip().isdigit()
-                                and not str(c).lower().startswith("unnamed")
-                            ]
-                            
-                            for col_alt in columnas_alternativas:
-                                if col_alt in row.index:
-                                    valor_alt = row[col_alt]
-                                    if pd.notna(valor_alt):
-                                        valor_alt_str = str(valor_alt).strip()
-                                        # Si tiene texto significativo (más de 3 caracteres y no es solo número)
-                                        if len(valor_alt_str) > 3 and not (valor_alt_str.replace(".", "").replace(",", "").isdigit()):
-                                            item_desc = valor_alt_str
-                                            break
-                        
-                        # Si aún no hay descripción o es solo un número, usar la actividad
-                        if not item_desc or (item_desc.isdigit() and len(item_desc) < 5):
-                            item_desc = actividad
-                        
-                        # Si aún no hay descripción válida, saltar esta fila
-                        if not item_desc:
-                            continue
-                        
-                        cantidad = pd.to_numeric(row["CANTIDAD"], errors="coerce")
-                        valor_unitario = pd.to_numeric(row["VALOR UNITARIO"], errors="coerce")
-                        
-                        # Determinar si necesita estimación
-                        necesita_estimacion = False
-                        if pd.isna(cantidad) or cantidad <= 0:
-                            cantidad = 1.0  # Default a 1 si no hay cantidad
-                            necesita_estimacion = True
-                        
-                        if pd.isna(valor_unitario) or valor_unitario <= 0:
-                            valor_unitario = 0.0  # Se estimará después
-                            necesita_estimacion = True
-                        
-                        valor_total = cantidad * valor_unitario if valor_unitario > 0 else 0.0
-                        
-                        item = {
-                            "actividad": actividad,
-                            "item": item_desc,
-                            "cantidad": float(cantidad),
-                            "valor_unitario": float(valor_unitario),
-                            "valor_total": float(valor_total),
-                            "hoja_origen": sheet_name,
-                            "necesita_estimacion": necesita_estimacion
-                        }
-                        
-                        items_hoja.append(item)
-                    
-                    if items_hoja:
-                        todos_los_items.extend(items_hoja)
-                        logger.info(f"Hoja '{sheet_name}': {len(items_hoja)} ítems válidos extraídos.")
-                    else:
-                        logger.info(f"Hoja '{sheet_name}': no se encontraron ítems válidos.")
-                        
-                except Exception as e:
-                    logger.warning(f"Error procesando hoja '{sheet_name}': {str(e)}. Continuando con la siguiente hoja.")
-                    continue
+            # 2. Procesar las hojas en hilos, acotando cuántas se leen a la vez
+            semaforo = asyncio.Semaphore(self.max_hojas_en_paralelo)
+
+            async def procesar(sheet_name: str) -> List[Dict[str, Any]]:
+                async with semaforo:
+                    try:
+                        return await asyncio.to_thread(self._leer_items_hoja, excel_file, sheet_name)
+                    except Exception as e:
+                        logger.warning(f"Error procesando hoja '{sheet_name}': {str(e)}. Continuando con la siguiente hoja.")
+                        return []
+
+            items_por_hoja = await asyncio.gather(*(procesar(sheet_name) for sheet_name in sheet_names))
+            # Se conserva el orden de las hojas del libro
+            todos_los_items = [item for items_hoja in items_por_hoja for item in items_hoja]
             
             # 3. Validar que se encontraron ítems
             if not todos_los_items:
@@ -327,6 +246,170 @@ class CotizacionService:
                 except Exception as e:
                     logger.warning(f"Error cerrando archivo Excel: {str(e)}")
 
+    def _leer_items_hoja(self, excel_file: pd.ExcelFile, sheet_name: str) -> List[Dict[str, Any]]:
+        """
+        Leer una hoja (una sola vez, sin encabezado) y devolver sus ítems cotizables.
+
+        El encabezado se busca en las primeras `filas_busqueda_encabezado` filas
+        y los ítems se toman de la misma lectura, sin volver a abrir la hoja.
+        """
+        # 2.1. Leer la hoja sin encabezado
+        df_raw = pd.read_excel(excel_file, sheet_name=sheet_name, header=None)
+        
+        # 2.2. Buscar fila que contenga "ACTIVIDAD", "CANTIDAD" y "VALOR UNITARIO"
+        header_pos = self._buscar_fila_encabezado(df_raw)
+        
+        # 2.3. Si no se encontró la fila de encabezados, ignorar esta hoja
+        if header_pos is None:
+            logger.info(f"Hoja '{sheet_name}' ignorada: no tiene columnas válidas.")
+            return []
+        
+        # 2.4. Tomar las filas de datos de la misma lectura, con nombres de columna normalizados
+        df = df_raw.iloc[header_pos + 1:].copy()
+        df.columns = self._nombres_columnas(df_raw.iloc[header_pos].tolist())
+        df = df.infer_objects()
+        
+        # 2.5. Validar columnas mínimas requeridas
+        req = ["ACTIVIDAD", "CANTIDAD", "VALOR UNITARIO"]
+        faltan = [c for c in req if c not in df.columns]
+        if faltan:
+            logger.info(f"Hoja '{sheet_name}' ignorada: faltan columnas {', '.join(faltan)}.")
+            return []
+        
+        # 2.6. Buscar columna de descripción/ítem (puede tener diferentes nombres)
+        item_col = self.hoja_a_desc.get(sheet_name)
+        if item_col is None or item_col not in df.columns:
+            # Fallback por palabras clave
+            for col in df.columns:
+                if any(k in col.lower() for k in ["descripción", "descripcion", "concepto", "item", "servicio"]):
+                    item_col = col
+                    break
+        if item_col is None:
+            item_col = "ACTIVIDAD"
+        
+        logger.debug(f"Hoja '{sheet_name}': usando columna '{item_col}' para descripción de ítems.")
+        
+        # 2.7. Filtrar filas que no sean ítems válidos (ignorar totales, subtotales, etc.)
+        # No se filtra por valores faltantes: los ítems sin valor se estiman después
+        df = df[~df["ACTIVIDAD"].astype(str).str.lower().str.contains("|".join(self.ignore_keywords), na=False, regex=True)]
+        
+        if df.empty:
+            logger.info(f"Hoja '{sheet_name}': no se encontraron ítems válidos después del filtrado.")
+            return []
+        
+        # 2.8. Mapear a formato estándar por columnas
+        actividades = self._texto_columna(df["ACTIVIDAD"])
+        if item_col in df.columns:
+            descripciones = self._texto_columna(df[item_col])
+        else:
+            descripciones = pd.Series("", index=df.index)
+        
+        # Si no hay descripción o es solo un número, buscar en otras columnas que no
+        # sean numéricas ni requeridas, en orden, la primera con texto significativo
+        sin_descripcion = self._descripcion_vacia(descripciones)
+        if sin_descripcion.any():
+            columnas_alternativas = [
+                c for c in df.columns
+                if c not in req + ["VALOR TOTAL", "TOTAL", "SUBTOTAL", "JUSTIFICACIÓN", "JUSTIFICACION"]
+                and c != item_col
+                and not c.isdigit()
+                and not c.lower().startswith("unnamed")
+            ]
+            for col_alt in columnas_alternativas:
+                valores_alt = self._texto_columna(df[col_alt])
+                significativo = (valores_alt.str.len() > 3) & ~valores_alt.str.replace(r"[.,]", "", regex=True).str.isdigit()
+                usar = sin_descripcion & significativo
+                descripciones = descripciones.mask(usar, valores_alt)
+                sin_descripcion &= ~usar
+                if not sin_descripcion.any():
+                    break
+        
+        # Si aún no hay descripción o es solo un número, usar la actividad;
+        # las filas que siguen sin descripción no son ítems
+        descripciones = descripciones.mask(self._descripcion_vacia(descripciones), actividades)
+        validas = descripciones != ""
+        
+        # Cifras en formato COP ("$ 1.500.000", "1.234,5"...) parseadas por columna
+        cantidades = parse_number_series(df["CANTIDAD"])
+        valores_unitarios = parse_number_series(df["VALOR UNITARIO"])
+        
+        # Determinar si necesita estimación: cantidad por defecto 1 y valor unitario 0 (se estimará después)
+        sin_cantidad = ~(cantidades > 0)
+        sin_valor = ~(valores_unitarios > 0)
+        cantidades = cantidades.mask(sin_cantidad, 1.0)
+        valores_unitarios = valores_unitarios.mask(sin_valor, 0.0)
+        valores_totales = cantidades * valores_unitarios
+        
+        items_hoja = [
+            {
+                "actividad": actividad,
+                "item": item_desc,
+                "cantidad": float(cantidad),
+                "valor_unitario": float(valor_unitario),
+                "valor_total": float(valor_total),
+                "hoja_origen": sheet_name,
+                "necesita_estimacion": bool(necesita_estimacion)
+            }
+            for actividad, item_desc, cantidad, valor_unitario, valor_total, necesita_estimacion in zip(
+                actividades[validas], descripciones[validas], cantidades[validas],
+                valores_unitarios[validas], valores_totales[validas], (sin_cantidad | sin_valor)[validas]
+            )
+        ]
+        
+        if items_hoja:
+            logger.info(f"Hoja '{sheet_name}': {len(items_hoja)} ítems válidos extraídos.")
+        else:
+            logger.info(f"Hoja '{sheet_name}': no se encontraron ítems válidos.")
+        return items_hoja
+
+    def _buscar_fila_encabezado(self, df_raw: pd.DataFrame) -> Optional[int]:
+        """
+        Posición de la fila de encabezados (ACTIVIDAD, CANTIDAD y VALOR UNITARIO)
+        dentro de las primeras `filas_busqueda_encabezado` filas, o None.
+        """
+        cabecera = df_raw.iloc[:self.filas_busqueda_encabezado]
+        if cabecera.empty:
+            return None
+        textos = cabecera.apply(lambda col: col.where(col.notna(), "").astype(str).str.strip().str.lower())
+
+        def contiene(*palabras: str):
+            return textos.apply(lambda col: col.str.contains("|".join(map(re.escape, palabras)))).any(axis=1)
+
+        candidatas = (
+            contiene("actividad")
+            & contiene("cantidad")
+            & contiene("valor unitario", "v. unitario", "costo unitario", "precio unitario")
+        ).to_numpy()
+        if not candidatas.any():
+            return None
+        return int(candidatas.argmax())
+
+    @staticmethod
+    def _nombres_columnas(encabezados: List[Any]) -> List[str]:
+        """Encabezados en mayúsculas y sin espacios; vacíos como 'UNNAMED: n' y repetidos con sufijo '.n'"""
+        nombres = []
+        vistos: Dict[str, int] = {}
+        for posicion, valor in enumerate(encabezados):
+            nombre = f"Unnamed: {posicion}" if pd.isna(valor) or not str(valor).strip() else str(valor)
+            nombre = nombre.strip().upper()
+            if nombre in vistos:
+                vistos[nombre] += 1
+                nombre = f"{nombre}.{vistos[nombre]}"
+            else:
+                vistos[nombre] = 0
+            nombres.append(nombre)
+        return nombres
+
+    @staticmethod
+    def _texto_columna(columna: pd.Series) -> pd.Series:
+        """Texto sin espacios de cada celda ("" en las vacías)"""
+        return columna.astype(str).str.strip().where(columna.notna(), "")
+
+    @staticmethod
+    def _descripcion_vacia(descripciones: pd.Series) -> pd.Series:
+        """Descripciones vacías o que son solo un número corto"""
+        return (descripciones == "") | (descripciones.str.isdigit() & (descripciones.str.len() < 5))
+
     async def _estimar_valores_faltantes(
         self,
         items: List[Dict[str, Any]],
@@ -353,6 +436,14 @@ class CotizacionService:
             logger.info("No hay ítems que necesiten estimación de valores.")
             return items
         
+        # Los valores del propio Excel alimentan el catálogo de precios
+        await self._registrar_en_catalogo(items_sin_estimacion, fuente="cotizacion")
+        
+        # Ítems con precio conocido en el catálogo; solo los demás se estiman
+        items_catalogo, items_para_estimar = await self._valorar_desde_catalogo(items_para_estimar)
+        if not items_para_estimar:
+            return items_sin_estimacion + items_catalogo
+        
         logger.info(f"Estimando valores para {len(items_para_estimar)} ítems sin valor.")
         
         # Si no hay LLM disponible, usar valores por defecto
@@ -365,9 +456,9 @@ class CotizacionService:
                 item["valor_total"] = item["cantidad"] * valor_default
                 item["valor_estimado"] = True
                 item["necesita_estimacion"] = False
-            return items_sin_estimacion + items_para_estimar
+            return items_sin_estimacion + items_catalogo + items_para_estimar
         
-        # Agrupar ítems por hoja para estimar en batch
+        # Agrupar ítems por hoja y partir las hojas grandes en lotes de tamaño fijo
         items_por_hoja = {}
         for item in items_para_estimar:
             hoja = item.get("hoja_origen", "General")
@@ -375,40 +466,96 @@ class CotizacionService:
                 items_por_hoja[hoja] = []
             items_por_hoja[hoja].append(item)
         
-        # Estimar valores para cada grupo
-        items_estimados = []
-        for hoja, items_hoja in items_por_hoja.items():
-            try:
-                valores_estimados = await self._estimar_valores_con_llm(
-                    items_hoja,
-                    hoja,
-                    project_description=project_description,
-                    project_context=project_context
-                )
-                
-                # Actualizar ítems con valores estimados
-                for i, item in enumerate(items_hoja):
-                    if i < len(valores_estimados):
-                        valor_estimado = valores_estimados[i]
-                        item["valor_unitario"] = valor_estimado
-                        item["valor_total"] = item["cantidad"] * valor_estimado
-                        item["valor_estimado"] = True
-                        item["necesita_estimacion"] = False
-                    items_estimados.append(item)
-                    
-            except Exception as e:
-                logger.error(f"Error estimando valores para hoja '{hoja}': {str(e)}")
-                # En caso de error, usar valores por defecto
-                for item in items_hoja:
-                    valor_default = self._obtener_valor_default_por_hoja(hoja)
-                    item["valor_unitario"] = valor_default
-                    item["valor_total"] = item["cantidad"] * valor_default
-                    item["valor_estimado"] = True
-                    item["necesita_estimacion"] = False
-                items_estimados.extend(items_hoja)
+        lotes = [
+            (hoja, items_hoja[inicio:inicio + self.items_por_lote_estimacion])
+            for hoja, items_hoja in items_por_hoja.items()
+            for inicio in range(0, len(items_hoja), self.items_por_lote_estimacion)
+        ]
+        
+        # Estimar los lotes en paralelo (acotado); cada lote actualiza sus propios ítems
+        semaforo = asyncio.Semaphore(self.max_lotes_estimacion_en_paralelo)
+        
+        async def estimar_lote(hoja: str, items_lote: List[Dict[str, Any]]):
+            async with semaforo:
+                try:
+                    valores_estimados = await self._estimar_valores_con_llm(
+                        items_lote,
+                        hoja,
+                        project_description=project_description,
+                        project_context=project_context
+                    )
+                    aceptados = True
+                except Exception as e:
+                    logger.error(f"Error estimando valores para hoja '{hoja}': {str(e)}")
+                    # En caso de error, usar valores por defecto solo para este lote
+                    valores_estimados = [self._obtener_valor_default_por_hoja(hoja)] * len(items_lote)
+                    aceptados = False
+            
+            # Actualizar ítems con valores estimados
+            for item, valor_estimado in zip(items_lote, valores_estimados):
+                item["valor_unitario"] = valor_estimado
+                item["valor_total"] = item["cantidad"] * valor_estimado
+                item["valor_estimado"] = True
+                item["necesita_estimacion"] = False
+            
+            # Las estimaciones del LLM (no los valores por defecto) pasan al catálogo
+            if aceptados:
+                await self._registrar_en_catalogo(items_lote, fuente="llm")
+        
+        logger.info(f"Estimando {len(items_para_estimar)} ítems en {len(lotes)} lotes de {len(items_por_hoja)} hojas.")
+        await asyncio.gather(*(estimar_lote(hoja, items_lote) for hoja, items_lote in lotes))
+        
+        # Reensamblar en el orden original: hojas en orden de aparición y lotes en orden
+        items_estimados = [item for _, items_lote in lotes for item in items_lote]
         
         logger.info(f"Valores estimados para {len(items_estimados)} ítems.")
-        return items_sin_estimacion + items_estimados
+        return items_sin_estimacion + items_catalogo + items_estimados
+
+    async def _valorar_desde_catalogo(self, items: List[Dict[str, Any]]):
+        """
+        Valorar con el catálogo de precios los ítems que tengan un precio conocido.
+
+        Returns:
+            (ítems valorados desde el catálogo, ítems que siguen sin valor)
+        """
+        if self.price_catalog is None or not items:
+            return [], items
+        try:
+            precios = await asyncio.to_thread(
+                self.price_catalog.lookup,
+                [(item.get("item", ""), item.get("hoja_origen")) for item in items]
+            )
+        except Exception as e:
+            logger.warning(f"Catálogo de precios no disponible: {str(e)}")
+            return [], items
+        
+        valorados, pendientes = [], []
+        for item, precio in zip(items, precios):
+            if precio is None:
+                pendientes.append(item)
+                continue
+            item["valor_unitario"] = precio["valor_unitario"]
+            item["valor_total"] = item["cantidad"] * precio["valor_unitario"]
+            item["valor_estimado"] = True
+            item["necesita_estimacion"] = False
+            item["fuente_valor"] = "catalogo"
+            valorados.append(item)
+        
+        if valorados:
+            logger.info(f"Catálogo de precios: {len(valorados)} de {len(items)} ítems valorados sin LLM.")
+        return valorados, pendientes
+
+    async def _registrar_en_catalogo(self, items: List[Dict[str, Any]], fuente: str) -> None:
+        """Guardar en el catálogo los valores unitarios de los ítems (descripción y hoja)"""
+        if self.price_catalog is None or not items:
+            return
+        try:
+            await asyncio.to_thread(self.price_catalog.add_prices, [
+                {"descripcion": item.get("item"), "rubro": item.get("hoja_origen"), "valor_unitario": item.get("valor_unitario")}
+                for item in items
+            ], fuente)
+        except Exception as e:
+            logger.warning(f"No se pudieron guardar precios en el catálogo: {str(e)}")
     
     async def _estimar_valores_con_llm(
         self,
@@ -422,6 +569,9 @@ class CotizacionService:
         
         Returns:
             Lista de valores unitarios estimados en COP
+
+        Raises:
+            ValueError: si el LLM falla o su respuesta no es un JSON válido
         """
         # Preparar información de ítems para el prompt
         items_texto = []
@@ -441,7 +591,7 @@ class CotizacionService:
         if project_description:
             contexto_proyecto += f"\n\nDESCRIPCIÓN DEL PROYECTO:\n{project_description}"
         if project_context:
-            contexto_proyecto += f"\n\nCONTEXTO ADICIONAL:\n{project_context[:2000]}"  # Limitar longitud
+            contexto_proyecto += f"\n\nCONTEXTO ADICIONAL:\n{self.context_packer.fit(project_context, 'cotizacion_estimation')}"
         
         system_prompt = """Eres un experto en estimación de costos para proyectos de investigación e innovación en Colombia.
 Tu tarea es estimar valores unitarios realistas en PESOS COLOMBIANOS (COP) para ítems de presupuesto.
@@ -514,9 +664,8 @@ Responde SOLO con el JSON en el formato especificado, sin texto adicional."""
             return valores
             
         except Exception as e:
-            logger.error(f"Error estimando valores con LLM: {str(e)}")
-            # Retornar valores por defecto
-            return [self._obtener_valor_default_por_hoja(hoja_origen) for _ in items]
+            # Quien llama usa los valores por defecto de la hoja y no los guarda en el catálogo
+            raise ValueError(f"Error estimando valores con LLM: {str(e)}")
     
     def _obtener_valor_default_por_hoja(self, hoja: str) -> float:
         """
@@ -806,196 +955,114 @@ Responde SOLO con el JSON en el formato especificado, sin texto adicional."""
 
         return agrupados
 
-    async def _generar_cotizacion_con_gemini(
+    def _renderizar_cotizacion(
         self,
         items_por_actividad: Dict[str, List[Dict[str, Any]]],
+        totales: Dict[str, float],
         incluir_iva: bool = False,
-        tasa_iva: float = 0.19
+        narrativa: Optional[str] = None
     ) -> str:
         """
-        Generar cotización en formato markdown usando Gemini.
-        """
-        # Preparar datos para el prompt
-        datos_actividades = []
-        for actividad, items in items_por_actividad.items():
-            items_texto = []
-            for item in items:
-                items_texto.append({
-                    "descripcion": item["actividad"],
-                    "cantidad": item["cantidad"],
-                    "valor_unitario": item["valor_unitario"],
-                    "valor_total": item["valor_total"],
-                    "justificacion": item.get("justificacion", "")
-                })
-
-            datos_actividades.append({
-                "actividad": actividad,
-                "items": items_texto
-            })
-
-        # Calcular totales
-        total_sin_iva = sum(
-            sum(item["valor_total"] for item in items)
-            for items in items_por_actividad.values()
-        )
-
-        iva = total_sin_iva * tasa_iva if incluir_iva else 0
-        total_con_iva = total_sin_iva + iva
-
-        system_prompt = """Eres un experto en generar cotizaciones formales para el Sistema General de Regalías (SGR) y entidades públicas colombianas.
-
-Tu tarea es generar una cotización profesional en formato de tabla markdown, usando terminología colombiana formal.
-
-REGLAS ESTRICTAS:
-1. Debes responder ÚNICAMENTE con una tabla markdown, sin texto adicional antes o después
-2. Usa terminología colombiana: "Ítem", "Valor unitario", "Valor total", "Subtotal por actividad", "Total general"
-3. Formato de moneda: $1.234.567 COP (con puntos como separadores de miles)
-4. Agrupa los ítems por actividad
-5. Incluye subtotal por cada actividad
-6. Al final, incluye Total general
-7. Si se solicita IVA, incluye fila de IVA (19%) y Total con IVA
-
-FORMATO DE LA TABLA MARKDOWN:
-- Primera columna: Número de ítem (1, 2, 3...)
-- Segunda columna: Descripción del ítem
-- Tercera columna: Cantidad
-- Cuarta columna: Valor unitario ($ COP)
-- Quinta columna: Valor total ($ COP)
-- Usa encabezados: | Ítem | Descripción | Cantidad | Valor unitario | Valor total |
-
-EJEMPLO DE ESTRUCTURA:
-| Ítem | Descripción | Cantidad | Valor unitario | Valor total |
-|------|-------------|----------|----------------|-------------|
-| **ACTIVIDAD: [Nombre de la actividad]** | | | | |
-| 1 | Descripción del ítem 1 | 10 | $150.000 COP | $1.500.000 COP |
-| 2 | Descripción del ítem 2 | 5 | $200.000 COP | $1.000.000 COP |
-| | **Subtotal por actividad** | | | **$2.500.000 COP** |
-| | | | | |
-| **ACTIVIDAD: [Otra actividad]** | | | | |
-| 3 | Descripción del ítem 3 | 2 | $500.000 COP | $1.000.000 COP |
-| | **Subtotal por actividad** | | | **$1.000.000 COP** |
-| | | | | |
-| | **TOTAL GENERAL** | | | **$3.500.000 COP** |
-| | IVA (19%) | | | **$665.000 COP** |
-| | **TOTAL CON IVA** | | | | **$4.165.000 COP** |
-
-IMPORTANTE:
-- NO incluyas texto antes o después de la tabla
-- NO uses código markdown adicional (```)
-- Formatea todos los valores con puntos como separadores de miles
-- Mantén el formato consistente y profesional"""
-
-        user_prompt = f"""Genera una cotización en formato de tabla markdown con los siguientes datos:
-
-DATOS DE LAS ACTIVIDADES:
-{self._formatear_datos_para_prompt(datos_actividades)}
-
-TOTALES:
-- Total sin IVA: ${total_sin_iva:,.0f} COP
-{"- IVA (19%): $" + f"{iva:,.0f} COP" if incluir_iva else ""}
-{"- Total con IVA: $" + f"{total_con_iva:,.0f} COP" if incluir_iva else ""}
-
-INSTRUCCIONES:
-{"- INCLUYE IVA (19%) y Total con IVA al final de la tabla" if incluir_iva else "- NO incluyas IVA"}
-- Agrupa los ítems por actividad
-- Incluye subtotal por cada actividad
-- Usa formato de moneda colombiana ($1.234.567 COP)
-- Responde SOLO con la tabla markdown, sin texto adicional"""
+        Generar la cotización en markdown a partir de una plantilla fija.
 
-        try:
-            respuesta = await self.llm_service.generate_answer(
-                question="Genera la cotización",
-                context=user_prompt,
-                system_prompt=system_prompt
-            )
-
-            # Limpiar respuesta (remover markdown code blocks si existen)
-            respuesta_limpia = respuesta.strip()
-            if respuesta_limpia.startswith("```"):
-                # Remover code blocks
-                respuesta_limpia = re.sub(r'^```[\w]*\n', '', respuesta_limpia)
-                respuesta_limpia = re.sub(r'\n```$', '', respuesta_limpia)
-
-            return respuesta_limpia.strip()
-
-        except Exception as e:
-            logger.error(f"Error generando cotización con Gemini: {str(e)}")
-            # Fallback a generación básica
-            return self._generar_cotizacion_basica(items_por_actividad, incluir_iva, tasa_iva)
+        La tabla (ítems, subtotal por actividad, total general e IVA) sale de los
+        ítems y de `_calcular_totales`, así que los totales siempre cuadran. La
+        narrativa, si la hay, se agrega al final.
+        """
+        lineas = [
+            "| Ítem | Descripción | Cantidad | Valor unitario | Valor total |",
+            "|------|-------------|----------|----------------|-------------|",
+        ]
 
-    def _formatear_datos_para_prompt(self, datos_actividades: List[Dict[str, Any]]) -> str:
-        """Formatear datos de actividades para el prompt de Gemini"""
-        texto = ""
         item_num = 1
+        for actividad, items in items_por_actividad.items():
+            # Encabezado de actividad
+            lineas.append(f"| **ACTIVIDAD: {self._celda_markdown(actividad)}** | | | | |")
 
-        for actividad_data in datos_actividades:
-            actividad = actividad_data["actividad"]
-            items = actividad_data["items"]
-
-            texto += f"\nACTIVIDAD: {actividad}\n"
-            texto += "Ítems:\n"
-
+            # Ítems de la actividad
             for item in items:
-                texto += f"  {item_num}. {item['descripcion']}\n"
-                texto += f"     Cantidad: {item['cantidad']}\n"
-                texto += f"     Valor unitario: ${item['valor_unitario']:,.0f} COP\n"
-                texto += f"     Valor total: ${item['valor_total']:,.0f} COP\n"
-                if item.get('justificacion'):
-                    texto += f"     Justificación: {item['justificacion']}\n"
-                texto += "\n"
+                descripcion = self._celda_markdown(item.get("item") or item["actividad"])
+                lineas.append(
+                    f"| {item_num} | {descripcion} | {self._formatear_cantidad(item['cantidad'])} "
+                    f"| {self._formatear_cop(item['valor_unitario'])} | {self._formatear_cop(item['valor_total'])} |"
+                )
                 item_num += 1
 
-        return texto
+            # Subtotal por actividad
+            subtotal_actividad = sum(item["valor_total"] for item in items)
+            lineas.append(f"| | **Subtotal por actividad** | | | **{self._formatear_cop(subtotal_actividad)}** |")
+            lineas.append("| | | | | |")
+
+        # Total general e IVA si aplica
+        lineas.append(f"| | **TOTAL GENERAL** | | | **{self._formatear_cop(totales['subtotal'])}** |")
+        if incluir_iva:
+            tasa = self._formatear_cantidad(totales["tasa_iva"] * 100)
+            lineas.append(f"| | IVA ({tasa}%) | | | **{self._formatear_cop(totales['iva'])}** |")
+            lineas.append(f"| | **TOTAL CON IVA** | | | **{self._formatear_cop(totales['total'])}** |")
+
+        markdown = "\n".join(lineas) + "\n"
+        if narrativa:
+            markdown += f"\n### Justificación\n\n{narrativa.strip()}\n"
+        return markdown
 
-    def _generar_cotizacion_basica(
+    async def _generar_narrativa_con_llm(
         self,
         items_por_actividad: Dict[str, List[Dict[str, Any]]],
-        incluir_iva: bool = False,
-        tasa_iva: float = 0.19
-    ) -> str:
-        """
-        Generar cotización básica sin LLM (fallback).
+        totales: Dict[str, float],
+        project_description: Optional[str] = None
+    ) -> Optional[str]:
         """
-        markdown = "| Ítem | Descripción | Cantidad | Valor unitario | Valor total |\n"
-        markdown += "|------|-------------|----------|----------------|------------|\n"
-
-        item_num = 1
-        total_general = 0.0
+        Pedir al LLM solo un párrafo de justificación de la cotización.
 
+        El prompt lleva un resumen por actividad (número de ítems, subtotal y los
+        ítems de mayor valor), no la lista completa, de modo que el costo no
+        crece con el número de ítems. Devuelve None si el LLM falla.
+        """
+        resumen = []
         for actividad, items in items_por_actividad.items():
-            # Encabezado de actividad
-            markdown += f"| **ACTIVIDAD: {actividad}** | | | | |\n"
+            principales = sorted(items, key=lambda item: item["valor_total"], reverse=True)[:3]
+            resumen.append(
+                f"- {actividad}: {len(items)} ítems, subtotal {self._formatear_cop(sum(item['valor_total'] for item in items))}"
+                f" (principales: {', '.join(str(item.get('item') or item['actividad']) for item in principales)})"
+            )
 
-            subtotal_actividad = 0.0
+        system_prompt = """Eres un experto en cotizaciones para el Sistema General de Regalías (SGR) y entidades públicas colombianas.
+Redacta en español formal colombiano un único párrafo breve (máximo 120 palabras) que justifique la cotización.
+NO escribas tablas, listas ni cifras distintas de las entregadas. NO repitas los ítems uno por uno."""
 
-            # Ítems de la actividad
-            for item in items:
-                descripcion = item["actividad"]
-                cantidad = item["cantidad"]
-                valor_unitario = item["valor_unitario"]
-                valor_total = item["valor_total"]
+        user_prompt = f"""RESUMEN DE LA COTIZACIÓN POR ACTIVIDAD:
+{chr(10).join(resumen[:20])}
 
-                markdown += f"| {item_num} | {descripcion} | {cantidad} | ${valor_unitario:,.0f} COP | ${valor_total:,.0f} COP |\n"
+TOTAL SIN IVA: {self._formatear_cop(totales['subtotal'])}
+{f"{chr(10)}DESCRIPCIÓN DEL PROYECTO:{chr(10)}{self.context_packer.fit(project_description, 'cotizacion_narrative')}" if project_description else ""}
 
-                subtotal_actividad += valor_total
-                total_general += valor_total
-                item_num += 1
+Escribe el párrafo de justificación."""
 
-            # Subtotal por actividad
-            markdown += f"| | **Subtotal por actividad** | | | **${subtotal_actividad:,.0f} COP** |\n"
-            markdown += "| | | | | |\n"
+        try:
+            respuesta = await self.llm_service.generate_answer(
+                question="Redacta la justificación de la cotización",
+                context=user_prompt,
+                system_prompt=system_prompt
+            )
+            return respuesta.strip() or None
+        except Exception as e:
+            logger.error(f"Error generando narrativa de la cotización: {str(e)}")
+            return None
 
-        # Total general
-        markdown += f"| | **TOTAL GENERAL** | | | **${total_general:,.0f} COP** |\n"
+    @staticmethod
+    def _formatear_cop(valor: float) -> str:
+        """$1.234.567 COP (puntos como separadores de miles)"""
+        return f"${valor:,.0f} COP".replace(",", ".")
 
-        # IVA si aplica
-        if incluir_iva:
-            iva = total_general * tasa_iva
-            total_con_iva = total_general + iva
-            markdown += f"| | IVA (19%) | | | **${iva:,.0f} COP** |\n"
-            markdown += f"| | **TOTAL CON IVA** | | | **${total_con_iva:,.0f} COP** |\n"
+    @staticmethod
+    def _formatear_cantidad(cantidad: float) -> str:
+        """Cantidades sin decimales innecesarios y con coma decimal: 2 -> "2", 1.5 -> "1,5\""""
+        return f"{cantidad:,.2f}".rstrip("0").rstrip(".").replace(",", "_").replace(".", ",").replace("_", ".")
 
-        return markdown
+    @staticmethod
+    def _celda_markdown(texto: Any) -> str:
+        """Texto seguro dentro de una celda de tabla markdown"""
+        return str(texto).replace("|", "/").replace("\n", " ").strip()
 
     def _calcular_totales(
         self,
@@ -1016,23 +1083,5 @@ INSTRUCCIONES:
         }
 
     def _safe_numeric(self, value: Any) -> Optional[float]:
-        """Convertir valor a numérico de forma segura"""
-        if pd.isna(value):
-            return None
-
-        try:
-            if isinstance(value, str):
-                # Limpiar formato (comas, símbolos de moneda, etc.)
-                cleaned = re.sub(r'[^\d.,\-]', '', value)
-                # Manejar separadores
-                if ',' in cleaned and '.' not in cleaned:
-                    cleaned = cleaned.replace(',', '.')
-                elif ',' in cleaned and '.' in cleaned:
-                    # Asumir que coma es separador de miles
-                    cleaned = cleaned.replace(',', '')
-
-                return float(cleaned) if cleaned else None
-
-            return float(value)
-        except (ValueError, TypeError):
-            return None
+        """Convertir valor a numérico de forma segura (formatos COP, ver services/number_parser.py)"""
+        return parse_number(value)
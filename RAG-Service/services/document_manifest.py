@@ -0,0 +1,148 @@
+"""
+Manifiesto de documentos indexados.
+
+Por cada documento agregado a ChromaDB guarda en SQLite su proyecto, nombre de
+archivo, ids de chunks, tamaños, un preview ya calculado y el hash del
+archivo original en el almacén de blobs (services/blob_store.py). Así listar o borrar
+documentos no necesita leer el texto de los chunks desde la base vectorial.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentManifest:
+    """Índice document_id -> proyecto, archivo, chunks y preview"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                document_id TEXT PRIMARY KEY,
+                project_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                document_type TEXT,
+                file_extension TEXT,
+                chunk_ids TEXT NOT NULL,
+                total_chunks INTEGER NOT NULL,
+                total_chars INTEGER NOT NULL,
+                content_preview TEXT,
+                added_at TEXT,
+                content_hash TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_project ON documents(project_id, added_at);
+            CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents(filename);
+            CREATE TABLE IF NOT EXISTS manifest_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        # Manifiestos creados antes de guardar los archivos originales
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(documents)")}
+        if "content_hash" not in columns:
+            self._conn.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents(content_hash)")
+        self._conn.commit()
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        entry = dict(row)
+        entry["chunk_ids"] = json.loads(entry["chunk_ids"])
+        return entry
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        """Registrar (o reemplazar) un documento"""
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO documents (
+                    document_id, project_id, filename, document_type, file_extension,
+                    chunk_ids, total_chunks, total_chars, content_preview, added_at,
+                    content_hash
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    entry["document_id"],
+                    str(entry.get("project_id")),
+                    entry.get("filename", "unknown"),
+                    entry.get("document_type", ""),
+                    entry.get("file_extension", ""),
+                    json.dumps(entry.get("chunk_ids", [])),
+                    int(entry.get("total_chunks", 0)),
+                    int(entry.get("total_chars", 0)),
+                    entry.get("content_preview", ""),
+                    entry.get("added_at", ""),
+                    entry.get("content_hash") or None,
+                ),
+            )
+            self._conn.commit()
+
+    def get(self, document_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM documents WHERE document_id = ?", (document_id,)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list_project(self, project_id: Any) -> List[Dict[str, Any]]:
+        """Documentos de un proyecto, en orden de carga"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM documents WHERE project_id = ? ORDER BY added_at",
+                (str(project_id),)
+            ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def find_by_filename(self, filename: str, project_id: Any = None) -> List[Dict[str, Any]]:
+        """Documentos con ese nombre de archivo (opcionalmente solo de un proyecto)"""
+        query = "SELECT * FROM documents WHERE filename = ?"
+        params: List[Any] = [filename]
+        if project_id is not None:
+            query += " AND project_id = ?"
+            params.append(str(project_id))
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def count_by_hash(self, content_hash: str) -> int:
+        """Cuántos documentos apuntan al archivo original con ese hash"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM documents WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return row[0]
+
+    def delete(self, document_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM documents WHERE document_id = ?", (document_id,))
+            self._conn.commit()
+
+    def is_backfilled(self) -> bool:
+        """Indica si ya se importaron los documentos existentes en ChromaDB"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM manifest_meta WHERE key = 'backfilled'"
+            ).fetchone()
+        return row is not None
+
+    def mark_backfilled(self) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO manifest_meta (key, value) VALUES ('backfilled', '1')"
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,21 +1,188 @@
 import os
+import asyncio
 import tempfile
-from typing import Dict, Any
+import threading
+import time
+import logging
+import multiprocessing
+from collections import deque
+from datetime import date, datetime, time as dt_time
+from concurrent.futures import (
+    ProcessPoolExecutor, Future, CancelledError as FuturesCancelledError, TimeoutError as FuturesTimeoutError,
+)
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Callable, Deque, Iterator, List, Optional
 from fastapi import UploadFile
 import PyPDF2
 from docx import Document
-import pandas as pd
+from openpyxl import load_workbook
+
+from .chunking import Segment
+
+logger = logging.getLogger(__name__)
+
+
+# Funciones de parseo a nivel de módulo: se ejecutan en los procesos del pool,
+# por eso deben poder serializarse (no pueden ser métodos de la instancia)
+
+def _count_pdf_pages(file_path: str) -> int:
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def _parse_pdf_pages(file_path: str, start: int, end: int) -> List[str]:
+    """Extraer el texto de las páginas [start, end) de un PDF"""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() for i in range(start, end)]
+
+
+def _is_heading_style(style_name: str) -> bool:
+    name = (style_name or "").lower()
+    return name.startswith(("heading", "title", "título", "titulo"))
+
+
+def _parse_docx(file_path: str) -> List[Segment]:
+    """Títulos y párrafos del documento, en orden"""
+    doc = Document(file_path)
+    segments = []
+    for paragraph in doc.paragraphs:
+        style_name = paragraph.style.name if paragraph.style is not None else ""
+        if _is_heading_style(style_name) and paragraph.text.strip():
+            segments.append(Segment(paragraph.text, "heading", paragraph.text.strip()))
+        else:
+            segments.append(Segment(paragraph.text, "paragraph"))
+    return segments
+
+
+def _parse_txt(file_path: str) -> List[Segment]:
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            text = file.read()
+    except UnicodeDecodeError:
+        # Intentar con diferentes encodings
+        with open(file_path, 'r', encoding='latin-1') as file:
+            text = file.read()
+    return [Segment(text)]
+
+
+def _format_cell(value) -> str:
+    """Texto compacto de una celda: sin decimales sobrantes ni saltos de línea"""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == dt_time() else value.isoformat(sep=" ")
+    if isinstance(value, (date, dt_time)):
+        return value.isoformat()
+    return " ".join(str(value).split())
+
+
+def _format_row(values) -> str:
+    cells = [_format_cell(value) for value in values]
+    # Quitar celdas vacías al final (las hojas suelen declarar más columnas de las usadas)
+    while cells and not cells[-1]:
+        cells.pop()
+    return " | ".join(cells)
+
+
+def iter_xlsx_segments(file_path: str, rows_per_segment: int = 200,
+                       progress: Optional[Callable[..., None]] = None) -> Iterator[Segment]:
+    """
+    Recorrer un libro Excel en modo de solo lectura, fila a fila.
+    
+    Cada hoja se entrega en segmentos de hasta `rows_per_segment` filas con el
+    formato "Hoja: <nombre>", la fila de encabezado y una línea por fila con las
+    celdas separadas por " | ". El encabezado se repite en cada segmento para
+    que todo grupo de filas conserve su contexto. La memoria usada no depende
+    del tamaño de la hoja.
+    """
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet_names = workbook.sheetnames
+        for sheet_number, sheet_name in enumerate(sheet_names, start=1):
+            worksheet = workbook[sheet_name]
+            header = None
+            rows: List[str] = []
+            for values in worksheet.iter_rows(values_only=True):
+                line = _format_row(values)
+                if not line.strip(" |"):
+                    continue
+                if header is None:
+                    header = line
+                    continue
+                rows.append(line)
+                if len(rows) >= rows_per_segment:
+                    yield Segment(f"Hoja: {sheet_name}\n{header}\n" + "\n".join(rows), "sheet", sheet_name)
+                    rows = []
+            if rows or header is not None:
+                lines = [f"Hoja: {sheet_name}"] + ([header] if header else []) + rows
+                yield Segment("\n".join(lines), "sheet", sheet_name)
+            if progress:
+                progress(pages_total=len(sheet_names), pages_parsed=sheet_number)
+    finally:
+        workbook.close()
+
+
+class _PoolTask:
+    """Tarea enviada al pool de parseo, con lo necesario para reenviarla"""
+    
+    __slots__ = ("future", "file_extension", "fn", "args", "started", "timed_out", "collateral")
+    
+    def __init__(self, future: Future, file_extension: str, fn: Callable, args: tuple):
+        self.future = future
+        self.file_extension = file_extension
+        self.fn = fn
+        self.args = args
+        self.started = time.monotonic()
+        # Superó el plazo y se mató su worker
+        self.timed_out = False
+        # Se mató su worker por culpa de otra tarea colgada: se puede repetir
+        self.collateral = False
+
 
 class DocumentProcessor:
     """Procesador de documentos para extraer texto de diferentes formatos"""
     
-    def __init__(self):
+    def __init__(self, max_workers: Optional[int] = None, timeout_seconds: Optional[float] = None):
         self.supported_formats = {
             '.pdf': self._process_pdf,
             '.docx': self._process_docx,
             '.txt': self._process_txt,
             '.xlsx': self._process_xlsx
         }
+        
+        # Pool de procesos para el parseo (CPU puro en Python). Con 0 workers se
+        # parsea en el hilo que llama, sin pool
+        if max_workers is None:
+            max_workers = int(os.getenv("DOC_PARSER_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.max_workers = max_workers
+        self.timeout_seconds = timeout_seconds if timeout_seconds is not None else float(
+            os.getenv("DOC_PARSER_TIMEOUT_SECONDS", "300")
+        )
+        self.pdf_pages_per_task = int(os.getenv("DOC_PARSER_PDF_PAGES_PER_TASK", "25"))
+        self.xlsx_rows_per_segment = int(os.getenv("DOC_PARSER_XLSX_ROWS_PER_SEGMENT", "200"))
+        self.pdf_max_inflight_ranges = int(os.getenv(
+            "DOC_PARSER_PDF_MAX_INFLIGHT_RANGES", str(max(2, 2 * self.max_workers))
+        ))
+        
+        # Tareas en el pool: nunca más que workers, así ninguna espera en la cola del
+        # pool y su plazo corre solo mientras se ejecuta. Dentro de ese límite, un
+        # máximo por formato para que un tipo de archivo (p. ej. un PDF enorme) no
+        # acapare todos los workers
+        self._worker_slots = threading.BoundedSemaphore(max(1, self.max_workers))
+        default_limit = str(max(1, self.max_workers))
+        self._format_slots = {
+            '.pdf': threading.BoundedSemaphore(int(os.getenv("DOC_PARSER_MAX_PDF_TASKS", default_limit))),
+            '.docx': threading.BoundedSemaphore(int(os.getenv("DOC_PARSER_MAX_DOCX_TASKS", default_limit))),
+            '.txt': threading.BoundedSemaphore(int(os.getenv("DOC_PARSER_MAX_TXT_TASKS", default_limit))),
+        }
+        
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        # Tareas del pool actual que ocupan un cupo (se liberan una sola vez)
+        self._in_flight: Dict[Future, _PoolTask] = {}
     
     async def process_document(self, file: UploadFile) -> str:
         """Procesar un documento y extraer su contenido de texto"""
@@ -35,91 +202,247 @@ class DocumentProcessor:
                 temp_file_path = temp_file.name
             
             try:
-                # Procesar según el tipo de archivo
-                processor = self.supported_formats[file_extension]
-                text_content = processor(temp_file_path)
-                
-                return text_content
-                
+                # Procesar según el tipo de archivo, fuera del event loop
+                return await asyncio.to_thread(self.process_file, temp_file_path, file_extension)
+            
             finally:
                 # Limpiar archivo temporal
                 os.unlink(temp_file_path)
-                
+        
         except Exception as e:
             raise Exception(f"Error procesando documento {file.filename}: {str(e)}")
     
-    def _process_pdf(self, file_path: str) -> str:
-        """Procesar archivo PDF"""
-        text = ""
-        try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-        except Exception as e:
-            raise Exception(f"Error procesando PDF: {str(e)}")
+    def iter_segments(self, file_path: str, file_extension: Optional[str] = None,
+                      progress: Optional[Callable[..., None]] = None) -> Iterator[Segment]:
+        """
+        Extraer el texto de un archivo como una secuencia de segmentos con estructura.
+        
+        Los PDF se entregan página a página y con memoria acotada; los DOCX como
+        títulos y párrafos; los XLSX como grupos de filas de cada hoja. Es bloqueante:
+        iterarlo desde un hilo.
+        """
+        file_extension = (file_extension or os.path.splitext(file_path)[1]).lower()
+        if file_extension not in self.supported_formats:
+            raise ValueError(f"Formato de archivo no soportado: {file_extension}")
         
-        return text.strip()
+        if file_extension == '.pdf':
+            for page_number, page in enumerate(self._iter_pdf_pages(file_path, progress), start=1):
+                yield Segment(page, "page", f"Página {page_number}")
+        elif file_extension == '.xlsx':
+            yield from self._iter_xlsx(file_path, progress)
+        else:
+            yield from self._parse_segments(file_path, file_extension, progress)
     
-    def _process_docx(self, file_path: str) -> str:
-        """Procesar archivo DOCX"""
-        try:
-            doc = Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-        except Exception as e:
-            raise Exception(f"Error procesando DOCX: {str(e)}")
+    def process_file(self, file_path: str, file_extension: Optional[str] = None,
+                     progress: Optional[Callable[..., None]] = None) -> str:
+        """
+        Extraer el texto de un archivo ya guardado en disco.
         
-        return text.strip()
+        Es bloqueante (el trabajo pesado ocurre en el pool de procesos); llamarlo
+        desde un hilo. `progress`, si se indica, recibe pages_total/pages_parsed a
+        medida que se leen las páginas (PDF) u hojas (XLSX).
+        """
+        file_extension = (file_extension or os.path.splitext(file_path)[1]).lower()
+        if file_extension not in self.supported_formats:
+            raise ValueError(f"Formato de archivo no soportado: {file_extension}")
+        
+        processor = self.supported_formats[file_extension]
+        return processor(file_path, progress)
     
-    def _process_txt(self, file_path: str) -> str:
-        """Procesar archivo TXT"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                text = file.read()
-        except UnicodeDecodeError:
-            # Intentar con diferentes encodings
+    def close(self):
+        """Apagar el pool de procesos"""
+        self._reset_pool()
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn: el proceso principal tiene hilos (modelo, ejecutor de embeddings)
+                # y hacer fork con hilos activos no es seguro
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+    
+    def _submit(self, file_extension: str, fn, *args) -> "_PoolTask":
+        """
+        Enviar una tarea al pool dentro del límite global (un worker libre por
+        tarea) y del límite de su formato. El plazo de la tarea corre desde aquí:
+        con el límite global la tarea empieza a ejecutarse en cuanto se envía.
+        """
+        if self.max_workers <= 0:
+            future: Future = Future()
             try:
-                with open(file_path, 'r', encoding='latin-1') as file:
-                    text = file.read()
+                future.set_result(fn(*args))
             except Exception as e:
-                raise Exception(f"Error procesando TXT: {str(e)}")
+                future.set_exception(e)
+            return _PoolTask(future, file_extension, fn, args)
+        
+        slots = self._format_slots[file_extension]
+        self._acquire(slots)
+        self._acquire(self._worker_slots)
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except BrokenProcessPool:
+            self._worker_slots.release()
+            slots.release()
+            self._reset_pool()
+            raise
+        task = _PoolTask(future, file_extension, fn, args)
+        with self._pool_lock:
+            self._in_flight[future] = task
+        future.add_done_callback(self._release_slots)
+        return task
+    
+    def _acquire(self, semaphore: threading.BoundedSemaphore):
+        # Mientras se espera un cupo se vigila que ninguna tarea en curso se haya colgado:
+        # si nadie espera su resultado, su cupo no se liberaría nunca
+        while not semaphore.acquire(timeout=1.0):
+            self._reap_hung_tasks()
+    
+    def _release_slots(self, future: Future):
+        with self._pool_lock:
+            task = self._in_flight.pop(future, None)
+        if task is not None:
+            self._worker_slots.release()
+            self._format_slots[task.file_extension].release()
+    
+    def _reap_hung_tasks(self):
+        now = time.monotonic()
+        with self._pool_lock:
+            hung = next((task for task in self._in_flight.values()
+                         if now - task.started > self.timeout_seconds), None)
+        if hung is not None:
+            self._reset_pool(hung=hung)
+    
+    def _reset_pool(self, hung: Optional["_PoolTask"] = None):
+        """
+        Descartar el pool actual; el siguiente _submit crea uno nuevo.
+        
+        Un worker muerto (p. ej. por memoria) deja el pool inutilizable. Un parseo
+        colgado (`hung`) no termina nunca: se matan los procesos del pool y se
+        devuelven los cupos de todas sus tareas. Las demás tareas en curso quedan
+        marcadas como víctimas colaterales y quien las espera las reenvía al pool nuevo.
+        """
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+            abandoned, self._in_flight = self._in_flight, {}
+        if hung is not None:
+            hung.timed_out = True
+            for task in abandoned.values():
+                task.collateral = task is not hung
+        if pool is not None:
+            if hung is not None:
+                # ProcessPoolExecutor no expone sus procesos antes de Python 3.14
+                for process in list((getattr(pool, "_processes", None) or {}).values()):
+                    process.terminate()
+            pool.shutdown(wait=False, cancel_futures=True)
+        for task in abandoned.values():
+            self._worker_slots.release()
+            self._format_slots[task.file_extension].release()
+    
+    def _result(self, task: "_PoolTask"):
+        """Resultado de la tarea, con a lo sumo `timeout_seconds` desde que empezó a ejecutarse"""
+        while True:
+            try:
+                return task.future.result(timeout=max(0.0, task.started + self.timeout_seconds - time.monotonic()))
+            except FuturesTimeoutError:
+                logger.warning(f"Parseo sin terminar tras {self.timeout_seconds:.0f}s: se reinicia el pool de procesos")
+                self._reset_pool(hung=task)
+                raise
+            except (BrokenProcessPool, FuturesCancelledError):
+                if task.timed_out:
+                    raise FuturesTimeoutError()
+                if not task.collateral:
+                    self._reset_pool()
+                    raise
+                # El pool se reinició por otra tarea colgada: repetir esta en el pool nuevo
+                logger.info(f"Reenviando tarea de parseo {task.file_extension} tras reiniciar el pool")
+                task = self._submit(task.file_extension, task.fn, *task.args)
+    
+    def _run_single(self, fn, file_path: str, file_extension: str):
+        return self._result(self._submit(file_extension, fn, file_path))
+    
+    def _parse_segments(self, file_path: str, file_extension: str,
+                        progress: Optional[Callable[..., None]] = None) -> List[Segment]:
+        """Parsear en el pool un DOCX o TXT completo"""
+        parsers = {'.docx': ("DOCX", _parse_docx), '.txt': ("TXT", _parse_txt)}
+        format_name, parser = parsers[file_extension]
+        try:
+            segments = self._run_single(parser, file_path, file_extension)
         except Exception as e:
-            raise Exception(f"Error procesando TXT: {str(e)}")
+            raise Exception(f"Error procesando {format_name}: {str(e)}")
+        return segments
+    
+    @staticmethod
+    def _join_segments(segments: List[Segment]) -> str:
+        return "\n".join(segment.text for segment in segments).strip()
+    
+    def _process_pdf(self, file_path: str, progress: Optional[Callable[..., None]] = None) -> str:
+        """Procesar archivo PDF repartiendo rangos de páginas entre los workers"""
+        return "\n".join(self._iter_pdf_pages(file_path, progress)).strip()
+    
+    def _iter_pdf_pages(self, file_path: str, progress: Optional[Callable[..., None]] = None) -> Iterator[str]:
+        """
+        Generar el texto de cada página en orden.
         
-        return text.strip()
+        Los rangos de páginas se parsean en paralelo en el pool, pero solo se
+        mantienen `pdf_max_inflight_ranges` rangos en vuelo: si quien consume el
+        generador (chunking, embeddings) es más lento, el parseo se detiene y la
+        memoria queda acotada al tamaño de esos rangos, no al del documento.
+        """
+        tasks: Deque[_PoolTask] = deque()
+        try:
+            total_pages = self._result(self._submit('.pdf', _count_pdf_pages, file_path))
+            
+            ranges = deque(
+                (start, min(start + self.pdf_pages_per_task, total_pages))
+                for start in range(0, total_pages, self.pdf_pages_per_task)
+            )
+            pages_parsed = 0
+            while ranges or tasks:
+                while ranges and len(tasks) < self.pdf_max_inflight_ranges:
+                    start, end = ranges.popleft()
+                    tasks.append(self._submit('.pdf', _parse_pdf_pages, file_path, start, end))
+                
+                pages = self._result(tasks.popleft())
+                for page in pages:
+                    pages_parsed += 1
+                    if progress:
+                        progress(pages_total=total_pages, pages_parsed=pages_parsed)
+                    yield page
+        except FuturesTimeoutError:
+            raise Exception(f"Error procesando PDF: el parseo superó {self.timeout_seconds:.0f}s")
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            raise Exception(f"Error procesando PDF: {str(e)}")
+        finally:
+            # Si el consumidor se detiene o hay un error, no dejar trabajo en el pool
+            for task in tasks:
+                task.future.cancel()
     
-    def _process_xlsx(self, file_path: str) -> str:
+    def _process_docx(self, file_path: str, progress: Optional[Callable[..., None]] = None) -> str:
+        """Procesar archivo DOCX"""
+        return self._join_segments(self._parse_segments(file_path, '.docx', progress))
+    
+    def _process_txt(self, file_path: str, progress: Optional[Callable[..., None]] = None) -> str:
+        """Procesar archivo TXT"""
+        return self._join_segments(self._parse_segments(file_path, '.txt', progress))
+    
+    def _process_xlsx(self, file_path: str, progress: Optional[Callable[..., None]] = None) -> str:
         """Procesar archivo XLSX"""
-        excel_file = None
-        text = ""
+        return self._join_segments(list(self._iter_xlsx(file_path, progress)))
+    
+    def _iter_xlsx(self, file_path: str, progress: Optional[Callable[..., None]] = None) -> Iterator[Segment]:
+        # La lectura en streaming se hace en el hilo que consume el generador: pasarla
+        # por el pool obligaría a materializar la hoja completa para enviarla de vuelta
         try:
-            # Leer todas las hojas del archivo Excel
-            excel_file = pd.ExcelFile(file_path)
-            sheet_names = excel_file.sheet_names  # Guardar nombres de hojas antes de cerrar
-            
-            # Leer todas las hojas y procesarlas
-            for sheet_name in sheet_names:
-                # Leer la hoja usando el objeto ExcelFile ya abierto
-                df = pd.read_excel(excel_file, sheet_name=sheet_name)
-                text += f"Hoja: {sheet_name}\n"
-                text += df.to_string(index=False) + "\n\n"
-            
-            # Cerrar el archivo Excel explícitamente antes de salir
-            excel_file.close()
-            excel_file = None  # Marcar como cerrado
-            
+            yield from iter_xlsx_segments(file_path, self.xlsx_rows_per_segment, progress)
+        except GeneratorExit:
+            raise
         except Exception as e:
-            # Asegurarse de cerrar el archivo incluso si hay un error
-            if excel_file is not None:
-                try:
-                    excel_file.close()
-                except:
-                    pass
             raise Exception(f"Error procesando XLSX: {str(e)}")
-        
-        return text.strip()
     
     def extract_metadata(self, content: str, filename: str) -> Dict[str, Any]:
         """Extraer metadatos del contenido del documento"""
@@ -0,0 +1,132 @@
+"""
+Ejecutor de embeddings con micro-batching.
+
+Un hilo dedicado es el único que llama a `model.encode`. Las peticiones que
+llegan casi al mismo tiempo (dentro de una ventana corta, o hasta llenar un
+lote) se concatenan y se codifican en una sola pasada del modelo; después se
+reparte a cada llamador su parte del resultado. Así el event loop nunca queda
+bloqueado por el modelo y muchas consultas de una sola pregunta comparten
+un mismo forward.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class _EncodeRequest:
+    __slots__ = ("texts", "future")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+
+
+class EmbeddingExecutor:
+    """Agrupa peticiones de `encode` concurrentes en lotes sobre un hilo propio"""
+
+    def __init__(self, model, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Optional[_EncodeRequest]]" = queue.Queue()
+        self._closed = False
+
+        # Métricas simples para observar el efecto del batching
+        self.batches = 0
+        self.texts_encoded = 0
+
+        self._thread = threading.Thread(target=self._run, name="embedding-executor", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: Sequence[str]) -> Future:
+        """Encolar textos para codificar; devuelve un Future con un np.ndarray (n, dim)"""
+        if self._closed:
+            raise RuntimeError("El ejecutor de embeddings está cerrado")
+        request = _EncodeRequest(list(texts))
+        if not request.texts:
+            request.future.set_result(np.zeros((0, self.dimension), dtype=np.float32))
+            return request.future
+        self._queue.put(request)
+        return request.future
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        """Versión bloqueante, para usar desde hilos o procesos de trabajo"""
+        return self.submit(texts).result()
+
+    async def encode_async(self, texts: Sequence[str]) -> np.ndarray:
+        """Versión para corutinas: espera el resultado sin bloquear el event loop"""
+        return await asyncio.wrap_future(self.submit(texts))
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def close(self):
+        """Detener el hilo tras vaciar las peticiones pendientes"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join(timeout=30)
+
+    def _collect_batch(self, first: _EncodeRequest) -> List[_EncodeRequest]:
+        """Reunir peticiones hasta llenar el lote o agotar la ventana de espera"""
+        batch = [first]
+        size = len(first.texts)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                # Reinsertar la señal de cierre para procesarla tras este lote
+                self._queue.put(None)
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            # Marcar como en ejecución; descarta las peticiones canceladas mientras esperaban
+            batch = [
+                request for request in self._collect_batch(first)
+                if request.future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+            texts = [text for request in batch for text in request.texts]
+            try:
+                embeddings = np.asarray(
+                    self.model.encode(texts, batch_size=self.max_batch_size, show_progress_bar=False)
+                )
+            except Exception as e:
+                logger.error(f"Error codificando lote de {len(texts)} textos: {str(e)}")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.texts_encoded += len(texts)
+
+            offset = 0
+            for request in batch:
+                n = len(request.texts)
+                request.future.set_result(embeddings[offset:offset + n])
+                offset += n
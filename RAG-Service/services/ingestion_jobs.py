@@ -0,0 +1,331 @@
+"""
+Cola de trabajos de ingesta de documentos.
+
+/documents/upload solo guarda el archivo y registra un trabajo; un grupo de
+workers asyncio lo procesa en segundo plano como un pipeline por lotes
+(páginas -> chunks -> embeddings -> escritura en ChromaDB). El estado y el
+progreso de cada trabajo se guardan en SQLite, de modo que un reinicio no
+pierde los trabajos pendientes: al arrancar se vuelven a encolar los que no
+habían terminado, salvo los que ya agotaron sus intentos (un archivo que tumba
+el proceso quedaría reintentándose en cada arranque). El archivo subido se
+conserva en el almacén de blobs.
+"""
+
+import os
+import asyncio
+import sqlite3
+import threading
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .blob_store import hash_file
+
+logger = logging.getLogger(__name__)
+
+# Estados de un trabajo
+QUEUED = "queued"
+PARSING = "parsing"
+EMBEDDING = "embedding"
+COMPLETED = "completed"
+FAILED = "failed"
+
+FINISHED_STATUSES = (COMPLETED, FAILED)
+PROGRESS_FIELDS = ("pages_total", "pages_parsed", "chunks_total", "chunks_embedded", "chunks_written")
+
+
+class IngestionJobStore:
+    """Persistencia de los trabajos de ingesta en SQLite"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                file_extension TEXT NOT NULL,
+                project_id INTEGER,
+                document_type TEXT,
+                document_id TEXT,
+                content_hash TEXT,
+                error TEXT,
+                pages_total INTEGER NOT NULL DEFAULT 0,
+                pages_parsed INTEGER NOT NULL DEFAULT 0,
+                chunks_total INTEGER NOT NULL DEFAULT 0,
+                chunks_embedded INTEGER NOT NULL DEFAULT 0,
+                chunks_written INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs(status, created_at);
+        """)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(ingestion_jobs)")}
+        if "content_hash" not in columns:
+            self._conn.execute("ALTER TABLE ingestion_jobs ADD COLUMN content_hash TEXT")
+        self._conn.commit()
+
+    def create(self, job_id: str, filename: str, file_path: str, file_extension: str,
+               project_id: Optional[int], document_type: str) -> Dict[str, Any]:
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO ingestion_jobs (
+                    job_id, status, filename, file_path, file_extension,
+                    project_id, document_type, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (job_id, QUEUED, filename, file_path, file_extension,
+                 project_id, document_type, datetime.now().isoformat()),
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM ingestion_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def update(self, job_id: str, **fields) -> None:
+        if not fields:
+            return
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE ingestion_jobs SET {assignments} WHERE job_id = ?",
+                (*fields.values(), job_id),
+            )
+            self._conn.commit()
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        """Trabajos encolados o interrumpidos a mitad de camino, en orden de llegada"""
+        placeholders = ",".join("?" * len(FINISHED_STATUSES))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM ingestion_jobs WHERE status NOT IN ({placeholders}) ORDER BY created_at",
+                FINISHED_STATUSES,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_unfinished_by_hash(self, content_hash: str) -> int:
+        """Trabajos sin terminar cuyo archivo es el blob con ese hash"""
+        placeholders = ",".join("?" * len(FINISHED_STATUSES))
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT COUNT(*) FROM ingestion_jobs WHERE content_hash = ? AND status NOT IN ({placeholders})",
+                (content_hash, *FINISHED_STATUSES),
+            ).fetchone()
+        return row[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class IngestionJobQueue:
+    """Workers asyncio que procesan los trabajos de ingesta registrados en el store"""
+
+    def __init__(self, store: IngestionJobStore, document_processor, rag_service, workers: int = 2,
+                 blob_store=None, budget_service=None, max_attempts: int = 3):
+        self.store = store
+        # Veces que se empieza a procesar un trabajo antes de darlo por fallido
+        self.max_attempts = max_attempts
+        # Llena la tabla de presupuesto con los Excel/DOCX procesados (opcional)
+        self.budget_service = budget_service
+        # Donde queda el archivo original una vez procesado (ver services/blob_store.py)
+        self.blob_store = blob_store
+        self.document_processor = document_processor
+        self.rag_service = rag_service
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        """Arrancar los workers y reencolar lo que quedó pendiente de una ejecución anterior"""
+        self._queue = asyncio.Queue()
+        for job in self.store.unfinished():
+            if self._attempts_exhausted(job):
+                continue
+            if job["status"] != QUEUED:
+                self.store.update(job["job_id"], status=QUEUED)
+            self._queue.put_nowait(job["job_id"])
+        if self._queue.qsize():
+            logger.info(f"Reencolados {self._queue.qsize()} trabajos de ingesta pendientes")
+
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"ingestion-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, job_id: str, filename: str, file_path: str, file_extension: str,
+               project_id: Optional[int], document_type: str) -> Dict[str, Any]:
+        """Registrar un trabajo y encolarlo; el archivo ya debe estar en `file_path`"""
+        job = self.store.create(job_id, filename, file_path, file_extension, project_id, document_type)
+        self._queue.put_nowait(job_id)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                logger.error(f"Error inesperado en el trabajo de ingesta {job_id}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: str):
+        job = self.store.get(job_id)
+        if job is None or job["status"] in FINISHED_STATUSES or self._attempts_exhausted(job):
+            return
+
+        self.store.update(
+            job_id,
+            status=PARSING,
+            attempts=job["attempts"] + 1,
+            started_at=datetime.now().isoformat(),
+            error=None,
+        )
+
+        try:
+            await self._process_job(job)
+        except asyncio.CancelledError:
+            # Apagado ordenado (stop): el trabajo vuelve a la cola sin gastar un intento;
+            # solo las interrupciones sin cancelación (caída del proceso) cuentan para el límite
+            current = self.store.get(job_id)
+            if current is not None and current["status"] not in FINISHED_STATUSES:
+                self.store.update(job_id, status=QUEUED, attempts=job["attempts"])
+            raise
+
+    async def _process_job(self, job: Dict[str, Any]):
+        job_id = job["job_id"]
+        if self.blob_store is not None and not self._file_in_blob_store(job):
+            # Conservar el original bajo su SHA-256 antes de parsearlo. El hash queda
+            # en el trabajo antes de que exista el blob, para que release_blob no lo
+            # borre mientras el trabajo siga pendiente; el archivo temporal se borra
+            # solo después de registrar en el trabajo dónde quedó el blob
+            try:
+                content_hash = job["content_hash"] or await asyncio.to_thread(hash_file, job["file_path"])
+                self.store.update(job_id, content_hash=content_hash)
+                job["content_hash"] = content_hash
+                await asyncio.to_thread(self.blob_store.put_file, job["file_path"], content_hash)
+                blob_path = self.blob_store.path(content_hash)
+                if blob_path is None:
+                    raise FileNotFoundError(f"El blob {content_hash} no quedó en el almacén")
+                self.store.update(job_id, file_path=blob_path)
+                self._remove_file(job["file_path"])
+                job["file_path"] = blob_path
+            except Exception as e:
+                logger.warning(f"No se pudo guardar el original del trabajo {job_id}: {str(e)}")
+                self.store.update(job_id, content_hash=None)
+                job["content_hash"] = None
+
+        def progress(**fields):
+            # Llamado desde el hilo del parser y desde el event loop
+            self.store.update(job_id, **{k: v for k, v in fields.items() if k in PROGRESS_FIELDS or k == "status"})
+
+        try:
+            # Páginas -> chunks -> embeddings -> escritura, por lotes y con memoria acotada.
+            # El id del documento es el del trabajo: si un reinicio interrumpe la
+            # escritura, reintentar sobrescribe los mismos chunks en vez de duplicarlos
+            segments = self.document_processor.iter_segments(job["file_path"], job["file_extension"], progress)
+            document_id = await self.rag_service.add_document_stream(
+                segments,
+                metadata={
+                    "filename": job["filename"],
+                    "project_id": job["project_id"],
+                    "document_type": job["document_type"],
+                    "file_extension": job["file_extension"],
+                    "content_hash": job["content_hash"],
+                },
+                document_id=job_id,
+                progress=progress,
+            )
+
+            self.store.update(
+                job_id,
+                status=COMPLETED,
+                document_id=document_id,
+                finished_at=datetime.now().isoformat(),
+            )
+            await self._index_budget(job, document_id)
+            logger.info(f"Trabajo de ingesta {job_id} completado ({job['filename']})")
+            self._discard_upload(job)
+
+        except Exception as e:
+            logger.error(f"Trabajo de ingesta {job_id} falló: {str(e)}")
+            self._fail_job(job, str(e))
+
+    def _attempts_exhausted(self, job: Dict[str, Any]) -> bool:
+        """Marcar como fallido un trabajo que ya se interrumpió `max_attempts` veces"""
+        if job["attempts"] < self.max_attempts:
+            return False
+        logger.error(
+            f"Trabajo de ingesta {job['job_id']} descartado tras {job['attempts']} intentos ({job['filename']})"
+        )
+        self._fail_job(job, (
+            f"El procesamiento se interrumpió {job['attempts']} veces (máximo {self.max_attempts}); "
+            f"el archivo puede estar dañado o agotar la memoria del servicio"
+        ))
+        return True
+
+    def _fail_job(self, job: Dict[str, Any], error: str):
+        self.store.update(
+            job["job_id"],
+            status=FAILED,
+            error=error,
+            finished_at=datetime.now().isoformat(),
+        )
+        self._discard_upload(job)
+        if job["content_hash"]:
+            # El blob se conserva solo si otro documento ya lo referencia
+            self.rag_service.release_blob(job["content_hash"])
+
+    async def _index_budget(self, job: Dict[str, Any], document_id: str):
+        # Un archivo sin presupuesto reconocible no hace fallar la ingesta
+        if self.budget_service is None or not job["content_hash"]:
+            return
+        try:
+            await self.budget_service.index_document_budget(
+                document_id, job["project_id"], job["filename"], job["file_extension"], job["content_hash"]
+            )
+        except Exception as e:
+            logger.warning(f"No se pudo extraer el presupuesto de {job['filename']}: {str(e)}")
+
+    def _discard_upload(self, job: Dict[str, Any]):
+        # Mientras no esté en el almacén de blobs, el archivo es el temporal de la subida
+        if not self._file_in_blob_store(job):
+            self._remove_file(job["file_path"])
+
+    def _file_in_blob_store(self, job: Dict[str, Any]) -> bool:
+        return (
+            self.blob_store is not None
+            and bool(job["content_hash"])
+            and job["file_path"] == self.blob_store.path(job["content_hash"])
+        )
+
+    @staticmethod
+    def _remove_file(file_path: str):
+        try:
+            os.unlink(file_path)
+        except OSError:
+            pass
@@ -0,0 +1,228 @@
+"""
+Índice léxico (BM25) de los chunks, por proyecto.
+
+Las preguntas de presupuesto dependen de términos exactos (nombres de rubros,
+códigos como "OE2", cargos, montos) que los embeddings de MiniLM no
+distinguen bien. Este índice guarda en SQLite la frecuencia de cada término
+normalizado por chunk (se actualiza en cada add_document/delete_document) y
+arma en memoria las listas de postings de cada proyecto la primera vez que se
+consulta; las escrituras posteriores las actualizan en sitio.
+
+`hybrid_scores` combina las puntuaciones BM25 con la similitud vectorial.
+"""
+
+import os
+import re
+import json
+import math
+import sqlite3
+import threading
+import unicodedata
+import logging
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"[a-z0-9ñ]+(?:[.,'][0-9]+)*")
+# Separadores de miles (seguidos de un grupo de 3 dígitos); los decimales se conservan
+_THOUSANDS_SEPARATOR = re.compile(r"[.,'](?=\d{3}(?!\d))")
+
+# Palabras funcionales del español que no aportan a la búsqueda
+STOPWORDS = frozenset("""
+a al algo ante con contra cual cuales cuando de del desde donde durante e el ella ellas ellos en entre
+era es esa esas ese eso esos esta estas este esto estos fue ha hay la las le les lo los mas me mi muy
+ni no nos o otra otro para pero por que quien se sea ser si sin sobre son su sus tambien te tiene
+todo todos tu un una uno unos y ya cuanto cuanta cuantos cuantas como cual que
+""".split())
+
+
+def _fold(text: str) -> str:
+    """Minúsculas y sin tildes (conserva la ñ)"""
+    text = unicodedata.normalize("NFD", str(text).lower().replace("ñ", "\0"))
+    return "".join(char for char in text if unicodedata.category(char) != "Mn").replace("\0", "ñ")
+
+
+def _stem(token: str) -> str:
+    """Singular aproximado: "equipos" -> "equipo", "viajes"/"viaje" -> "viaj", "profesionales" -> "profesional" """
+    if len(token) > 3 and token.endswith("s"):
+        token = token[:-1]
+    if len(token) > 4 and token.endswith("e"):
+        token = token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Términos normalizados de un texto: sin tildes ni palabras funcionales, en
+    singular aproximado, y las cifras sin separadores ("$ 1.234.567" -> "1234567")
+    """
+    tokens = []
+    for match in _TOKEN.finditer(_fold(text)):
+        token = match.group()
+        if token[0].isdigit():
+            token = _THOUSANDS_SEPARATOR.sub("", token)
+        elif token in STOPWORDS:
+            continue
+        else:
+            token = _stem(token)
+        if len(token) > 1 or token.isdigit():
+            tokens.append(token)
+    return tokens
+
+
+class _ProjectPostings:
+    """Listas de postings en memoria de un proyecto (o de todos)"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.terms: Dict[str, Dict[str, int]] = {}
+        self.lengths: Dict[str, int] = {}
+        self.total_length = 0
+
+    def add(self, chunk_id: str, terms: Dict[str, int]):
+        self.remove(chunk_id)
+        self.terms[chunk_id] = terms
+        self.lengths[chunk_id] = sum(terms.values())
+        self.total_length += self.lengths[chunk_id]
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[chunk_id] = frequency
+
+    def remove(self, chunk_id: str):
+        terms = self.terms.pop(chunk_id, None)
+        if terms is None:
+            return
+        self.total_length -= self.lengths.pop(chunk_id)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(chunk_id, None)
+                if not posting:
+                    del self.postings[term]
+
+
+class LexicalIndex:
+    """BM25 sobre los chunks de cada proyecto, persistido en SQLite"""
+
+    def __init__(self, db_path: str, k1: float = 1.5, b: float = 0.75):
+        self.db_path = db_path
+        self.k1 = k1
+        self.b = b
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS lexical_chunks (
+                chunk_id TEXT PRIMARY KEY,
+                project_id TEXT NOT NULL,
+                document_id TEXT,
+                terms TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_lexical_project ON lexical_chunks(project_id);
+            CREATE TABLE IF NOT EXISTS lexical_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self._conn.commit()
+        # Postings cargados por proyecto ("" = todos los proyectos)
+        self._loaded: Dict[str, _ProjectPostings] = {}
+
+    def add_chunks(self, project_id, document_id: str, chunks: Iterable[Tuple[str, str]]) -> int:
+        """Indexar (chunk_id, texto); un chunk_id ya indexado se reemplaza"""
+        project = str(project_id)
+        rows = [(chunk_id, dict(Counter(tokenize(text)))) for chunk_id, text in chunks]
+        if not rows:
+            return 0
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO lexical_chunks (chunk_id, project_id, document_id, terms) VALUES (?, ?, ?, ?)",
+                    [(chunk_id, project, document_id, json.dumps(terms, ensure_ascii=False)) for chunk_id, terms in rows],
+                )
+            for key in (project, ""):
+                postings = self._loaded.get(key)
+                if postings is not None:
+                    for chunk_id, terms in rows:
+                        postings.add(chunk_id, terms)
+        return len(rows)
+
+    def delete_chunks(self, chunk_ids: Sequence[str]) -> None:
+        if not chunk_ids:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("DELETE FROM lexical_chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+            for postings in self._loaded.values():
+                for chunk_id in chunk_ids:
+                    postings.remove(chunk_id)
+
+    def search(self, query: str, project_id=None, limit: int = 20) -> List[Tuple[str, float]]:
+        """Chunks con mayor puntuación BM25 para la consulta, de mayor a menor"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        scores: Dict[str, float] = {}
+        with self._lock:
+            index = self._postings(project_id)
+            documents = len(index.terms)
+            if not documents:
+                return []
+            average_length = index.total_length / documents or 1.0
+            for term in terms:
+                posting = index.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (documents - len(posting) + 0.5) / (len(posting) + 0.5))
+                for chunk_id, frequency in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * index.lengths[chunk_id] / average_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def _postings(self, project_id) -> _ProjectPostings:
+        """Postings del proyecto, cargados desde SQLite la primera vez (con el lock tomado)"""
+        key = "" if project_id is None else str(project_id)
+        postings = self._loaded.get(key)
+        if postings is not None:
+            return postings
+        if key:
+            rows = self._conn.execute(
+                "SELECT chunk_id, terms FROM lexical_chunks WHERE project_id = ?", (key,)
+            ).fetchall()
+        else:
+            rows = self._conn.execute("SELECT chunk_id, terms FROM lexical_chunks").fetchall()
+        postings = _ProjectPostings()
+        for chunk_id, terms in rows:
+            postings.add(chunk_id, json.loads(terms))
+        self._loaded[key] = postings
+        return postings
+
+    def is_backfilled(self) -> bool:
+        """Indica si ya se indexaron los chunks existentes en ChromaDB"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM lexical_meta WHERE key = 'backfilled'").fetchone()
+        return row is not None
+
+    def mark_backfilled(self) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO lexical_meta (key, value) VALUES ('backfilled', '1')")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def hybrid_scores(similarities: Dict[str, float], bm25: Dict[str, float],
+                  lexical_weight: float) -> Dict[str, float]:
+    """
+    Puntuación híbrida por chunk: (1 - w) * similitud vectorial + w * BM25
+    normalizado por el mejor BM25 de la consulta (ambas acotadas a [0, 1]).
+    """
+    best = max(bm25.values(), default=0.0)
+    return {
+        chunk_id: (1 - lexical_weight) * min(max(similarities.get(chunk_id, 0.0), 0.0), 1.0)
+        + lexical_weight * (bm25.get(chunk_id, 0.0) / best if best > 0 else 0.0)
+        for chunk_id in set(similarities) | set(bm25)
+    }
@@ -1,20 +1,35 @@
 import os
 import json
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
+from typing import AsyncIterator, List, Dict, Any, Optional
+from openai import AsyncOpenAI
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 from dotenv import load_dotenv
 
+from .context_packer import build_context_packer
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+GEMINI_SAFETY_SETTINGS = {
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+}
+
+DEFAULT_ANSWER_SYSTEM_PROMPT = """Eres un asistente experto en análisis de proyectos y presupuestos. 
+            Tu tarea es responder preguntas basándote en la información proporcionada en el contexto.
+            Si la información no está disponible en el contexto, indica claramente que no tienes esa información.
+            Responde siempre en español y de manera clara y profesional."""
+
 class LLMService:
     """Servicio para integración con modelos de lenguaje (OpenAI o Google Gemini)"""
     
-    def __init__(self):
+    def __init__(self, context_packer=None):
         # Determinar qué proveedor usar
         self.provider = os.getenv("LLM_PROVIDER", "gemini").lower()  # Por defecto Gemini
         
@@ -26,6 +41,14 @@ class LLMService:
             raise ValueError(f"Proveedor LLM no soportado: {self.provider}. Use 'openai' o 'gemini'")
         
         self.temperature = float(os.getenv("LLM_TEMPERATURE", "0.3"))
+        
+        # Las llamadas al proveedor son asíncronas (no bloquean el event loop);
+        # el semáforo acota cuántas están en curso a la vez
+        self.max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        # Recorta el contexto de los prompts al presupuesto de tokens de cada tarea
+        self.context_packer = context_packer if context_packer is not None else build_context_packer()
     
     def _init_openai(self):
         """Inicializar OpenAI"""
@@ -33,7 +56,7 @@ class LLMService:
         if not api_key:
             raise ValueError("OPENAI_API_KEY no está configurada")
         
-        self.client = OpenAI(api_key=api_key)
+        self.client = AsyncOpenAI(api_key=api_key)
         self.model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
     
     def _init_gemini(self):
@@ -48,6 +71,20 @@ class LLMService:
         self.model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-pro-latest")
         self.model = genai.GenerativeModel(self.model_name)
     
+    async def _openai_chat(self, **kwargs):
+        """Llamada a chat.completions con concurrencia acotada"""
+        async with self._semaphore:
+            return await self.client.chat.completions.create(**kwargs)
+    
+    async def _gemini_generate(self, prompt: str, generation_config):
+        """Llamada a generate_content_async con concurrencia acotada"""
+        async with self._semaphore:
+            return await self.model.generate_content_async(
+                prompt,
+                generation_config=generation_config,
+                safety_settings=GEMINI_SAFETY_SETTINGS
+            )
+    
     async def generate_answer(self, question: str, context: str, system_prompt: Optional[str] = None) -> str:
         """
         Generar respuesta usando LLM basado en contexto
@@ -61,12 +98,7 @@ class LLMService:
             Respuesta generada por el LLM
         """
         try:
-            default_system_prompt = """Eres un asistente experto en análisis de proyectos y presupuestos. 
-            Tu tarea es responder preguntas basándote en la información proporcionada en el contexto.
-            Si la información no está disponible en el contexto, indica claramente que no tienes esa información.
-            Responde siempre en español y de manera clara y profesional."""
-            
-            system_prompt = system_prompt or default_system_prompt
+            system_prompt = system_prompt or DEFAULT_ANSWER_SYSTEM_PROMPT
             
             if self.provider == "openai":
                 return await self._generate_answer_openai(question, context, system_prompt)
@@ -76,14 +108,54 @@ class LLMService:
         except Exception as e:
             raise Exception(f"Error generando respuesta con LLM: {str(e)}")
     
-    async def _generate_answer_openai(self, question: str, context: str, system_prompt: str) -> str:
-        """Generar respuesta usando OpenAI"""
-        messages = [
+    async def stream_answer(self, question: str, context: str,
+                            system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Generar la misma respuesta que `generate_answer`, entregando el texto por
+        fragmentos a medida que el proveedor los produce.
+
+        Mantiene ocupado un cupo del semáforo de concurrencia mientras dura el stream.
+        """
+        system_prompt = system_prompt or DEFAULT_ANSWER_SYSTEM_PROMPT
+        try:
+            async with self._semaphore:
+                if self.provider == "openai":
+                    stream = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=self._openai_answer_messages(question, context, system_prompt),
+                        temperature=self.temperature,
+                        max_tokens=1000,
+                        stream=True
+                    )
+                    async for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            yield chunk.choices[0].delta.content
+                else:  # gemini
+                    response = await self.model.generate_content_async(
+                        self._gemini_answer_prompt(question, context, system_prompt),
+                        generation_config=self._gemini_answer_config(),
+                        safety_settings=GEMINI_SAFETY_SETTINGS,
+                        stream=True
+                    )
+                    async for chunk in response:
+                        # Los fragmentos bloqueados o vacíos no tienen partes de texto
+                        if chunk.parts:
+                            yield chunk.text
+        except Exception as e:
+            raise Exception(f"Error generando respuesta con LLM: {str(e)}")
+    
+    @staticmethod
+    def _openai_answer_messages(question: str, context: str, system_prompt: str) -> List[Dict[str, str]]:
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"Contexto:\n{context}\n\nPregunta: {question}\n\nRespuesta:"}
         ]
+    
+    async def _generate_answer_openai(self, question: str, context: str, system_prompt: str) -> str:
+        """Generar respuesta usando OpenAI"""
+        messages = self._openai_answer_messages(question, context, system_prompt)
         
-        response = self.client.chat.completions.create(
+        response = await self._openai_chat(
             model=self.model,
             messages=messages,
             temperature=self.temperature,
@@ -92,9 +164,9 @@ class LLMService:
         
         return response.choices[0].message.content.strip()
     
-    async def _generate_answer_gemini(self, question: str, context: str, system_prompt: str) -> str:
-        """Generar respuesta usando Google Gemini con soporte para respuestas más largas"""
-        prompt = f"""{system_prompt}
+    @staticmethod
+    def _gemini_answer_prompt(question: str, context: str, system_prompt: str) -> str:
+        return f"""{system_prompt}
 
 Contexto:
 {context}
@@ -110,27 +182,24 @@ Instrucciones adicionales:
 - No te limites a respuestas cortas; sé exhaustivo y completo
 
 Respuesta:"""
+    
+    def _gemini_answer_config(self):
+        # Aumentar significativamente max_output_tokens para respuestas más largas
+        # Gemini 1.5 Pro puede manejar hasta 8192 tokens de salida
+        max_tokens = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS", "8192"))
+        return genai.types.GenerationConfig(
+            temperature=self.temperature,
+            max_output_tokens=max_tokens,
+            top_p=0.95,  # Nucleus sampling para mejor calidad
+            top_k=40  # Diversidad en la generación
+        )
+    
+    async def _generate_answer_gemini(self, question: str, context: str, system_prompt: str) -> str:
+        """Generar respuesta usando Google Gemini con soporte para respuestas más largas"""
+        prompt = self._gemini_answer_prompt(question, context, system_prompt)
         
         try:
-            # Aumentar significativamente max_output_tokens para respuestas más largas
-            # Gemini 1.5 Pro puede manejar hasta 8192 tokens de salida
-            max_tokens = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS", "8192"))
-            
-            response = self.model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=self.temperature,
-                    max_output_tokens=max_tokens,
-                    top_p=0.95,  # Nucleus sampling para mejor calidad
-                    top_k=40  # Diversidad en la generación
-                ),
-                safety_settings={
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                }
-            )
+            response = await self._gemini_generate(prompt, self._gemini_answer_config())
             
             # Verificar si la respuesta tiene contenido válido
             if not response.parts:
@@ -161,7 +230,7 @@ Respuesta:"""
             # Preparar contexto de documentos si está disponible
             documents_context = ""
             if project_documents_context:
-                documents_context = f"\n\nInformación adicional de documentos del proyecto:\n{project_documents_context[:2000]}"
+                documents_context = f"\n\nInformación adicional de documentos del proyecto:\n{self.context_packer.fit(project_documents_context, 'budget_generation')}"
             
             # Categorías por defecto
             if not budget_categories:
@@ -253,7 +322,7 @@ Responde SOLO con el JSON, sin texto adicional."""
             {"role": "user", "content": user_prompt}
         ]
         
-        response = self.client.chat.completions.create(
+        response = await self._openai_chat(
             model=self.model,
             messages=messages,
             temperature=self.temperature,
@@ -273,21 +342,15 @@ Responde SOLO con el JSON, sin texto adicional."""
             # Aumentar max_output_tokens para presupuestos más detallados
             max_tokens = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS_BUDGET", "8192"))
             
-            response = self.model.generate_content(
+            response = await self._gemini_generate(
                 full_prompt,
-                generation_config=genai.types.GenerationConfig(
+                genai.types.GenerationConfig(
                     temperature=self.temperature,
                     max_output_tokens=max_tokens,  # Máximo para respuestas detalladas
                     top_p=0.95,
                     top_k=40,
                     response_mime_type="application/json"  # Forzar respuesta JSON
-                ),
-                safety_settings={
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                }
+                )
             )
             
             # Verificar si la respuesta tiene contenido válido
@@ -506,7 +569,7 @@ Responde SOLO con el JSON, sin texto adicional."""
             {"role": "user", "content": user_prompt}
         ]
         
-        response = self.client.chat.completions.create(
+        response = await self._openai_chat(
             model=self.model,
             messages=messages,
             temperature=self.temperature,
@@ -526,21 +589,15 @@ Responde SOLO con el JSON, sin texto adicional."""
             # Aumentar max_output_tokens para planes más detallados
             max_tokens = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS_PLAN", "8192"))
             
-            response = self.model.generate_content(
+            response = await self._gemini_generate(
                 full_prompt,
-                generation_config=genai.types.GenerationConfig(
+                genai.types.GenerationConfig(
                     temperature=self.temperature,
                     max_output_tokens=max_tokens,
                     top_p=0.95,
                     top_k=40,
                     response_mime_type="application/json"
-                ),
-                safety_settings={
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                }
+                )
             )
             
             # Verificar si la respuesta tiene contenido válido
@@ -0,0 +1,294 @@
+"""
+Parseo de cifras en formato colombiano (COP) para los libros de presupuesto.
+
+Un único conjunto de reglas para el extractor de presupuestos, la cotización
+y la extracción desde texto:
+
+- Símbolos y palabras de moneda ("$", "COP", "US$", "pesos"...) y espacios se ignoran.
+- Negativos con signo ("-1.500", "1.500-") o entre paréntesis ("(1.500)").
+- Con los dos separadores, el último es el decimal: "1.234.567,89" y
+  "1,234,567.89" valen lo mismo.
+- Un separador repetido es de miles ("1.234.567").
+- Un separador único seguido de exactamente tres dígitos ("1.500", "4,500") es
+  de miles, como se escriben los pesos; con otra cantidad de dígitos
+  ("12,5", "1234.56") es decimal. En columnas, el separador decimal se infiere
+  de las demás celdas para resolver ese caso ambiguo.
+- El apóstrofo de millones ("1'500.000") se trata como separador de miles.
+
+`parse_number` convierte una celda; `parse_number_series` una columna completa
+(pandas Series o arreglo numpy de objetos), parseando una vez cada valor
+distinto. Ambos prueban primero el formato habitual (cifra con separadores de
+miles y decimal opcional, moneda solo en los extremos) con una sola expresión
+regular; la limpieza y las reglas completas solo corren para lo que no encaja.
+"""
+
+import re
+import math
+from decimal import Decimal
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+_APOSTROPHES = re.compile(r"['’]")
+_NOISE = re.compile(r"[^\d.,()\-−]")
+_PATTERNS = {
+    # Decimal con coma, miles con punto
+    ",": re.compile(r"(?:\d{1,3}(?:\.\d{3})+|\d+),\d*|,\d+|\d{1,3}(?:\.\d{3})+|\d+"),
+    # Decimal con punto, miles con coma
+    ".": re.compile(r"(?:\d{1,3}(?:,\d{3})+|\d+)\.\d*|\.\d+|\d{1,3}(?:,\d{3})+|\d+"),
+    # Sin decimales: solo separadores de miles
+    "": re.compile(r"\d{1,3}(?:\.\d{3})+|\d{1,3}(?:,\d{3})+|\d+"),
+}
+
+
+# Formato habitual según el separador decimal de la columna (None: sin decimales):
+# grupo 1 = parte entera (solo con separadores de miles), grupo 2 = decimales
+_EDGE_NOISE = r"[^\d.,()\-−'’]*"
+_FAST = {
+    ",": re.compile(_EDGE_NOISE + r"([1-9]\d{0,2}(?:\.\d{3})+|\d+)(?:,(\d+))?" + _EDGE_NOISE),
+    ".": re.compile(_EDGE_NOISE + r"([1-9]\d{0,2}(?:,\d{3})+|\d+)(?:\.(\d+))?" + _EDGE_NOISE),
+    None: re.compile(_EDGE_NOISE + r"([1-9]\d{0,2}(?:\.\d{3})+|[1-9]\d{0,2}(?:,\d{3})+|\d+)()" + _EDGE_NOISE),
+}
+
+_THOUSANDS = {",": ".", ".": ",", "": ".,"}
+_NUMERIC_TYPES = (bool, int, float, Decimal, np.bool_, np.integer, np.floating)
+
+
+def _strip_sign(core: str):
+    negative = False
+    if len(core) >= 2 and core[0] == "(" and core[-1] == ")":
+        negative, core = True, core[1:-1]
+    if core[:1] in ("-", "−"):
+        negative, core = True, core[1:]
+    if core[-1:] in ("-", "−"):
+        negative, core = True, core[:-1]
+    return negative, core
+
+
+def _decimal_mode(core: str, decimal: Optional[str]) -> str:
+    """Separador decimal de una cifra ya limpia ("," "." o "" si es entera)"""
+    dots, commas = core.count("."), core.count(",")
+    if dots and commas:
+        return "." if core.rfind(".") > core.rfind(",") else ","
+    if not dots and not commas:
+        return ""
+    separator = "." if dots else ","
+    if dots + commas > 1:
+        return ""
+    if decimal is not None:
+        return separator if separator == decimal else ""
+    integer_part, fraction = core.split(separator)
+    if len(fraction) == 3 and 1 <= len(integer_part) <= 3 and not integer_part.startswith("0"):
+        return ""
+    return separator
+
+
+def _without_apostrophes(text: str) -> str:
+    if "'" in text or "’" in text:
+        return _APOSTROPHES.sub(".", text)
+    return text
+
+
+def _fast_number(text: str, decimal: Optional[str]) -> Optional[float]:
+    """Cifra en el formato habitual (ver _FAST), o None si la celda necesita las reglas completas"""
+    match = _FAST[decimal].fullmatch(text)
+    if match is None:
+        return None
+    integer, fraction = match.groups()
+    integer = integer.replace(".", "").replace(",", "")
+    return float(f"{integer}.{fraction}" if fraction else integer)
+
+
+def _parse_clean(text: str, decimal: Optional[str]) -> float:
+    """Cifra de un texto ya sin apóstrofos, o NaN"""
+    number = _fast_number(text, decimal)
+    if number is not None:
+        return number
+
+    core = _NOISE.sub("", text)
+    negative, core = _strip_sign(core)
+    mode = _decimal_mode(core, decimal)
+    if not _PATTERNS[mode].fullmatch(core):
+        return math.nan
+
+    for separator in _THOUSANDS[mode]:
+        core = core.replace(separator, "")
+    if mode == ",":
+        core = core.replace(",", ".")
+    number = float(core)
+    return -number if negative else number
+
+
+def _parse_text(text: str, decimal: Optional[str]) -> float:
+    """Cifra de una celda de texto, o NaN"""
+    return _parse_clean(_without_apostrophes(text), decimal)
+
+
+def _own_decimal(text: str, dots: int, commas: int) -> Optional[str]:
+    """Decimal que fija la propia cifra: con ambos separadores el último; con uno repetido, el otro"""
+    if dots and commas:
+        return "." if text.rfind(".") > text.rfind(",") else ","
+    if dots > 1:
+        return ","
+    if commas > 1:
+        return "."
+    return None
+
+
+def _single_separator_vote(text: str) -> Optional[str]:
+    if _FAST[None].fullmatch(text):
+        # Separador único seguido de tres dígitos: de miles
+        return None
+    separator = "." if "." in text else ","
+    if _FAST[separator].fullmatch(text):
+        # Cifra habitual que no es de miles: el separador es decimal
+        return separator
+    core = _strip_sign(_NOISE.sub("", text))[1]
+    return _decimal_mode(core, None) or None
+
+
+def _decimal_vote(text: str) -> Optional[str]:
+    """Separador decimal que indica una celda sin ambigüedad (None si no indica ninguno)"""
+    text = _without_apostrophes(text)
+    # La limpieza y el signo no cambian cuántos separadores hay ni su orden
+    dots, commas = text.count("."), text.count(",")
+    if dots + commas == 1:
+        return _single_separator_vote(text)
+    return _own_decimal(text, dots, commas)
+
+
+def parse_number(value: Any, default: Optional[float] = None, decimal: Optional[str] = None) -> Optional[float]:
+    """
+    Convertir una celda a float. Devuelve `default` si está vacía o no es una cifra.
+
+    `decimal` ("," o ".") fija el separador decimal cuando se conoce, por
+    ejemplo el inferido para toda la columna con `infer_decimal_separator`.
+    """
+    if type(value) is str:
+        number = _parse_text(value, decimal)
+        return default if math.isnan(number) else number
+    if value is None:
+        return default
+    if isinstance(value, _NUMERIC_TYPES):
+        number = float(value)
+        return default if math.isnan(number) else number
+    if not isinstance(value, str):
+        return default
+    number = _parse_text(value, decimal)
+    return default if math.isnan(number) else number
+
+
+def _text_cells(values: Any):
+    """(Series original, máscara de celdas de texto, textos distintos, códigos por celda de texto)"""
+    column = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    if pd.api.types.infer_dtype(column, skipna=False) == "string":
+        is_text = np.ones(len(column), dtype=bool)
+    else:
+        is_text = column.map(lambda value: isinstance(value, str)).to_numpy(dtype=bool)
+    codes, uniques = pd.factorize(column.to_numpy(dtype=object)[is_text])
+    return column, is_text, uniques, codes
+
+
+def _infer_from_uniques(uniques, codes) -> Optional[str]:
+    if len(uniques) == 0:
+        return None
+    counts = np.bincount(codes, minlength=len(uniques)).tolist()
+    votes = {",": 0, ".": 0, None: 0}
+    for text, count in zip(uniques, counts):
+        # Sin separadores (ni apóstrofo) una celda no vota
+        if "." in text or "," in text or "'" in text or "’" in text:
+            votes[_decimal_vote(text)] += count
+    return _majority(votes)
+
+
+def _majority(votes: Dict[Optional[str], int]) -> Optional[str]:
+    if votes[","] > votes["."]:
+        return ","
+    if votes["."] > votes[","]:
+        return "."
+    return None
+
+
+def _parse_inferring(uniques, codes) -> Tuple[np.ndarray, Optional[str]]:
+    """
+    Parsear los textos distintos de una columna e inferir a la vez su separador
+    decimal, en una sola pasada. Solo las cifras con un separador único dependen
+    del decimal de la columna: se completan al final, ya inferido.
+    """
+    counts = np.bincount(codes, minlength=len(uniques)).tolist()
+    votes = {",": 0, ".": 0, None: 0}
+    parsed = []
+    pending = []
+    for text, count in zip(uniques, counts):
+        text = _without_apostrophes(text)
+        dots, commas = text.count("."), text.count(",")
+        if dots + commas == 1:
+            pending.append((len(parsed), text))
+            parsed.append(math.nan)
+            votes[_single_separator_vote(text)] += count
+            continue
+        if not dots and not commas:
+            parsed.append(_parse_clean(text, None))
+            continue
+        # Con ambos separadores o uno repetido, el decimal sale de la propia cifra
+        own = _own_decimal(text, dots, commas)
+        votes[own] += count
+        parsed.append(_parse_clean(text, own))
+
+    decimal = _majority(votes)
+    for i, text in pending:
+        parsed[i] = _parse_clean(text, decimal)
+    return np.array(parsed, dtype=float), decimal
+
+
+def infer_decimal_separator(values: Any) -> Optional[str]:
+    """
+    Separador decimal más probable de una columna de texto ("," "." o None).
+
+    Votan las celdas sin ambigüedad: las que tienen ambos separadores, las que
+    repiten uno (es de miles, así que el decimal es el otro) y las que tienen
+    uno solo sin tres dígitos detrás.
+    """
+    _, _, uniques, codes = _text_cells(values)
+    return _infer_from_uniques(uniques, codes)
+
+
+def parse_number_series(values: Any, default: float = np.nan, decimal: Optional[str] = None,
+                        infer: bool = True) -> pd.Series:
+    """
+    Convertir una columna completa a float64 (`default` donde no hay cifra).
+
+    Acepta una Series o un arreglo numpy de objetos. Las columnas numéricas se
+    convierten directamente; en las de texto cada valor distinto se parsea una
+    sola vez y el resultado se reparte a las celdas. Con `infer=True` y sin
+    `decimal`, el separador decimal de los casos ambiguos se infiere de la
+    propia columna.
+    """
+    column = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    if pd.api.types.is_bool_dtype(column) or pd.api.types.is_numeric_dtype(column):
+        return column.astype(float).fillna(default)
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return pd.Series(default, index=column.index, dtype=float)
+
+    column, is_text, uniques, codes = _text_cells(column)
+    result = np.full(len(column), np.nan)
+
+    if len(uniques):
+        if decimal is None and infer:
+            parsed, decimal = _parse_inferring(uniques, codes)
+        else:
+            parsed = np.fromiter((_parse_text(text, decimal) for text in uniques), dtype=float, count=len(uniques))
+        result[is_text] = parsed[codes]
+
+    # Números (y booleanos) en columnas mixtas; fechas y otros objetos no son cifras
+    if not is_text.all():
+        objects = column.to_numpy(dtype=object)
+        numeric = ~is_text & np.fromiter(
+            (isinstance(value, _NUMERIC_TYPES) for value in objects), dtype=bool, count=len(objects)
+        )
+        if numeric.any():
+            result[numeric] = objects[numeric].astype(float)
+
+    result = pd.Series(result, index=column.index)
+    return result.fillna(default)
@@ -0,0 +1,250 @@
+"""
+Catálogo local de precios unitarios.
+
+Los ítems que se estiman se repiten entre proyectos ("Profesional
+especializado", "Computador portátil", "Tiquete aéreo nacional"...). El
+catálogo guarda en SQLite (descripción normalizada, rubro, valor unitario,
+fuente, fecha), alimentado con las estimaciones aceptadas del LLM y con los
+presupuestos extraídos de los documentos, y los indexa con los embeddings del
+modelo SentenceTransformer del proceso.
+
+Antes de pedir precios al LLM se busca cada ítem: una descripción idéntica del
+mismo rubro, o la más parecida por similitud coseno por encima del umbral, se
+valora localmente; solo los fallos van al LLM.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^a-z0-9ñ]+")
+_LEADING_NUMBER = re.compile(r"^\s*\d+[.)\-]?\s*")
+
+
+def normalize_description(text: str) -> str:
+    """Minúsculas, sin tildes (conserva la ñ) y sin signos: clave de coincidencia exacta"""
+    text = unicodedata.normalize("NFD", str(text).lower().replace("ñ", "\0"))
+    text = "".join(char for char in text if unicodedata.category(char) != "Mn").replace("\0", "ñ")
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def normalize_category(category: Optional[str]) -> str:
+    """Rubro comparable entre hojas SGR y rubros del extractor:
+    "01. Talento Humano", "Talento humano" y "TalentoHumano" -> "talentohumano"."""
+    if not category:
+        return ""
+    return normalize_description(_LEADING_NUMBER.sub("", str(category))).replace(" ", "")
+
+
+class _CatalogIndex(NamedTuple):
+    """Índice en memoria de una versión del catálogo (inmutable: se reemplaza entero)"""
+    generation: int
+    exact: Dict[Tuple[str, str], Dict[str, Any]]
+    entries: List[Dict[str, Any]]
+    categories: np.ndarray
+    matrix: Optional[np.ndarray]
+
+
+_EMPTY_INDEX = _CatalogIndex(-1, {}, [], np.zeros(0, dtype=object), None)
+
+
+class PriceCatalog:
+    """Precios unitarios conocidos con búsqueda exacta y por vecino más cercano"""
+
+    def __init__(self, db_path: str, embedder=None, similarity_threshold: float = 0.9):
+        self.db_path = db_path
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        self.lookups = 0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS price_catalog (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                descripcion_normalizada TEXT NOT NULL,
+                categoria TEXT NOT NULL,
+                descripcion TEXT NOT NULL,
+                rubro TEXT,
+                valor_unitario REAL NOT NULL,
+                fuente TEXT NOT NULL,
+                observaciones INTEGER NOT NULL DEFAULT 1,
+                actualizado_en TEXT NOT NULL,
+                embedding BLOB,
+                UNIQUE (descripcion_normalizada, categoria)
+            );
+        """)
+        self._conn.commit()
+
+        # Índice en memoria (se reconstruye tras cada escritura, en la siguiente búsqueda).
+        # Cada escritura incrementa la generación; las búsquedas toman una sola
+        # referencia al índice y no ven uno a medio reemplazar
+        self._generation = 0
+        self._index = _EMPTY_INDEX
+
+    def add_prices(self, entries: Sequence[Dict[str, Any]], fuente: str) -> int:
+        """
+        Guardar precios (descripcion, rubro, valor_unitario). Una descripción ya
+        conocida en el mismo rubro toma el valor más reciente.
+        """
+        rows: Dict[Tuple[str, str], Tuple[str, Optional[str], float]] = {}
+        for entry in entries:
+            descripcion = str(entry.get("descripcion") or "").strip()
+            valor = entry.get("valor_unitario")
+            if not descripcion or valor is None or not valor > 0:
+                continue
+            key = (normalize_description(descripcion), normalize_category(entry.get("rubro")))
+            if key[0]:
+                rows[key] = (descripcion, entry.get("rubro"), float(valor))
+        if not rows:
+            return 0
+
+        known = set(self._refresh_index().exact)
+        # Solo se codifican las descripciones nuevas
+        new_keys = [key for key in rows if key not in known]
+        vectors = self._encode([rows[key][0] for key in new_keys]) if new_keys else None
+
+        now = datetime.now().isoformat()
+        with self._lock:
+            with self._conn:
+                for position, key in enumerate(new_keys):
+                    descripcion, rubro, valor = rows[key]
+                    blob = vectors[position].tobytes() if vectors is not None else None
+                    self._conn.execute(
+                        """
+                        INSERT OR IGNORE INTO price_catalog (
+                            descripcion_normalizada, categoria, descripcion, rubro, valor_unitario,
+                            fuente, actualizado_en, embedding
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        (key[0], key[1], descripcion, rubro, valor, fuente, now, blob),
+                    )
+                self._conn.executemany(
+                    """
+                    UPDATE price_catalog
+                    SET valor_unitario = ?, fuente = ?, actualizado_en = ?, observaciones = observaciones + 1
+                    WHERE descripcion_normalizada = ? AND categoria = ?
+                    """,
+                    [(rows[key][2], fuente, now, key[0], key[1]) for key in rows if key in known],
+                )
+            self._generation += 1
+        return len(rows)
+
+    def lookup(self, items: Sequence[Tuple[str, Optional[str]]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Precio de cada (descripción, rubro), o None si no hay uno suficientemente parecido.
+
+        Primero se busca la descripción normalizada exacta; las demás se codifican
+        en un solo lote y se comparan con los precios del mismo rubro (o con todos
+        si el ítem no tiene rubro).
+        """
+        index = self._refresh_index()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        pending = []
+        for position, (descripcion, rubro) in enumerate(items):
+            entry = index.exact.get((normalize_description(descripcion), normalize_category(rubro)))
+            if entry is not None:
+                results[position] = {**entry, "similitud": 1.0}
+            else:
+                pending.append(position)
+
+        exact_hits = len(items) - len(pending)
+        semantic_hits = 0
+        if pending and index.matrix is not None and len(index.matrix):
+            queries = self._encode([str(items[position][0]) for position in pending])
+            scores = queries @ index.matrix.T
+            for row, position in enumerate(pending):
+                categoria = normalize_category(items[position][1])
+                candidate_scores = scores[row]
+                if categoria:
+                    candidate_scores = np.where(index.categories == categoria, candidate_scores, -1.0)
+                best = int(np.argmax(candidate_scores))
+                if candidate_scores[best] >= self.similarity_threshold:
+                    results[position] = {**index.entries[best], "similitud": float(candidate_scores[best])}
+                    semantic_hits += 1
+
+        with self._lock:
+            self.lookups += len(items)
+            self.exact_hits += exact_hits
+            self.semantic_hits += semantic_hits
+        return results
+
+    def _encode(self, texts: List[str]) -> Optional[np.ndarray]:
+        if self.embedder is None:
+            return None
+        vectors = np.asarray(self.embedder.encode(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+    def _refresh_index(self) -> _CatalogIndex:
+        """Índice de la última versión del catálogo, reconstruido si hubo escrituras"""
+        with self._lock:
+            if self._index.generation == self._generation:
+                return self._index
+            generation = self._generation
+            rows = self._conn.execute(
+                """
+                SELECT descripcion_normalizada, categoria, descripcion, rubro, valor_unitario,
+                       fuente, observaciones, actualizado_en, embedding
+                FROM price_catalog
+                ORDER BY id
+                """
+            ).fetchall()
+
+        exact = {}
+        entries, categories, vectors = [], [], []
+        for row in rows:
+            entry = {
+                "descripcion": row["descripcion"],
+                "rubro": row["rubro"],
+                "valor_unitario": row["valor_unitario"],
+                "fuente": row["fuente"],
+                "observaciones": row["observaciones"],
+                "actualizado_en": row["actualizado_en"],
+            }
+            exact[(row["descripcion_normalizada"], row["categoria"])] = entry
+            if row["embedding"] is not None:
+                entries.append(entry)
+                categories.append(row["categoria"])
+                vectors.append(np.frombuffer(row["embedding"], dtype=np.float32))
+
+        index = _CatalogIndex(
+            generation, exact, entries, np.array(categories, dtype=object),
+            np.vstack(vectors) if vectors else None,
+        )
+        with self._lock:
+            # Otra búsqueda pudo publicar antes un índice más reciente
+            if index.generation > self._index.generation:
+                self._index = index
+            return self._index
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM price_catalog").fetchone()[0]
+        hits = self.exact_hits + self.semantic_hits
+        return {
+            "entries": entries,
+            "similarity_threshold": self.similarity_threshold,
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "hit_rate": hits / self.lookups if self.lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,107 +1,238 @@
 import os
 import uuid
-from typing import List, Dict, Any, Optional
-try:
-    import chromadb
-    from chromadb.config import Settings
-    CHROMADB_AVAILABLE = True
-except Exception as e:
-    CHROMADB_AVAILABLE = False
-    print(f"Warning: ChromaDB not available: {e}")
-from sentence_transformers import SentenceTransformer
+import asyncio
+from itertools import islice
+from typing import List, Dict, Any, Optional, Callable, Iterable, Iterator, AsyncIterator, Tuple
 import numpy as np
 from datetime import datetime
 import logging
 
 from models.schemas import Activity, Resource, ResourceAssignment
-from .llm_service import LLMService
+from . import container
+from .answer_cache import SemanticAnswerCache
+from .cache import LRUCache
+from .context_packer import ContextCandidate
+from .lexical_index import hybrid_scores
+from .retrieval import RetrievalPostProcessor
 
 logger = logging.getLogger(__name__)
+
+NO_RELEVANT_INFO_ANSWER = "No se encontró información relevante para responder tu pregunta."
+
+
+def _take(iterator: Iterator[Any], n: int) -> List[Any]:
+    """Siguientes `n` elementos del iterador (se llama desde un hilo)"""
+    return list(islice(iterator, n))
     
 class RAGService:
     """Servicio RAG para búsqueda semántica y generación de respuestas"""
     
-    def __init__(self):
-        # Inicializar ChromaDB
-        if CHROMADB_AVAILABLE:
-            try:
-                self.chroma_client = chromadb.PersistentClient(
-                    path="./chroma_db",
-                    settings=Settings(anonymized_telemetry=False)
-                )
-                # Obtener o crear colección
-                try:
-                    self.collection = self.chroma_client.get_collection("project_documents")
-                except:
-                    self.collection = self.chroma_client.create_collection(
-                        name="project_documents",
-                        metadata={"description": "Documentos de proyectos para RAG"}
-                    )
-            except Exception as e:
-                print(f"Warning: ChromaDB initialization failed: {e}")
-                self.chroma_client = None
-                self.collection = None
-        else:
-            self.chroma_client = None
-            self.collection = None
-            print("Warning: Running without ChromaDB - vector search disabled")
+    def __init__(self, embedding_model=None, embedder=None, embedding_cache=None, document_manifest=None,
+                 chunker=None, collection=None, llm_service=None, blob_store=None,
+                 budget_store=None, context_packer=None, lexical_index=None, ingestion_job_store=None):
+        # Las dependencias pesadas se comparten a nivel de proceso (ver services/container.py);
+        # si no se inyectan, se toman del contenedor en lugar de construir copias nuevas
+        self.collection = collection if collection is not None else container.get_chroma_collection()
+        self.embedding_model = embedding_model if embedding_model is not None else container.get_embedding_model()
+        # Todas las codificaciones pasan por el ejecutor con micro-batching, fuera del event loop
+        self.embedder = embedder if embedder is not None else container.get_embedding_executor()
+        # Caché persistente de embeddings de chunks (puede ser None)
+        self.embedding_cache = embedding_cache if embedding_cache is not None else container.get_embedding_cache()
+        # Manifiesto de documentos: listado y borrado sin leer el texto de los chunks
+        self.manifest = document_manifest if document_manifest is not None else container.get_document_manifest()
+        # Archivos originales por SHA-256; el manifiesto guarda el hash de cada documento
+        self.blob_store = blob_store if blob_store is not None else container.get_blob_store()
+        # Trabajos de ingesta pendientes: sus archivos ya están en el almacén de blobs
+        self.ingestion_job_store = (
+            ingestion_job_store if ingestion_job_store is not None else container.get_ingestion_job_store()
+        )
+        # Ítems de presupuesto extraídos de los Excel/DOCX (contexto estructurado para preguntas de presupuesto)
+        self.budget_store = budget_store if budget_store is not None else container.get_budget_store()
+        # Chunker configurado (RAG_CHUNKER): por tokens del modelo y por estructura del documento
+        self.chunker = chunker if chunker is not None else container.get_chunker()
+        # Contexto de los prompts por presupuesto de tokens (fuentes por relevancia, sin solapamientos)
+        self.context_packer = context_packer if context_packer is not None else container.get_context_packer()
         
-        # Inicializar modelo de embeddings
-        self.embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+        # Servicio LLM opcional, solo si está configurado
+        self.llm_service = llm_service if llm_service is not None else container.get_llm_service()
+        self.use_llm = self.llm_service is not None
+
+        # Documentos agrupados por proyecto, cacheados bajo (proyecto, versión).
+        # add_document/delete_document incrementan la versión del proyecto, así las
+        # entradas viejas dejan de consultarse y salen por LRU; el TTL cubre cambios
+        # hechos por otro proceso sobre la misma base de ChromaDB
+        self._project_versions: Dict[str, int] = {}
+        self._project_documents_cache = LRUCache(
+            max_entries=int(os.getenv("PROJECT_DOCS_CACHE_MAX_PROJECTS", "64")),
+            ttl_seconds=float(os.getenv("PROJECT_DOCS_CACHE_TTL_SECONDS", "300")),
+        )
         
-        # Inicializar servicio LLM (opcional, solo si está configurado)
-        try:
-            self.llm_service = LLMService()
-            self.use_llm = True
-        except Exception as e:
-            # Si no hay API key configurada, usar modo sin LLM
-            self.llm_service = None
-            self.use_llm = False
-            print(f"Advertencia: LLM no disponible. Usando modo básico. Error: {str(e)}")
+        # Índice BM25 por proyecto (puede ser None): sus puntuaciones se combinan con
+        # la similitud vectorial; RAG_LEXICAL_WEIGHT=0 desactiva la búsqueda híbrida
+        self.lexical_index = lexical_index if lexical_index is not None else container.get_lexical_index()
+        self.lexical_weight = float(os.getenv("RAG_LEXICAL_WEIGHT", "0.3"))
+        
+        # Post-recuperación: k adaptativo, MMR y unión de chunks vecinos del mismo documento
+        self.retrieval_postprocessor = RetrievalPostProcessor(
+            max_chunks=int(os.getenv("RAG_MAX_CONTEXT_CHUNKS", "8")),
+            mmr_lambda=float(os.getenv("RAG_MMR_LAMBDA", "0.7")),
+            similarity_gap=float(os.getenv("RAG_SIMILARITY_GAP", "0.1")),
+            similarity_spread=float(os.getenv("RAG_SIMILARITY_SPREAD", "0.25")),
+            duplicate_similarity=float(os.getenv("RAG_DUPLICATE_SIMILARITY", "0.97")),
+        )
+        
+        # Respuestas de /query por proyecto, versión de documentos y embedding de la pregunta
+        self.answer_cache = SemanticAnswerCache(
+            max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512")),
+            ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "1800")),
+            similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95")),
+        )
+        
+        # Chunks por lote en la ingesta: acota la memoria a un lote de textos y embeddings
+        self.ingest_batch_size = int(os.getenv("INGEST_BATCH_CHUNKS", "64"))
     
-    async def add_document(self, content: str, metadata: Dict[str, Any]) -> str:
-        """Agregar un documento a la base de datos vectorial"""
+    async def add_document(self, content: str, metadata: Dict[str, Any],
+                           document_id: Optional[str] = None,
+                           progress: Optional[Callable[..., None]] = None) -> str:
+        """
+        Agregar un documento a la base de datos vectorial.
+        
+        Si se indica `document_id` la escritura es idempotente (los chunks se
+        sobrescriben). `progress` recibe el estado y los contadores
+        chunks_total/chunks_embedded/chunks_written a medida que avanza.
+        """
+        return await self.add_document_stream([content], metadata, document_id, progress)
+    
+    async def add_document_stream(self, segments: Iterable[str], metadata: Dict[str, Any],
+                                  document_id: Optional[str] = None,
+                                  progress: Optional[Callable[..., None]] = None) -> str:
+        """
+        Agregar un documento a partir de una secuencia de segmentos de texto (p. ej. páginas).
+        
+        Pipeline por lotes: segmentos -> chunks -> embeddings -> escritura en ChromaDB.
+        En memoria solo hay un lote de chunks y sus embeddings a la vez, así que el
+        consumo no crece con el tamaño del documento. `segments` (textos o
+        `Segment` con estructura) puede ser un iterador bloqueante: se consume
+        desde un hilo.
+        """
+        chunk_ids: List[str] = []
         try:
             # Generar ID único para el documento
-            document_id = str(uuid.uuid4())
-            
-            # Dividir contenido en chunks para mejor procesamiento
-            chunks = self._split_text_into_chunks(content)
-            
-            # Generar embeddings para cada chunk
-            embeddings = self.embedding_model.encode(chunks).tolist()
+            document_id = document_id or str(uuid.uuid4())
             
             # Limpiar metadatos: ChromaDB no acepta None, convertir a valores válidos
             cleaned_metadata = self._clean_metadata(metadata)
+            added_at = datetime.now().isoformat()
             
-            # Preparar metadatos para cada chunk
-            chunk_metadata = []
-            chunk_ids = []
+            # Dividir contenido en chunks para mejor procesamiento
+            chunk_iter = self.chunker.chunk(segments)
+            preview_chunks: List[str] = []
+            total_chars = 0
             
-            for i, chunk in enumerate(chunks):
-                chunk_id = f"{document_id}_chunk_{i}"
-                chunk_metadata.append({
-                    **cleaned_metadata,
-                    "chunk_index": i,
-                    "total_chunks": len(chunks),
-                    "chunk_length": len(chunk),
-                    "added_at": datetime.now().isoformat()
-                })
-                chunk_ids.append(chunk_id)
+            while True:
+                chunks = await asyncio.to_thread(_take, chunk_iter, self.ingest_batch_size)
+                if not chunks:
+                    break
+                batch = [chunk.text for chunk in chunks]
+                first_index = len(chunk_ids)
+                if progress:
+                    progress(status="embedding", chunks_total=first_index + len(batch))
+                
+                # Generar embeddings del lote (solo se codifican los que no están en caché)
+                embeddings = await self._embed_chunks(batch)
+                if progress:
+                    progress(chunks_embedded=first_index + len(batch))
+                
+                # Preparar metadatos para cada chunk
+                batch_ids = []
+                batch_metadata = []
+                for offset, chunk in enumerate(chunks):
+                    batch_ids.append(f"{document_id}_chunk_{first_index + offset}")
+                    batch_metadata.append({
+                        **cleaned_metadata,
+                        "document_id": document_id,
+                        "chunk_index": first_index + offset,
+                        "chunk_length": len(chunk.text),
+                        # Posición del chunk en el texto extraído y sección de origen
+                        "char_start": chunk.char_start,
+                        "char_end": chunk.char_end,
+                        "section_type": chunk.kind,
+                        "section": chunk.label,
+                        "added_at": added_at
+                    })
+                
+                # Agregar a ChromaDB (fuera del event loop, como el índice léxico)
+                await asyncio.to_thread(
+                    self.collection.upsert,
+                    embeddings=embeddings,
+                    documents=batch,
+                    metadatas=batch_metadata,
+                    ids=batch_ids
+                )
+                chunk_ids.extend(batch_ids)
+                if self.lexical_index is not None:
+                    await asyncio.to_thread(
+                        self.lexical_index.add_chunks,
+                        cleaned_metadata.get("project_id"), document_id, list(zip(batch_ids, batch))
+                    )
+                total_chars += sum(len(chunk) for chunk in batch)
+                if len(preview_chunks) < 2:
+                    preview_chunks.extend(batch[:2 - len(preview_chunks)])
+                self._bump_project_version(cleaned_metadata.get("project_id"))
+                if progress:
+                    progress(chunks_written=len(chunk_ids))
             
-            # Agregar a ChromaDB
-            self.collection.add(
-                embeddings=embeddings,
-                documents=chunks,
-                metadatas=chunk_metadata,
-                ids=chunk_ids
-            )
+            # Registrar en el manifiesto (preview = primeros 2 chunks, como en el listado)
+            await asyncio.to_thread(self.manifest.add, {
+                "document_id": document_id,
+                "project_id": cleaned_metadata.get("project_id"),
+                "filename": cleaned_metadata.get("filename", "unknown"),
+                "document_type": cleaned_metadata.get("document_type", ""),
+                "file_extension": cleaned_metadata.get("file_extension", ""),
+                "chunk_ids": chunk_ids,
+                "total_chunks": len(chunk_ids),
+                "total_chars": total_chars,
+                "content_preview": " ".join(preview_chunks),
+                "added_at": added_at,
+                "content_hash": cleaned_metadata.get("content_hash", ""),
+            })
             
             return document_id
             
         except Exception as e:
+            # No dejar chunks huérfanos de un documento que no quedó registrado
+            if chunk_ids:
+                try:
+                    await self._delete_chunks(chunk_ids)
+                except Exception as cleanup_error:
+                    logger.warning(f"No se pudieron eliminar chunks parciales: {str(cleanup_error)}")
             raise Exception(f"Error agregando documento: {str(e)}")
     
+    async def _embed_chunks(self, chunks: List[str]) -> List[List[float]]:
+        """Obtener embeddings de chunks consultando primero la caché persistente"""
+        if self.embedding_cache is None:
+            return (await self.embedder.encode_async(chunks)).tolist()
+
+        try:
+            cached = await asyncio.to_thread(self.embedding_cache.get_many, chunks)
+        except Exception as e:
+            logger.warning(f"Error leyendo caché de embeddings: {str(e)}")
+            cached = [None] * len(chunks)
+
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            missing_texts = [chunks[i] for i in missing]
+            encoded = await self.embedder.encode_async(missing_texts)
+            for i, vector in zip(missing, encoded):
+                cached[i] = vector
+            try:
+                await asyncio.to_thread(self.embedding_cache.put_many, missing_texts, encoded)
+            except Exception as e:
+                logger.warning(f"Error guardando en caché de embeddings: {str(e)}")
+
+        logger.info(f"Embeddings: {len(chunks) - len(missing)}/{len(chunks)} chunks servidos desde caché")
+        return [np.asarray(vector, dtype=np.float32).tolist() for vector in cached]
+    
     def _clean_metadata(self, metadata: Dict[str, Any]) -> Dict[str, Any]:
         """Limpiar metadatos para que sean compatibles con ChromaDB (no acepta None)"""
         cleaned = {}
@@ -133,77 +264,248 @@ class RAGService:
             top_k: Número de documentos a recuperar (por defecto 10 para más contexto)
         """
         try:
-            # Generar embedding para la pregunta
-            query_embedding = self.embedding_model.encode([question]).tolist()[0]
+            # Respuesta ya generada para una pregunta equivalente sobre los mismos documentos
+            query_embedding = (await self.embedder.encode_async([question]))[0].tolist()
+            scope = self._answer_scope(project_id, top_k)
+            cached = self.answer_cache.get(scope, question, query_embedding)
+            if cached is not None:
+                return {**cached, "cached": True}
             
-            # Preparar filtros si se especifica project_id
-            where_filter = None
-            if project_id is not None:
-                where_filter = {"project_id": project_id}
-            
-            # Aumentar top_k para obtener más contexto (mínimo 10, máximo 20)
-            effective_top_k = max(10, min(top_k, 20))
-            
-            # Buscar documentos similares
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=effective_top_k,
-                where=where_filter
-            )
-            
-            # Procesar resultados y filtrar por similitud mínima
-            sources = []
-            relevant_docs = []
-            min_similarity = 0.3  # Umbral mínimo de similitud
-            
-            if results['documents'] and results['documents'][0]:
-                for i, doc in enumerate(results['documents'][0]):
-                    similarity = 1 - results['distances'][0][i]  # Convertir distancia a similitud
-                    
-                    # Solo incluir documentos con similitud razonable
-                    if similarity >= min_similarity:
-                        source = {
-                            "content": doc,
-                            "metadata": results['metadatas'][0][i],
-                            "similarity": similarity
-                        }
-                        sources.append(source)
-                        relevant_docs.append(doc)
-            
-            # Si no hay documentos relevantes, intentar con umbral más bajo
-            if not relevant_docs and results['documents'] and results['documents'][0]:
-                # Usar al menos los 3 más similares
-                for i, doc in enumerate(results['documents'][0][:3]):
-                    similarity = 1 - results['distances'][0][i]
-                    source = {
-                        "content": doc,
-                        "metadata": results['metadatas'][0][i],
-                        "similarity": similarity
-                    }
-                    sources.append(source)
-                    relevant_docs.append(doc)
+            sources, tokens_saved = await self._retrieve(question, project_id, top_k, query_embedding)
             
             # Generar respuesta basada en el contexto (ahora con más documentos)
-            answer = await self._generate_answer(question, relevant_docs, project_id)
+            answer, cacheable = await self._generate_answer(question, sources, project_id)
             
-            # Calcular confianza basada en similitud promedio
-            confidence = 0.0
-            if sources:
-                confidence = sum(source["similarity"] for source in sources) / len(sources)
-            
-            return {
+            result = {
                 "answer": answer,
                 "sources": sources,
-                "confidence": confidence
+                "confidence": self._confidence(sources),
+                "tokens_saved": tokens_saved
             }
+            if cacheable:
+                self.answer_cache.set(scope, question, query_embedding, result)
+            return {**result, "cached": False}
             
         except Exception as e:
             raise Exception(f"Error en consulta: {str(e)}")
     
+    async def query_stream(self, question: str, project_id: Optional[int] = None,
+                           top_k: int = 10) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Consulta con la respuesta por partes, para /query/stream.
+
+        Emite eventos {"event", "data"} en este orden: "sources" (fuentes,
+        confianza y tokens ahorrados, en cuanto termina la recuperación), "delta" (fragmentos de la
+        respuesta a medida que el LLM los genera) y "done". Una respuesta de la
+        caché llega en un solo "delta".
+        """
+        query_embedding = (await self.embedder.encode_async([question]))[0].tolist()
+        scope = self._answer_scope(project_id, top_k)
+        cached = self.answer_cache.get(scope, question, query_embedding)
+        if cached is not None:
+            yield {"event": "sources", "data": {
+                "sources": cached["sources"], "confidence": cached["confidence"],
+                "tokens_saved": cached["tokens_saved"], "cached": True
+            }}
+            yield {"event": "delta", "data": {"text": cached["answer"]}}
+            yield {"event": "done", "data": {"confidence": cached["confidence"], "sources": len(cached["sources"]), "cached": True}}
+            return
+        
+        sources, tokens_saved = await self._retrieve(question, project_id, top_k, query_embedding)
+        confidence = self._confidence(sources)
+        yield {"event": "sources", "data": {"sources": sources, "confidence": confidence, "tokens_saved": tokens_saved, "cached": False}}
+        
+        # Solo se guardan en caché las respuestas completas (no las de respaldo por un fallo del LLM)
+        parts: List[str] = []
+        cacheable = True
+        prepared = await self._prepare_answer(question, sources, project_id)
+        if prepared is None:
+            parts.append(NO_RELEVANT_INFO_ANSWER)
+            yield {"event": "delta", "data": {"text": NO_RELEVANT_INFO_ANSWER}}
+        elif self.use_llm and self.llm_service:
+            try:
+                async for text in self.llm_service.stream_answer(
+                    question, prepared["context"], system_prompt=prepared["system_prompt"]
+                ):
+                    parts.append(text)
+                    yield {"event": "delta", "data": {"text": text}}
+            except Exception as e:
+                logger.warning(f"Error en streaming del LLM: {str(e)}")
+                cacheable = False
+                if parts:
+                    # La respuesta quedó a medias: se informa en lugar de mezclar otra respuesta
+                    yield {"event": "error", "data": {"detail": f"Error generando respuesta: {str(e)}"}}
+                else:
+                    yield {"event": "delta", "data": {"text": self._fallback_answer(question, prepared)}}
+        else:
+            fallback = self._fallback_answer(question, prepared)
+            parts.append(fallback)
+            yield {"event": "delta", "data": {"text": fallback}}
+        
+        if cacheable:
+            self.answer_cache.set(scope, question, query_embedding, {
+                "answer": "".join(parts), "sources": sources, "confidence": confidence, "tokens_saved": tokens_saved
+            })
+        yield {"event": "done", "data": {"confidence": confidence, "sources": len(sources), "cached": False}}
+    
+    async def _retrieve(self, question: str, project_id: Optional[int], top_k: int,
+                        query_embedding: List[float]) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Fuentes para la pregunta (con el embedding ya calculado), con su similitud,
+        y los tokens de entrada que la etapa de post-recuperación evitó enviar al LLM
+        """
+        # Preparar filtros si se especifica project_id
+        where_filter = None
+        if project_id is not None:
+            where_filter = {"project_id": project_id}
+        
+        # Aumentar top_k para obtener más contexto (mínimo 10, máximo 20)
+        effective_top_k = max(10, min(top_k, 20))
+        
+        # Buscar documentos similares (con sus embeddings, para MMR), sin bloquear el event loop
+        results = await asyncio.to_thread(
+            self.collection.query,
+            query_embeddings=[query_embedding],
+            n_results=effective_top_k,
+            where=where_filter,
+            include=["documents", "metadatas", "distances", "embeddings"]
+        )
+        
+        # Candidatos por id de chunk: fuente y embedding
+        candidates: Dict[str, Dict[str, Any]] = {}
+        vectors: Dict[str, Any] = {}
+        if results['documents'] and results['documents'][0]:
+            result_embeddings = results.get('embeddings')
+            for i, doc in enumerate(results['documents'][0]):
+                chunk_id = results['ids'][0][i]
+                candidates[chunk_id] = {
+                    "content": doc,
+                    "metadata": results['metadatas'][0][i],
+                    "similarity": 1 - results['distances'][0][i]  # Convertir distancia a similitud
+                }
+                if result_embeddings is not None:
+                    vectors[chunk_id] = result_embeddings[0][i]
+        
+        # Búsqueda léxica (BM25) en el mismo proyecto: términos exactos como rubros, códigos o montos
+        bm25: Dict[str, float] = {}
+        if self.lexical_index is not None and self.lexical_weight > 0:
+            await self._ensure_lexical_backfilled()
+            bm25 = dict(await asyncio.to_thread(self.lexical_index.search, question, project_id, effective_top_k))
+            missing = [chunk_id for chunk_id in bm25 if chunk_id not in candidates]
+            if missing:
+                extra = await asyncio.to_thread(
+                    self.collection.get, ids=missing, include=["documents", "metadatas", "embeddings"]
+                )
+                extra_embeddings = extra.get('embeddings')
+                for i, chunk_id in enumerate(extra['ids']):
+                    vector = extra_embeddings[i] if extra_embeddings is not None else None
+                    candidates[chunk_id] = {
+                        "content": extra['documents'][i],
+                        "metadata": extra['metadatas'][i],
+                        "similarity": self._vector_similarity(query_embedding, vector)
+                    }
+                    if vector is not None:
+                        vectors[chunk_id] = vector
+        
+        # Puntuación híbrida: similitud vectorial y BM25 normalizado
+        scores = hybrid_scores(
+            {chunk_id: candidate["similarity"] for chunk_id, candidate in candidates.items()},
+            bm25, self.lexical_weight if bm25 else 0.0
+        )
+        best_bm25 = max(bm25.values(), default=0.0)
+        ranked = sorted(candidates, key=lambda chunk_id: -scores[chunk_id])
+        
+        # Procesar resultados y filtrar por similitud mínima
+        sources = []
+        source_ids = []
+        min_similarity = 0.3  # Umbral mínimo de similitud
+        min_lexical = 0.5     # O coincidencia fuerte de términos (BM25 relativo al mejor)
+        for chunk_id in ranked:
+            lexical_score = bm25.get(chunk_id, 0.0) / best_bm25 if best_bm25 > 0 else 0.0
+            # Solo incluir documentos con similitud razonable
+            if candidates[chunk_id]["similarity"] >= min_similarity or lexical_score >= min_lexical:
+                sources.append({**candidates[chunk_id], "score": scores[chunk_id], "lexical_score": lexical_score})
+                source_ids.append(chunk_id)
+        
+        # Si no hay documentos relevantes, intentar con umbral más bajo
+        if not sources:
+            # Usar al menos los 3 mejores
+            for chunk_id in ranked[:3]:
+                lexical_score = bm25.get(chunk_id, 0.0) / best_bm25 if best_bm25 > 0 else 0.0
+                sources.append({**candidates[chunk_id], "score": scores[chunk_id], "lexical_score": lexical_score})
+                source_ids.append(chunk_id)
+        
+        embeddings = [vectors[chunk_id] for chunk_id in source_ids] if all(chunk_id in vectors for chunk_id in source_ids) else None
+        
+        # Corte adaptativo, MMR y unión de chunks vecinos
+        selected = self.retrieval_postprocessor.process(sources, embeddings=embeddings, max_chunks=top_k)
+        tokens_saved = max(
+            0,
+            sum(self.context_packer.count(source["content"]) for source in sources)
+            - sum(self.context_packer.count(source["content"]) for source in selected)
+        )
+        if sources:
+            logger.info(
+                f"Post-recuperación: {len(selected)} de {len(sources)} chunks, {tokens_saved} tokens ahorrados"
+            )
+        return selected, tokens_saved
+    
+    def _vector_similarity(self, query_embedding: List[float], vector) -> float:
+        """Similitud en la misma escala que 1 - distancia de ChromaDB (según el espacio de la colección)"""
+        if vector is None:
+            return 0.0
+        query = np.asarray(query_embedding, dtype=np.float32)
+        vector = np.asarray(vector, dtype=np.float32)
+        space = (getattr(self.collection, "metadata", None) or {}).get("hnsw:space", "l2")
+        if space == "cosine":
+            norms = float(np.linalg.norm(query) * np.linalg.norm(vector))
+            return float(query @ vector) / norms if norms else 0.0
+        if space == "ip":
+            return float(query @ vector)
+        return 1 - float(np.sum((query - vector) ** 2))
+    
+    @staticmethod
+    def _confidence(sources: List[Dict[str, Any]]) -> float:
+        """Confianza basada en similitud promedio"""
+        if not sources:
+            return 0.0
+        return sum(source["similarity"] for source in sources) / len(sources)
+    
+    def get_project_version(self, project_id: Any) -> int:
+        """Versión actual de los documentos de un proyecto (cambia en cada alta o baja)"""
+        return self._project_versions.get(str(project_id), 0)
+
+    def _bump_project_version(self, project_id: Any):
+        key = str(project_id)
+        self._project_versions[key] = self._project_versions.get(key, 0) + 1
+    
+    def mark_project_changed(self, project_id: Any):
+        """Registrar un cambio en datos del proyecto fuera de ChromaDB (p. ej. la tabla de presupuesto)"""
+        self._bump_project_version(project_id)
+    
+    def _answer_scope(self, project_id: Optional[int], top_k: int) -> Tuple[str, int, int]:
+        """Clave de la caché de respuestas: proyecto, versión de sus documentos y top_k"""
+        if project_id is None:
+            # Consultas sobre todos los proyectos: cualquier cambio de documentos las invalida
+            return "*", sum(self._project_versions.values()), top_k
+        return str(project_id), self.get_project_version(project_id), top_k
+
     async def get_project_documents(self, project_id: int) -> List[Dict[str, Any]]:
         """Obtener todos los documentos de un proyecto específico"""
+        cache_key = (str(project_id), self.get_project_version(project_id))
+        cached = self._project_documents_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        documents = await self._load_project_documents(project_id)
+        self._project_documents_cache.set(cache_key, documents)
+        return list(documents)
+
+    async def _load_project_documents(self, project_id: int) -> List[Dict[str, Any]]:
+        """Leer y agrupar por documento todos los chunks del proyecto en ChromaDB"""
         try:
-            results = self.collection.get(
+            results = await asyncio.to_thread(
+                self.collection.get,
                 where={"project_id": project_id}
             )
             
@@ -242,49 +544,159 @@ class RAGService:
         except Exception as e:
             raise Exception(f"Error obteniendo documentos del proyecto: {str(e)}")
     
-    async def delete_document(self, document_id: str):
-        """Eliminar un documento de la base de datos vectorial"""
+    async def list_project_documents(self, project_id: int) -> List[Dict[str, Any]]:
+        """Listar los documentos de un proyecto desde el manifiesto (sin texto de chunks)"""
         try:
-            # Buscar todos los chunks del documento
-            results = self.collection.get(
-                where={"filename": document_id}
-            )
+            await self._ensure_manifest_backfilled()
+            documents = []
+            for entry in self.manifest.list_project(project_id):
+                documents.append({
+                    "document_id": entry["document_id"],
+                    "filename": entry["filename"],
+                    "document_type": entry["document_type"] or "unknown",
+                    "project_id": project_id,
+                    "upload_date": entry["added_at"] or "",
+                    "total_chunks": entry["total_chunks"],
+                    "total_chars": entry["total_chars"],
+                    "content_preview": entry["content_preview"] or "",
+                    "file_extension": entry["file_extension"] or "",
+                    "content_hash": entry["content_hash"] or "",
+                })
+            return documents
+            
+        except Exception as e:
+            raise Exception(f"Error listando documentos del proyecto: {str(e)}")
+    
+    async def delete_document(self, document_id: str, project_id: Optional[int] = None):
+        """
+        Eliminar un documento de la base de datos vectorial.
+        
+        `document_id` es el id devuelto al subir el documento. Por compatibilidad
+        también se acepta el nombre de archivo; en ese caso conviene indicar
+        `project_id` para no borrar archivos homónimos de otros proyectos.
+        """
+        try:
+            await self._ensure_manifest_backfilled()
+            entries = []
+            entry = self.manifest.get(document_id)
+            if entry is not None:
+                if project_id is not None and entry["project_id"] != str(project_id):
+                    raise ValueError(f"El documento {document_id} no pertenece al proyecto {project_id}")
+                entries = [entry]
+            else:
+                entries = self.manifest.find_by_filename(document_id, project_id)
+
+            if entries:
+                chunk_ids = [chunk_id for e in entries for chunk_id in e["chunk_ids"]]
+                if chunk_ids:
+                    await self._delete_chunks(chunk_ids)
+                for e in entries:
+                    self.manifest.delete(e["document_id"])
+                    self.budget_store.delete_document(e["document_id"])
+                    self._bump_project_version(e["project_id"])
+                for content_hash in {e["content_hash"] for e in entries if e["content_hash"]}:
+                    self.release_blob(content_hash)
+                return
+
+            # Documentos que no están en el manifiesto: búsqueda por nombre de archivo
+            where: Dict[str, Any] = {"filename": document_id}
+            if project_id is not None:
+                where = {"$and": [{"filename": document_id}, {"project_id": project_id}]}
+            results = await asyncio.to_thread(self.collection.get, where=where, include=["metadatas"])
             
             if results['ids']:
                 # Eliminar todos los chunks del documento
-                self.collection.delete(ids=results['ids'])
+                await self._delete_chunks(results['ids'])
+                for project in {str(m.get('project_id')) for m in results['metadatas'] or []}:
+                    self._bump_project_version(project)
             
         except Exception as e:
             raise Exception(f"Error eliminando documento: {str(e)}")
+
+    async def _delete_chunks(self, chunk_ids: List[str]):
+        """Borrar chunks de ChromaDB y del índice léxico sin bloquear el event loop"""
+        await asyncio.to_thread(self.collection.delete, ids=chunk_ids)
+        if self.lexical_index is not None:
+            await asyncio.to_thread(self.lexical_index.delete_chunks, chunk_ids)
+
+    def get_original_file(self, content_hash: str) -> Optional[str]:
+        """Ruta del archivo original guardado con ese hash (None si no está disponible)"""
+        if not content_hash or self.blob_store is None:
+            return None
+        return self.blob_store.path(content_hash)
+
+    def release_blob(self, content_hash: str):
+        """Eliminar el archivo original si ya ningún documento ni trabajo de ingesta pendiente lo referencia"""
+        if not content_hash or self.blob_store is None:
+            return
+        if self.manifest.count_by_hash(content_hash) > 0:
+            return
+        # Un trabajo en cola o en curso con el mismo contenido lee el archivo desde el blob.
+        # Los trabajos registran su hash antes de escribir el blob, y la comprobación y el
+        # borrado se hacen sin ceder el event loop: un blob recién escrito nunca queda sin referencia
+        if self.ingestion_job_store.count_unfinished_by_hash(content_hash) > 0:
+            return
+        self.blob_store.delete(content_hash)
+
+    async def _ensure_manifest_backfilled(self):
+        """Importar una sola vez al manifiesto los documentos cargados antes de que existiera"""
+        if self.manifest.is_backfilled():
+            return
+        try:
+            await asyncio.to_thread(self._backfill_manifest)
+        except Exception as e:
+            logger.warning(f"No se pudo reconstruir el manifiesto de documentos: {str(e)}")
+
+    def _backfill_manifest(self):
+        results = self.collection.get(include=["metadatas", "documents"])
+        groups: Dict[str, Dict[str, Any]] = {}
+        for chunk_id, metadata, text in zip(results['ids'], results['metadatas'] or [], results['documents'] or []):
+            metadata = metadata or {}
+            # Los ids de chunk tienen la forma "<document_id>_chunk_<i>"
+            document_id = metadata.get('document_id') or chunk_id.rsplit("_chunk_", 1)[0]
+            group = groups.setdefault(document_id, {
+                "document_id": document_id,
+                "project_id": metadata.get('project_id', -1),
+                "filename": metadata.get('filename', 'unknown'),
+                "document_type": metadata.get('document_type', ''),
+                "file_extension": metadata.get('file_extension', ''),
+                "added_at": metadata.get('added_at', ''),
+                "chunks": [],
+            })
+            group["chunks"].append((metadata.get('chunk_index', 0), chunk_id, text or ""))
+
+        for group in groups.values():
+            chunks = sorted(group.pop("chunks"))
+            self.manifest.add({
+                **group,
+                "chunk_ids": [chunk_id for _, chunk_id, _ in chunks],
+                "total_chunks": len(chunks),
+                "total_chars": sum(len(text) for _, _, text in chunks),
+                "content_preview": " ".join(text for _, _, text in chunks[:2]),
+            })
+        self.manifest.mark_backfilled()
+        logger.info(f"Manifiesto reconstruido con {len(groups)} documentos existentes")
     
-    def _split_text_into_chunks(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """Dividir texto en chunks para procesamiento"""
-        if len(text) <= chunk_size:
-            return [text]
-        
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = start + chunk_size
-            
-            # Intentar dividir en un punto lógico (final de oración)
-            if end < len(text):
-                # Buscar el último punto, exclamación o interrogación
-                for i in range(end, max(start + chunk_size // 2, end - 100), -1):
-                    if text[i] in '.!?':
-                        end = i + 1
-                        break
-            
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            start = end - overlap
-            if start >= len(text):
-                break
-        
-        return chunks
+    async def _ensure_lexical_backfilled(self):
+        """Indexar una sola vez en el índice léxico los chunks cargados antes de que existiera"""
+        if self.lexical_index.is_backfilled():
+            return
+        try:
+            await asyncio.to_thread(self._backfill_lexical_index)
+        except Exception as e:
+            logger.warning(f"No se pudo reconstruir el índice léxico: {str(e)}")
+
+    def _backfill_lexical_index(self):
+        results = self.collection.get(include=["metadatas", "documents"])
+        groups: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+        for chunk_id, metadata, text in zip(results['ids'], results['metadatas'] or [], results['documents'] or []):
+            metadata = metadata or {}
+            document_id = metadata.get('document_id') or chunk_id.rsplit("_chunk_", 1)[0]
+            groups.setdefault((metadata.get('project_id', -1), document_id), []).append((chunk_id, text or ""))
+        for (project_id, document_id), chunks in groups.items():
+            self.lexical_index.add_chunks(project_id, document_id, chunks)
+        self.lexical_index.mark_backfilled()
+        logger.info(f"Índice léxico reconstruido con {len(results['ids'])} chunks existentes")
     
     async def plan_resources(
         self,
@@ -443,20 +855,37 @@ class RAGService:
             "confidence": float(coverage_ratio),
         }
 
-    async def _generate_answer(self, question: str, context_docs: List[str], project_id: Optional[int] = None) -> str:
+    async def _prepare_answer(self, question: str, sources: List[Dict[str, Any]],
+                              project_id: Optional[int] = None) -> Optional[Dict[str, str]]:
         """
-        Generar respuesta basada en el contexto de los documentos con mejoras para respuestas más completas
+        Contexto y prompt del sistema para responder la pregunta, o None si no hay
+        información relevante. Lo comparten la respuesta completa y la respuesta en streaming.
         
         Args:
             question: Pregunta del usuario
-            context_docs: Lista de documentos relevantes recuperados
+            sources: Fuentes recuperadas (texto, metadatos y similitud)
             project_id: ID del proyecto (opcional, para obtener contexto adicional)
         """
-        if not context_docs:
-            return "No se encontró información relevante para responder tu pregunta."
+        # Para preguntas de presupuesto, los totales por rubro salen de la tabla de presupuesto
+        budget_context = ""
+        if project_id is not None and self._is_budget_question(question):
+            try:
+                budget_context = await asyncio.to_thread(self._budget_table_context, project_id)
+            except Exception as e:
+                logger.warning(f"No se pudo consultar la tabla de presupuesto: {str(e)}")
+        
+        if not sources and not budget_context:
+            return None
         
-        # Combinar contexto con mejor organización
-        # Agrupar documentos relacionados y ordenar por relevancia
+        # Fuentes por relevancia, sin solapamientos, dentro del presupuesto de tokens
+        packed = self.context_packer.pack(
+            [
+                ContextCandidate(source["content"], source["similarity"], self._source_key(source), position)
+                for position, source in enumerate(sources)
+            ],
+            "answer",
+        )
+        context_docs = packed.texts
         context = "\n\n--- Documento {0} ---\n{1}".format(
             "1", context_docs[0]
         ) if len(context_docs) == 1 else "\n\n".join(
@@ -469,18 +898,22 @@ class RAGService:
             try:
                 project_docs = await self.get_project_documents(project_id)
                 if project_docs:
-                    # Agregar información general del proyecto
-                    project_summary = " ".join([
-                        " ".join([chunk["content"] for chunk in doc["chunks"][:2]])
-                        for doc in project_docs[:2]  # Primeros 2 documentos
-                    ])
+                    # Agregar información general del proyecto: los primeros chunks de los
+                    # 2 primeros documentos que no estén ya entre las fuentes recuperadas
+                    candidates = [
+                        ContextCandidate(chunk["content"], source=doc["filename"])
+                        for doc in project_docs[:2] for chunk in doc["chunks"][:2]
+                        if chunk["content"] not in context_docs
+                    ]
+                    summary = self.context_packer.pack(candidates, "answer_project")
+                    project_summary = " ".join(summary.texts)
                     if project_summary and len(project_summary) > 100:
-                        additional_context = f"\n\n--- Contexto adicional del proyecto ---\n{project_summary[:1500]}"
+                        additional_context = f"\n\n--- Contexto adicional del proyecto ---\n{project_summary}"
             except Exception as e:
                 logger.warning(f"No se pudo obtener contexto adicional del proyecto: {str(e)}")
         
         # Combinar todo el contexto
-        full_context = context + additional_context
+        full_context = "\n\n".join(part for part in (budget_context, context + additional_context) if part)
 
         # Detectar tipo de pregunta y construir prompt especializado
         system_prompt = None
@@ -522,7 +955,7 @@ FORMATO DE RESPUESTA:
 - Si un elemento importante no aparece en el contexto, menciona brevemente: "En los documentos proporcionados no se encontró información explícita sobre X".
 - Proporciona ejemplos y detalles específicos cuando estén disponibles en el contexto.
 """
-        elif "presupuesto" in q_lower or "costo" in q_lower or "presupuest" in q_lower:
+        elif self._is_budget_question(question):
             system_prompt = """
 Eres un experto en análisis de presupuestos de proyectos de investigación e innovación.
 Debes proporcionar respuestas COMPLETAS y DETALLADAS sobre presupuestos, costos y recursos financieros.
@@ -563,21 +996,75 @@ INSTRUCCIONES:
 - Sé exhaustivo: no omitas información relevante que pueda ayudar a responder la pregunta completamente.
 """
 
+        return {"context": full_context, "system_prompt": system_prompt, "budget_context": budget_context}
+    
+    async def _generate_answer(self, question: str, sources: List[Dict[str, Any]],
+                               project_id: Optional[int] = None) -> Tuple[str, bool]:
+        """
+        Generar respuesta basada en el contexto de los documentos con mejoras para respuestas más completas.
+        
+        Devuelve la respuesta y si puede guardarse en caché (no, si es la de respaldo por un fallo del LLM).
+        
+        Args:
+            question: Pregunta del usuario
+            sources: Fuentes recuperadas (texto, metadatos y similitud)
+            project_id: ID del proyecto (opcional, para obtener contexto adicional)
+        """
+        prepared = await self._prepare_answer(question, sources, project_id)
+        if prepared is None:
+            return NO_RELEVANT_INFO_ANSWER, True
+        
         # Usar LLM si está disponible
         if self.use_llm and self.llm_service:
             try:
-                return await self.llm_service.generate_answer(
+                answer = await self.llm_service.generate_answer(
                     question,
-                    full_context,
-                    system_prompt=system_prompt,
+                    prepared["context"],
+                    system_prompt=prepared["system_prompt"],
                 )
+                return answer, True
             except Exception as e:
                 # Si falla el LLM, usar método básico como fallback
                 print(f"Error usando LLM, usando método básico: {str(e)}")
-                return self._generate_basic_answer(question, full_context)
+                return self._fallback_answer(question, prepared), False
         else:
             # Método básico sin LLM
-            return self._generate_basic_answer(question, full_context)
+            return self._fallback_answer(question, prepared), True
+    
+    def _fallback_answer(self, question: str, prepared: Dict[str, str]) -> str:
+        """Respuesta sin LLM: la tabla de presupuesto o un extracto del contexto"""
+        return prepared["budget_context"] or self._generate_basic_answer(question, prepared["context"])
+    
+    @staticmethod
+    def _source_key(source: Dict[str, Any]) -> str:
+        """Documento de origen de una fuente (el solapamiento entre chunks se quita por documento)"""
+        metadata = source.get("metadata") or {}
+        return str(metadata.get("document_id") or metadata.get("filename") or "")
+    
+    @staticmethod
+    def _is_budget_question(question: str) -> bool:
+        q_lower = question.lower()
+        return "presupuest" in q_lower or "costo" in q_lower
+    
+    def _budget_table_context(self, project_id: int, items_per_rubro: int = 5) -> str:
+        """Totales por rubro y principales ítems del proyecto, desde la tabla de presupuesto"""
+        totals = self.budget_store.rubro_totals(project_id)
+        if not totals:
+            return ""
+        
+        lines = ["--- Presupuesto estructurado del proyecto (ítems extraídos de los archivos) ---"]
+        for rubro in totals:
+            line = f"- {rubro['rubro']}: ${rubro['total']:,.0f} en {rubro['items']} ítems"
+            if rubro["items_without_budget"]:
+                line += f" ({rubro['items_without_budget']} sin valor)"
+            lines.append(line)
+            for item in self.budget_store.top_items(project_id, rubro["rubro"], items_per_rubro):
+                lines.append(
+                    f"  • {item['nombre']}: {item['cantidad'] or 1:g} x ${item['valor_unitario'] or 0:,.0f}"
+                    f" = ${item['total']:,.0f} ({item['filename']}, {item['source_sheet']} fila {item['source_row']})"
+                )
+        lines.append(f"Total presupuestado: ${sum(rubro['total'] for rubro in totals):,.0f}")
+        return "\n".join(lines)
     
     def _generate_basic_answer(self, question: str, context: str) -> str:
         """Generar respuesta básica sin LLM (fallback)"""
@@ -0,0 +1,128 @@
+"""
+Post-procesamiento de los chunks recuperados antes de armar el contexto.
+
+La búsqueda en ChromaDB devuelve los chunks más parecidos a la pregunta y
+muchos son casi duplicados: chunks vecinos que comparten 200 caracteres o el
+mismo anexo subido dos veces. Con los embeddings que devuelve la misma
+consulta, esta etapa (sobre la puntuación "score" de cada fuente, la híbrida
+vectorial + BM25, o su similitud si no la tiene):
+
+1. corta la curva de similitud donde cae bruscamente (k adaptativo);
+2. elige por relevancia marginal máxima (MMR): relevancia para la pregunta
+   menos parecido con lo ya elegido, descartando los casi duplicados;
+3. une en un solo fragmento los chunks consecutivos de un mismo documento.
+"""
+
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .context_packer import overlap_length
+
+
+class RetrievalPostProcessor:
+    """Menos chunks y más diversos para el contexto del LLM"""
+
+    def __init__(self, max_chunks: int = 8, mmr_lambda: float = 0.7, similarity_gap: float = 0.1,
+                 similarity_spread: float = 0.25, duplicate_similarity: float = 0.97, min_chunks: int = 3):
+        self.max_chunks = max_chunks
+        # Peso de la relevancia frente a la diversidad en MMR (1.0 = solo relevancia)
+        self.mmr_lambda = mmr_lambda
+        # Corte adaptativo: caída entre similitudes consecutivas y distancia máxima a la mejor
+        self.similarity_gap = similarity_gap
+        self.similarity_spread = similarity_spread
+        # Parecido entre chunks a partir del cual se consideran el mismo contenido
+        self.duplicate_similarity = duplicate_similarity
+        self.min_chunks = min_chunks
+
+    def process(self, sources: Sequence[Dict[str, Any]], embeddings: Optional[Sequence[Sequence[float]]] = None,
+                max_chunks: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Fuentes ({"content", "metadata", "similarity", "score"}) seleccionadas y
+        unidas, ordenadas por relevancia. Sin embeddings se omite MMR y solo se
+        quitan los textos repetidos.
+        """
+        if not sources:
+            return []
+        limit = min(max_chunks or self.max_chunks, self.max_chunks)
+        relevance = [_relevance(source) for source in sources]
+        order = sorted(range(len(sources)), key=lambda i: -relevance[i])
+        order = self._adaptive_cutoff(order, [relevance[i] for i in order])
+
+        if embeddings is not None and len(embeddings) == len(sources):
+            selected = self._mmr(order, np.asarray([relevance[i] for i in order], dtype=np.float32),
+                                 np.asarray(embeddings, dtype=np.float32), limit)
+        else:
+            selected, seen = [], set()
+            for i in order:
+                if sources[i]["content"] not in seen and len(selected) < limit:
+                    seen.add(sources[i]["content"])
+                    selected.append(i)
+
+        merged = self._merge_adjacent([sources[i] for i in selected])
+        return sorted(merged, key=lambda source: -_relevance(source))
+
+    def _adaptive_cutoff(self, order: List[int], similarities: List[float]) -> List[int]:
+        """Cortar en la primera caída brusca de la curva o lejos de la mejor similitud"""
+        if not similarities:
+            return order
+        floor = similarities[0] - self.similarity_spread
+        for position in range(self.min_chunks, len(similarities)):
+            if (similarities[position - 1] - similarities[position] >= self.similarity_gap
+                    or similarities[position] < floor):
+                return order[:position]
+        return order
+
+    def _mmr(self, order: List[int], relevance: np.ndarray, embeddings: np.ndarray, limit: int) -> List[int]:
+        vectors = _normalize(embeddings[order])
+        redundancy = np.full(len(order), -1.0, dtype=np.float32)
+        available = np.ones(len(order), dtype=bool)
+        selected: List[int] = []
+        while len(selected) < limit and available.any():
+            scores = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * redundancy
+            best = int(np.argmax(np.where(available, scores, -np.inf)))
+            selected.append(order[best])
+            available[best] = False
+            redundancy = np.maximum(redundancy, vectors @ vectors[best])
+            # Casi duplicados de lo ya elegido (el mismo anexo subido dos veces)
+            available &= redundancy < self.duplicate_similarity
+        return selected
+
+    @staticmethod
+    def _merge_adjacent(sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Unir chunks con chunk_index consecutivo del mismo documento, sin repetir el solapamiento"""
+        def document_key(source):
+            metadata = source.get("metadata") or {}
+            return str(metadata.get("document_id") or metadata.get("filename") or "")
+
+        indexed = [source for source in sources if "chunk_index" in (source.get("metadata") or {})]
+        merged = [source for source in sources if "chunk_index" not in (source.get("metadata") or {})]
+        indexed.sort(key=lambda source: (document_key(source), source["metadata"]["chunk_index"]))
+
+        current, last_index = None, None
+        for source in indexed:
+            index = source["metadata"]["chunk_index"]
+            if current is not None and document_key(source) == document_key(current) and index == last_index + 1:
+                text = source["content"]
+                overlap = overlap_length(current["content"], text, 400)
+                current["content"] = current["content"] + ("" if overlap else "\n") + text[overlap:]
+                for key in ("similarity", "score", "lexical_score"):
+                    if key in source:
+                        current[key] = max(current.get(key, source[key]), source[key])
+                current["metadata"]["merged_chunks"] += 1
+                if "char_end" in source["metadata"]:
+                    current["metadata"]["char_end"] = source["metadata"]["char_end"]
+            else:
+                current = {**source, "metadata": {**source["metadata"], "merged_chunks": 1}}
+                merged.append(current)
+            last_index = index
+        return merged
+
+
+def _relevance(source: Dict[str, Any]) -> float:
+    return source.get("score", source["similarity"])
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
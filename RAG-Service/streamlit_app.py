@@ -1,6 +1,7 @@
 import os
 import json
-from typing import Dict, Any, List, Optional
+import time
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from datetime import datetime
 
 import requests
@@ -59,6 +60,26 @@ def call_rag_api(
         return None
 
 
+def stream_rag_api(path: str, json_body: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Llamar a un endpoint server-sent events del servicio RAG y entregar (evento, datos) al llegar."""
+    url = f"{get_base_url().rstrip('/')}{path}"
+    try:
+        with requests.post(url, json=json_body, stream=True, timeout=300) as resp:
+            if resp.status_code >= 400:
+                st.error(f"Error {resp.status_code} llamando a {path}: {resp.text}")
+                return
+            event = "message"
+            # chunk_size=None: procesar cada fragmento apenas llega, sin esperar a llenar un buffer
+            for raw_line in resp.iter_lines(chunk_size=None):
+                line = raw_line.decode("utf-8")
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    yield event, json.loads(line[len("data:"):].strip())
+    except requests.RequestException as e:
+        st.error(f"No se pudo conectar con el servicio RAG en {url}: {e}")
+
+
 def ui_header():
     st.set_page_config(
         page_title="RAG Budget Dashboard",
@@ -121,24 +142,41 @@ def tab_query(project_id_default: int):
         if project_id > 0:
             payload["project_id"] = project_id
 
-        with st.spinner("Consultando servicio RAG..."):
-            result = call_rag_api("POST", "/query", json_body=payload)
+        # La respuesta llega por partes: primero las fuentes y luego el texto a medida que se genera
+        st.markdown("#### 🧾 Respuesta generada")
+        answer_box = st.empty()
+        answer_box.info("Consultando servicio RAG...")
+        result: Optional[Dict[str, Any]] = None
+        answer = ""
+        for event, data in stream_rag_api("/query/stream", payload):
+            if event == "sources":
+                result = data
+                answer_box.info(f"{len(data.get('sources', []))} fuentes encontradas. Generando respuesta...")
+            elif event == "delta":
+                answer += data.get("text", "")
+                answer_box.markdown(answer + "▌")
+            elif event == "done" and result is not None:
+                result["confidence"] = data.get("confidence", result.get("confidence", 0.0))
+            elif event == "error":
+                st.error(data.get("detail", "Error en consulta."))
 
         if not result:
+            answer_box.empty()
             return
-
-        # Mostrar respuesta principal
-        st.markdown("#### 🧾 Respuesta generada")
-        st.write(result.get("answer", "Sin respuesta."))
+        answer_box.markdown(answer or "Sin respuesta.")
+        if result.get("cached"):
+            st.caption("♻️ Respuesta reutilizada de una pregunta equivalente (caché de respuestas).")
 
         # Métricas básicas
         st.markdown("#### 📊 Métricas de la consulta")
-        col_m1, col_m2 = st.columns(2)
+        col_m1, col_m2, col_m3 = st.columns(3)
         with col_m1:
             st.metric("Confianza promedio", f"{result.get('confidence', 0.0):.2f}")
         with col_m2:
             n_sources = len(result.get("sources", []))
             st.metric("Número de fuentes", n_sources)
+        with col_m3:
+            st.metric("Tokens ahorrados", result.get("tokens_saved", 0))
 
         # Tabla de fuentes + gráfico de similitud
         sources = result.get("sources", [])
@@ -202,12 +240,32 @@ def tab_documents(project_id_default: int):
         if project_id > 0:
             params["project_id"] = project_id
 
-        with st.spinner("Subiendo y procesando documento..."):
+        with st.spinner("Subiendo documento..."):
             result = call_rag_api("POST", "/documents/upload", params=params, files=files)
 
-        if result:
-            st.success("Documento procesado exitosamente.")
-            st.json(result)
+        if result and result.get("job_id"):
+            # La ingesta corre en segundo plano: consultar el trabajo hasta que termine
+            progress_bar = st.progress(0.0, text="Procesando documento...")
+            job = result
+            while job and job.get("status") not in ("completed", "failed"):
+                time.sleep(1)
+                job = call_rag_api("GET", f"/jobs/{result['job_id']}")
+                if job:
+                    done = job.get("chunks_written", 0)
+                    total = job.get("chunks_total", 0) or 1
+                    progress_bar.progress(
+                        min(done / total, 1.0),
+                        text=(
+                            f"{job.get('status')}: páginas {job.get('pages_parsed', 0)}/{job.get('pages_total', 0)}, "
+                            f"chunks embebidos {job.get('chunks_embedded', 0)}/{job.get('chunks_total', 0)}"
+                        ),
+                    )
+
+            if job and job.get("status") == "completed":
+                st.success("Documento procesado exitosamente.")
+            elif job:
+                st.error(f"Error procesando documento: {job.get('error')}")
+            st.json(job or result)
 
     st.markdown("---")
     st.markdown("### 📚 Documentos del proyecto")
@@ -496,6 +554,11 @@ def tab_cotizacion():
                 step=0.1,
                 help="Tasa de IVA a aplicar (por defecto 19%)"
             ) / 100.0  # Convertir a decimal
+            incluir_narrativa = st.checkbox(
+                "Incluir justificación (LLM)",
+                value=True,
+                help="Agrega un párrafo de justificación bajo la tabla; desmárcalo para una respuesta más rápida"
+            )
         
         submitted = st.form_submit_button("Generar Cotización", type="primary")
     
@@ -507,7 +570,8 @@ def tab_cotizacion():
         
         params = {
             "incluir_iva": incluir_iva,
-            "tasa_iva": tasa_iva
+            "tasa_iva": tasa_iva,
+            "incluir_narrativa": incluir_narrativa
         }
         
         with st.spinner("Generando cotización (esto puede tardar unos segundos)..."):
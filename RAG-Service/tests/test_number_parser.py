@@ -0,0 +1,77 @@
+"""
+Pruebas de services/number_parser.py.
+
+Las propiedades de ida y vuelta usan el generador de cifras del benchmark
+(benchmarks/bench_number_parser.py): formatear un valor conocido en cada estilo
+de las hojas de presupuesto y volver a parsearlo debe devolver el mismo valor,
+celda a celda y por columnas.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.bench_number_parser import generate_column
+from services.number_parser import infer_decimal_separator, parse_number, parse_number_series
+
+STYLES = ["co", "us", "plain", "apostrophe"]
+
+
+@pytest.mark.parametrize("style", STYLES)
+@pytest.mark.parametrize("seed", range(50))
+def test_round_trip_por_columna(style, seed):
+    texts, truth = generate_column(50, style, seed)
+    parsed = parse_number_series(texts).to_numpy()
+    assert np.allclose(parsed, truth), [
+        (text, value, expected) for text, value, expected in zip(texts, parsed, truth) if not math.isclose(value, expected)
+    ][:5]
+
+
+@pytest.mark.parametrize("style", STYLES)
+@pytest.mark.parametrize("seed", range(50))
+def test_celda_y_columna_coinciden(style, seed):
+    texts, _ = generate_column(50, style, seed)
+    decimal = infer_decimal_separator(texts)
+    by_cell = np.array([parse_number(text, np.nan, decimal) for text in texts])
+    by_column = parse_number_series(texts).to_numpy()
+    assert np.array_equal(by_cell, by_column, equal_nan=True)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("$ 1.234.567", 1234567.0),
+    ("1.234.567,89", 1234567.89),
+    ("1,234,567.89", 1234567.89),
+    ("COP 3.000.000", 3000000.0),
+    ("1'500.000", 1500000.0),
+    ("(1.500)", -1500.0),
+    ("1.500-", -1500.0),
+    ("-1.500", -1500.0),
+    ("4,500", 4500.0),
+    ("12,5", 12.5),
+    ("1234.56", 1234.56),
+    ("0.500", 0.5),
+])
+def test_parse_number_formatos(text, expected):
+    assert parse_number(text) == expected
+
+
+@pytest.mark.parametrize("value", [None, "", "N/A", "$", "1.2.3,4,5", float("nan")])
+def test_parse_number_sin_cifra_devuelve_default(value):
+    assert parse_number(value, default=-1) == -1
+
+
+def test_separador_inferido_resuelve_casos_ambiguos():
+    # "1.500" sola es de miles; en una columna con decimales con punto es 1.5
+    column = ["1.500", "2.25", "3.75"]
+    assert infer_decimal_separator(column) == "."
+    assert parse_number_series(column).tolist() == [1.5, 2.25, 3.75]
+    assert parse_number_series(["1.500", "2.000.000"]).tolist() == [1500.0, 2000000.0]
+
+
+def test_columna_mixta_conserva_indice_y_default():
+    column = pd.Series(["$ 1.000", 2500, None, "sin valor", True], index=[10, 11, 12, 13, 14], dtype=object)
+    parsed = parse_number_series(column, default=0.0)
+    assert parsed.index.tolist() == [10, 11, 12, 13, 14]
+    assert parsed.tolist() == [1000.0, 2500.0, 0.0, 0.0, 1.0]